@@ -6,6 +6,7 @@ Optimized, Organized, and Simplified for high-performance trading analytics.
 import os
 import asyncio
 import logging
+import queue
 import httpx
 import pandas as pd
 import io
@@ -14,6 +15,7 @@ from datetime import datetime
 from typing import Any, Optional, List
 from contextlib import asynccontextmanager
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
 from urllib.parse import unquote
 import re
 
@@ -82,6 +84,14 @@ def validate_sql(sql: str):
 # ==================== INITIALIZATION ====================
 
 dictConfig(LOGGING_CONFIG)
+
+# Callers only enqueue records; the configured console/file handlers write them on a listener thread
+_root_logger = logging.getLogger()
+_log_queue = queue.SimpleQueue()
+log_listener = QueueListener(_log_queue, *_root_logger.handlers, respect_handler_level=True)
+_root_logger.handlers = [QueueHandler(_log_queue)]
+log_listener.start()
+
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
@@ -120,9 +130,17 @@ async def lifespan(app: FastAPI):
     logger.info("Shutting down ProTrade Terminal...")
     try:
         await options_manager.stop()
+        data_engine.stop_flush_worker()
         data_engine.flush_tick_buffer()
+        await tv_api.close()
+        await bot.execution.flush_trades_async()
+        from symmetry_engine.database import WriteSession
+        WriteSession.remove()
+        await bot.alert_manager.close()
     except Exception as e:
         logger.error(f"Shutdown error: {e}")
+    # Drain queued log records before the process exits
+    log_listener.stop()
 
 fastapi_app = FastAPI(title="ProTrade Enhanced API", lifespan=lifespan)
 sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', ping_timeout=60, ping_interval=25)
@@ -875,7 +893,7 @@ async def get_symmetry_signals():
     session = get_session()
     try:
         signals = session.query(Signal).order_by(Signal.timestamp.desc()).limit(100).all()
-        return [{"id": s.id, "timestamp": s.timestamp, "index": s.index_name, "side": s.side, "price": s.index_price, "score": s.confluence_score, "details": s.details} for s in signals]
+        return [{"id": s.id, "timestamp": s.timestamp, "index": s.index_name, "side": s.side, "price": s.index_price, "score": s.confluence_score, "ce_key": s.ce_key, "pe_key": s.pe_key, "details": s.details} for s in signals]
     finally:
         session.close()
 
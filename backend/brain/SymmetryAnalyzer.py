@@ -5,6 +5,65 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+__all__ = ['SymmetryAnalyzer']
+
+CANDLE_FIELDS = ('o', 'h', 'l', 'c', 'v')
+
+
+def _candle_columns(candles, suffix):
+    """
+    Converts candles ([ts, o, h, l, c, v] rows or an (N, 6) ndarray) into
+    a column frame in a single C-level pass, with fields suffixed per stream.
+    OHLC is held as float32 (ample for rupee prices) to halve the bytes the
+    scan streams through; ts stays int64 and volume float64, since index and
+    option volumes exceed float32's exact integer range. Emitted signal
+    prices are rounded back to 2 decimals.
+    """
+    arr = candles if isinstance(candles, np.ndarray) else np.asarray(candles, dtype=np.float64)
+    columns = {'ts': arr[:, 0].astype(np.int64)}
+    for j, field in enumerate(CANDLE_FIELDS, start=1):
+        columns[f'{field}{suffix}'] = arr[:, j].astype(np.float64 if field == 'v' else np.float32)
+    return pd.DataFrame(columns, copy=False)
+
+
+def _lag(arr, k):
+    """Returns arr delayed by k bars (NaN-padded), i.e. _lag(a, k)[i] == a[i-k]."""
+    out = np.empty_like(arr)
+    out[:k] = np.nan
+    out[k:] = arr[:-k]
+    return out
+
+
+def _streak(mask, n):
+    """True where mask held on each of the last n bars."""
+    out = mask.copy()
+    for k in range(1, n):
+        out[k:] &= mask[:-k]
+    out[:n - 1] = False
+    return out
+
+
+def _flags(**checks):
+    """Builds a signal's details dict from the confluence checks that passed."""
+    return {name: True for name, passed in checks.items() if passed}
+
+
+def _writer_panic(oi_data, ts_arr, field):
+    """Per-bar writer panic (OI change < -100); assumed when there is no OI feed."""
+    if not oi_data:
+        return np.ones(len(ts_arr), dtype=bool)
+    empty = {}
+    return np.fromiter((oi_data.get(t, empty).get(field, 0) < -100 for t in ts_arr.tolist()),
+                       dtype=bool, count=len(ts_arr))
+
+
+def _velocity(arr, lookback=3):
+    """Vectorized calculate_relative_velocity: fractional change over lookback bars."""
+    past = _lag(arr, lookback)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(past > 0, (arr - past) / past, 0)
+
+
 class SymmetryAnalyzer:
     """
     Implements the Triple-Stream Symmetry & Panic Strategy (inspired by MaheshUmale/ENGINE).
@@ -32,6 +91,36 @@ class SymmetryAnalyzer:
         df['tr'] = df[['h-l', 'h-pc', 'l-pc']].max(axis=1)
         return df['tr'].tail(window).mean()
 
+    def swing_types(self, combined, window=15):
+        """
+        Vectorized identify_swing over every bar of the combined frame.
+        Returns an int8 array: +1 where bar i confirms a High wall at i-3,
+        -1 for a Low wall, 0 otherwise.
+        """
+        h = combined['h_idx'].to_numpy()
+        l = combined['l_idx'].to_numpy()
+        pc = _lag(combined['c_idx'].to_numpy(), 1)
+
+        # ATR(14) of the index, same true range as calculate_atr
+        tr = pd.DataFrame({'hl': h - l, 'hpc': np.abs(h - pc), 'lpc': np.abs(l - pc)}).max(axis=1)
+        atr = tr.rolling(14).mean().to_numpy()
+        atr_threshold = np.where(atr > 0, atr * 1.5, 5.0)
+
+        current_high = pd.Series(h).rolling(window).max().to_numpy()
+        current_low = pd.Series(l).rolling(window).min().to_numpy()
+        window_start_price = _lag(combined['o_idx'].to_numpy(), window - 1)
+        significant = ~((np.abs(current_high - window_start_price) < atr_threshold) &
+                        (np.abs(current_low - window_start_price) < atr_threshold))
+
+        h1, h2, h3 = _lag(h, 1), _lag(h, 2), _lag(h, 3)
+        l1, l2, l3 = _lag(l, 1), _lag(l, 2), _lag(l, 3)
+        is_high = significant & (h3 == current_high) & (h2 < h3) & (h1 < h2) & (h < h1)
+        is_low = significant & (l3 == current_low) & (l2 > l3) & (l1 > l2) & (l > l1)
+
+        types = np.where(is_high, 1, np.where(is_low, -1, 0)).astype(np.int8)
+        types[:window - 1] = 0
+        return types
+
     def identify_swing(self, subset_df):
         if len(subset_df) < 15: return None
 
@@ -193,136 +282,139 @@ class SymmetryAnalyzer:
         """
         Executes the Comprehensive Squeeze strategy.
         """
-        if not idx_candles or not ce_candles or not pe_candles:
+        if any(c is None or len(c) == 0 for c in (idx_candles, ce_candles, pe_candles)):
             return []
 
-        idx_df = pd.DataFrame(idx_candles, columns=['ts', 'o', 'h', 'l', 'c', 'v'])
-        ce_df = pd.DataFrame(ce_candles, columns=['ts', 'o', 'h', 'l', 'c', 'v'])
-        pe_df = pd.DataFrame(pe_candles, columns=['ts', 'o', 'h', 'l', 'c', 'v'])
-
-        combined = pd.merge(idx_df, ce_df, on='ts', suffixes=('_idx', '_ce'))
-        combined = pd.merge(combined, pe_df, on='ts')
-        combined.rename(columns={'o': 'o_pe', 'h': 'h_pe', 'l': 'l_pe', 'c': 'c_pe', 'v': 'v_pe'}, inplace=True)
+        combined = pd.merge(_candle_columns(idx_candles, '_idx'), _candle_columns(ce_candles, '_ce'), on='ts')
+        combined = pd.merge(combined, _candle_columns(pe_candles, '_pe'), on='ts')
         combined.sort_values('ts', inplace=True)
 
         signals = []
         seen_timestamps = set()
 
-        for i in range(self.swing_window, len(combined)):
+        # Rolling 20-bar index volume average, computed once for both triggers
+        v_idx = combined['v_idx'].to_numpy()
+        vol_ma = combined['v_idx'].rolling(20).mean().fillna(0).to_numpy()
+        # Per-underlying constants, resolved once instead of per bar
+        is_nifty = "NIFTY" in self.underlying
+        exhaustion_pct = 0.015 if "BANK" in self.underlying else 0.006
+        # DYNAMIC: Higher volume requirement for NIFTY to ensure Win Rate
+        bull_vol_mult = 1.8 if is_nifty else 1.1
+        # TIGHTENED FOR NIFTY
+        bull_req_score = 5 if is_nifty else 4
+        bear_req_score = 5 if is_nifty else 3
+        refs = self.reference_levels
+        log_refs = logger.isEnabledFor(logging.INFO)
+
+        # Per-bar lookbacks precomputed from lagged column arrays
+        ts_arr = combined['ts'].to_numpy()
+        c_idx = combined['c_idx'].to_numpy()
+        c_ce = combined['c_ce'].to_numpy()
+        c_pe = combined['c_pe'].to_numpy()
+        idx_vel_arr, ce_vel_arr, pe_vel_arr = _velocity(c_idx), _velocity(c_ce), _velocity(c_pe)
+        green3_ce = _streak(c_ce > combined['o_ce'].to_numpy(), 3)
+        green3_pe = _streak(c_pe > combined['o_pe'].to_numpy(), 3)
+        ce_panic = _writer_panic(oi_data, ts_arr, 'ce_oi_chg')
+        pe_panic = _writer_panic(oi_data, ts_arr, 'pe_oi_chg')
+
+        # Swings only ever set references, so nothing can fire before the
+        # first one: skip straight to it unless a reference carried over.
+        swing_type = self.swing_types(combined)
+        h_idx = combined['h_idx'].to_numpy()
+        l_idx = combined['l_idx'].to_numpy()
+        start = self.swing_window
+        if not (refs.get('High') or refs.get('Low')):
+            pending = np.flatnonzero(swing_type[start:])
+            if len(pending) == 0:
+                return signals
+            start += int(pending[0])
+
+        for i in range(start, len(combined)):
             subset = combined.iloc[:i+1]
-            current = combined.iloc[i]
-            ts = int(current['ts'])
-
-            swing = self.identify_swing(subset)
-            if swing:
-                l_type = swing['type']
-                peak_data = swing['data']
-                self.reference_levels[l_type] = {
-                    'index_price': float(peak_data['h_idx'] if l_type == 'High' else peak_data['l_idx']),
-                    'ce_price': float(peak_data['c_ce']),
-                    'pe_price': float(peak_data['c_pe']),
+            ts = int(ts_arr[i])
+            idx_vel, ce_vel, pe_vel = idx_vel_arr[i], ce_vel_arr[i], pe_vel_arr[i]
+
+            if swing_type[i]:
+                l_type = 'High' if swing_type[i] > 0 else 'Low'
+                peak = i - 3
+                refs[l_type] = {
+                    'index_price': float(h_idx[peak] if l_type == 'High' else l_idx[peak]),
+                    'ce_price': float(c_ce[peak]),
+                    'pe_price': float(c_pe[peak]),
                     'type': l_type,
-                    'time': int(peak_data['ts'])
+                    'time': int(ts_arr[peak])
                 }
+                if log_refs:
+                    logger.info("New Reference %s set at %s: Index=%s", l_type, refs[l_type]['time'], refs[l_type]['index_price'])
+
+            ref_high = refs['High']
+            ref_low = refs['Low']
+
+            # Time & Exhaustion Filters (shared by both triggers)
+            dt_utc = datetime.fromtimestamp(ts)
+            # Prime trading: IST 10:00 - 11:30 and 13:30 - 15:00
+            is_morning = (dt_utc.hour == 4 and dt_utc.minute >= 30) or (dt_utc.hour == 5) or (dt_utc.hour == 6 and dt_utc.minute <= 0)
+            is_afternoon = (dt_utc.hour == 8) or (dt_utc.hour == 9 and dt_utc.minute <= 30)
+            if not (is_morning or is_afternoon): continue
+            if self.is_exhausted(subset, threshold_pct=exhaustion_pct): continue
 
-            ref_high = self.reference_levels.get('High')
-            ref_low = self.reference_levels.get('Low')
+            avg_vol = vol_ma[i]
 
             # --- Bullish Trigger (Call Buy) ---
             if ref_high:
-                score = 0
-                details = {}
-
                 # 0. Volume Confirmation (Surge > 1.2x MA)
-                avg_vol = self.calculate_avg_volume(subset, period=20)
-                # DYNAMIC: Higher volume requirement for NIFTY to ensure Win Rate
-                vol_mult = 1.8 if "NIFTY" in self.underlying else 1.1
-                vol_surge = current['v_idx'] > (avg_vol * vol_mult) if avg_vol > 0 else False
-                if vol_surge:
-                    score += 1
-                    details['volume_confirmation'] = True
+                vol_surge = v_idx[i] > (avg_vol * bull_vol_mult) if avg_vol > 0 else False
 
                 # 0.1 Trend Filter (5m EMA proxy via 20-period EMA on 1m chart)
                 ema_val = self.calculate_ema(subset, period=20)
                 ema_long = self.calculate_ema(subset, period=50) # Extra trend filter
-                trend_ok = (current['c_idx'] > ema_val) and (current['c_idx'] > ema_long) if ema_val > 0 else True
-                if trend_ok:
-                    score += 1
-                    details['trend_confirmation'] = True
-
-                # 0.2 Time & Exhaustion Filters
-                dt_utc = datetime.fromtimestamp(ts)
-                # Prime trading: IST 10:00 - 11:30 and 13:30 - 15:00
-                is_morning = (dt_utc.hour == 4 and dt_utc.minute >= 30) or (dt_utc.hour == 5) or (dt_utc.hour == 6 and dt_utc.minute <= 0)
-                is_afternoon = (dt_utc.hour == 8) or (dt_utc.hour == 9 and dt_utc.minute <= 30)
-                if not (is_morning or is_afternoon): continue
-
-                if self.is_exhausted(subset, threshold_pct=0.015 if "BANK" in self.underlying else 0.006): continue
-                if self.is_exhausted(subset, threshold_pct=0.015 if "BANK" in self.underlying else 0.006): continue
+                trend_ok = (c_idx[i] > ema_val) and (c_idx[i] > ema_long) if ema_val > 0 else True
 
                 # 1. Absorption Filter
-                is_absorption = current['c_idx'] >= ref_high['index_price'] and current['c_ce'] <= ref_high['ce_price']
+                is_absorption = c_idx[i] >= ref_high['index_price'] and c_ce[i] <= ref_high['ce_price']
 
                 # 2. Relative Velocity (Tick-Stream Anticipation)
-                idx_vel, ce_vel, pe_vel = self.calculate_relative_velocity(subset, lookback=3)
                 # RELAXED: 1.1x Velocity confirmation
-                if ce_vel > (idx_vel * 0.5 * 1.1) and ce_vel > 0:
-                    details['relative_velocity_high'] = True
-                    score += 1
+                velocity_high = ce_vel > (idx_vel * 0.5 * 1.1) and ce_vel > 0
 
                 # 2.1 Candle Color Confirmation (Last 3 candles must be green)
-                if len(subset) >= 3:
-                    if subset.iloc[-1]['c_ce'] > subset.iloc[-1]['o_ce'] and \
-                       subset.iloc[-2]['c_ce'] > subset.iloc[-2]['o_ce'] and \
-                       subset.iloc[-3]['c_ce'] > subset.iloc[-3]['o_ce']:
-                        score += 1
-                        details['color_confirmation'] = True
+                color_ok = green3_ce[i]
 
                 # 3. Symmetry of Panic (Opposing Option / Victim making fresh lows)
-                pe_fresh_low = current['c_pe'] < ref_high['pe_price'] and pe_vel < 0
-                if pe_fresh_low:
-                    details['pe_victim_breakdown'] = True
-                    score += 1
+                pe_fresh_low = c_pe[i] < ref_high['pe_price'] and pe_vel < 0
 
                 # 4. PCR Momentum Check
-                pcr_mom = self.calculate_pcr_momentum(pcr_data, ts)
-                if pcr_mom == 1:
-                    score += 1
-                    details['pcr_momentum'] = True
+                pcr_ok = self.calculate_pcr_momentum(pcr_data, ts) == 1
 
                 # 5. Void Check
-                has_void = self.check_void_above(current['c_idx'], 'UP', option_chain)
-                if has_void:
-                    score += 1
-                    details['void_present'] = True
+                has_void = self.check_void_above(c_idx[i], 'UP', option_chain)
 
                 # 6. Shallow Pullback flag
-                if self.is_shallow_pullback(subset, active_side='CE'):
-                    details['shallow_pullback'] = True
-                    score += 1
+                shallow = self.is_shallow_pullback(subset, active_side='CE')
 
                 # 7. Writer Panic (Negative OI Delta)
-                ce_oi_delta = 0
-                if oi_data and ts in oi_data:
-                    ce_oi_delta = oi_data[ts].get('ce_oi_chg', 0)
+                writer_panic = bool(ce_panic[i])
 
-                writer_panic = True if (not oi_data or ce_oi_delta < -100) else False
-                if writer_panic:
-                    details['writer_panic'] = True
-                    score += 2
+                # Branchless confluence score (writer panic carries double weight)
+                score = (int(vol_surge) + int(trend_ok) + int(velocity_high) + int(color_ok) + int(pe_fresh_low)
+                         + int(pcr_ok) + int(has_void) + int(shallow) + 2 * int(writer_panic))
 
                 # 8. The Trigger: 
                 if not is_absorption and not self.is_late_to_party(subset, 'CE'):
-                    if pe_fresh_low and current['c_ce'] > (ref_high['ce_price'] * 1.02) and writer_panic:
-                        if current['c_idx'] >= ref_high['index_price'] * 0.9995:
+                    if pe_fresh_low and c_ce[i] > (ref_high['ce_price'] * 1.02) and writer_panic:
+                        if c_idx[i] >= ref_high['index_price'] * 0.9995:
                             cooldown_passed = all(ts - s.get('time', 0) > 900 for s in signals[-3:])
-                            # TIGHTENED FOR NIFTY
-                            req_score = 5 if "NIFTY" in self.underlying else 4
-                            if score >= req_score and cooldown_passed and ts not in seen_timestamps:
-                                entry_price = float(current['c_ce'])
+                            if score >= bull_req_score and cooldown_passed and ts not in seen_timestamps:
+                                entry_price = round(float(c_ce[i]), 2)
                                 # Dynamic TP: 2.0 RR target
                                 sl_buffer = (entry_price * 0.05) + 1.0 # Give it a bit more room
                                 sl = entry_price - sl_buffer
+                                details = _flags(
+                                    volume_confirmation=vol_surge, trend_confirmation=trend_ok,
+                                    relative_velocity_high=velocity_high, color_confirmation=color_ok,
+                                    pe_victim_breakdown=pe_fresh_low, pcr_momentum=pcr_ok,
+                                    void_present=has_void, shallow_pullback=shallow, writer_panic=writer_panic
+                                )
                                 signals.append({
                                     'time': ts, 'type': 'BUY_CE', 'score': score, 'price': entry_price, 'sl': float(sl),
                                     'tp': entry_price + (sl_buffer * 2.5),
@@ -331,97 +423,57 @@ class SymmetryAnalyzer:
                                 seen_timestamps.add(ts)
 
             # --- Bearish Trigger (Put Buy) ---
-            if ref_low and self.underlying == "NSE:BANKNIFTY":
-                # Special logic for Banknifty Bearish
-                pass
-
             if ref_low:
-                score = 0
-                details = {}
-
                 # 0. Volume Confirmation
-                avg_vol = self.calculate_avg_volume(subset, period=20)
-                vol_surge = current['v_idx'] > (avg_vol * 1.05) if avg_vol > 0 else False
-                if vol_surge:
-                    score += 1
-                    details['volume_confirmation'] = True
+                vol_surge = v_idx[i] > (avg_vol * 1.05) if avg_vol > 0 else False
 
                 # 0.1 Trend Filter
                 ema_val = self.calculate_ema(subset, period=20)
                 ema_long = self.calculate_ema(subset, period=50)
-                trend_ok = (current['c_idx'] < ema_val) and (current['c_idx'] < ema_long) if ema_val > 0 else True
-                if trend_ok:
-                    score += 1
-                    details['trend_confirmation'] = True
-
-                # 0.2 Time & Exhaustion
-                dt_utc = datetime.fromtimestamp(ts)
-                is_morning = (dt_utc.hour == 4 and dt_utc.minute >= 30) or (dt_utc.hour == 5) or (dt_utc.hour == 6 and dt_utc.minute <= 0)
-                is_afternoon = (dt_utc.hour == 8) or (dt_utc.hour == 9 and dt_utc.minute <= 30)
-                if not (is_morning or is_afternoon): continue
-
-                if self.is_exhausted(subset, threshold_pct=0.015 if "BANK" in self.underlying else 0.006): continue
+                trend_ok = (c_idx[i] < ema_val) and (c_idx[i] < ema_long) if ema_val > 0 else True
 
                 # 1. Absorption Filter
-                is_absorption = current['c_idx'] <= ref_low['index_price'] and current['c_pe'] <= ref_low['pe_price']
+                is_absorption = c_idx[i] <= ref_low['index_price'] and c_pe[i] <= ref_low['pe_price']
 
                 # 2. Relative Velocity
-                idx_vel, ce_vel, pe_vel = self.calculate_relative_velocity(subset, lookback=3)
-                if pe_vel > abs(idx_vel) * 0.5 * 1.1 and pe_vel > 0:
-                    details['relative_velocity_high'] = True
-                    score += 1
+                velocity_high = pe_vel > abs(idx_vel) * 0.5 * 1.1 and pe_vel > 0
 
                 # 2.1 Candle Color
-                if len(subset) >= 3:
-                    if subset.iloc[-1]['c_pe'] > subset.iloc[-1]['o_pe'] and \
-                       subset.iloc[-2]['c_pe'] > subset.iloc[-2]['o_pe'] and \
-                       subset.iloc[-3]['c_pe'] > subset.iloc[-3]['o_pe']:
-                        score += 1
-                        details['color_confirmation'] = True
+                color_ok = green3_pe[i]
 
                 # 3. Symmetry of Panic
-                ce_fresh_low = current['c_ce'] < ref_low['ce_price'] and ce_vel < 0
-                if ce_fresh_low:
-                    details['ce_victim_breakdown'] = True
-                    score += 1
+                ce_fresh_low = c_ce[i] < ref_low['ce_price'] and ce_vel < 0
 
                 # 4. PCR Momentum Check
-                pcr_mom = self.calculate_pcr_momentum(pcr_data, ts)
-                if pcr_mom == -1:
-                    score += 1
-                    details['pcr_momentum'] = True
+                pcr_ok = self.calculate_pcr_momentum(pcr_data, ts) == -1
 
                 # 5. Void Check
-                has_void = self.check_void_above(current['c_idx'], 'DOWN', option_chain)
-                if has_void:
-                    score += 1
-                    details['void_present'] = True
+                has_void = self.check_void_above(c_idx[i], 'DOWN', option_chain)
 
                 # 6. Shallow Pullback flag
-                if self.is_shallow_pullback(subset, active_side='PE'):
-                    details['shallow_pullback'] = True
-                    score += 1
+                shallow = self.is_shallow_pullback(subset, active_side='PE')
 
                 # 7. Writer Panic
-                pe_oi_delta = 0
-                if oi_data and ts in oi_data:
-                    pe_oi_delta = oi_data[ts].get('pe_oi_chg', 0)
+                writer_panic = bool(pe_panic[i])
 
-                writer_panic = True if (not oi_data or pe_oi_delta < -100) else False
-                if writer_panic:
-                    details['writer_panic'] = True
-                    score += 2
+                score = (int(vol_surge) + int(trend_ok) + int(velocity_high) + int(color_ok) + int(ce_fresh_low)
+                         + int(pcr_ok) + int(has_void) + int(shallow) + 2 * int(writer_panic))
 
                 # 8. The Trigger: 
                 if not is_absorption and not self.is_late_to_party(subset, 'PE'):
-                    if ce_fresh_low and current['c_pe'] > (ref_low['pe_price'] * 1.02) and writer_panic:
-                        if current['c_idx'] <= ref_low['index_price'] * 1.0005:
+                    if ce_fresh_low and c_pe[i] > (ref_low['pe_price'] * 1.02) and writer_panic:
+                        if c_idx[i] <= ref_low['index_price'] * 1.0005:
                             cooldown_passed = all(ts - s.get('time', 0) > 900 for s in signals[-3:])
-                            req_score = 5 if "NIFTY" in self.underlying else 3
-                            if score >= req_score and cooldown_passed and ts not in seen_timestamps:
-                                entry_price = float(current['c_pe'])
+                            if score >= bear_req_score and cooldown_passed and ts not in seen_timestamps:
+                                entry_price = round(float(c_pe[i]), 2)
                                 sl_buffer = (entry_price * 0.05) + 1.0
                                 sl = entry_price - sl_buffer
+                                details = _flags(
+                                    volume_confirmation=vol_surge, trend_confirmation=trend_ok,
+                                    relative_velocity_high=velocity_high, color_confirmation=color_ok,
+                                    ce_victim_breakdown=ce_fresh_low, pcr_momentum=pcr_ok,
+                                    void_present=has_void, shallow_pullback=shallow, writer_panic=writer_panic
+                                )
                                 signals.append({
                                     'time': ts, 'type': 'BUY_PE', 'score': score, 'price': entry_price, 'sl': float(sl),
                                     'tp': entry_price + (sl_buffer * 2.5),
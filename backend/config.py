@@ -32,6 +32,12 @@ LOGGING_CONFIG = {
             "level": "DEBUG"
         }
     },
+    "loggers": {
+        # Trade entries/exits and state recovery are INFO; keep them in the log file
+        "symmetry_engine": {
+            "level": "INFO"
+        }
+    },
     "root": {
         "level": "WARNING",
         "handlers": ["console", "file"]
@@ -128,6 +134,9 @@ except Exception as e:
 
 TV_STUDY_ID = os.getenv("TV_STUDY_ID", "USER:f9c7fa68b382417ba34df4122c632dcf")
 
+# Candle cache shared by all workers (Optional, e.g. redis://localhost:6379/0)
+CANDLE_CACHE_REDIS_URL = os.getenv("CANDLE_CACHE_REDIS_URL", "")
+
 # Database Configuration
 DATABASE_CONFIG = {
     "path": "data/protrade.db",
@@ -188,7 +197,8 @@ UI_CONFIG = {
     "default_underlying": "NSE:NIFTY",
     "refresh_interval_seconds": 5,
     "chart_history_days": 30,
-    "max_strikes_displayed": 50
+    "max_strikes_displayed": 50,
+    "binary_chart_updates": False  # Send chart_update as msgpack binary frames (requires msgpack)
 }
 
 # ==============================================================================
@@ -7,27 +7,57 @@ import json
 import logging
 import threading
 import time
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Dict, Any, List, Optional, Union
-from db.local_db import db, LocalDBJSONEncoder
+from typing import Dict, Any, List, Optional, Tuple, Union
+import numpy as np
+from db.local_db import db, to_json_native
 from core.symbol_mapper import symbol_mapper
 from core.utils import safe_int, safe_float
 from core.provider_registry import live_stream_registry
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _json_loads(message: Union[str, bytes]) -> Any:
+    """Parses a feed message; orjson takes str and bytes directly, stdlib covers NaN/Infinity tokens."""
+    if orjson:
+        try:
+            return orjson.loads(message)
+        except ValueError:
+            pass
+    return json.loads(message)
 
 logger = logging.getLogger(__name__)
 
 # Configuration
 try:
-    from config import INITIAL_INSTRUMENTS, UPSTOX_INDEX_MAP
+    from config import INITIAL_INSTRUMENTS
 except ImportError:
     INITIAL_INSTRUMENTS = ["NSE:NIFTY"]
-    UPSTOX_INDEX_MAP = {}
+try:
+    from config import UI_CONFIG
+except ImportError:
+    UI_CONFIG = {}
+
+# chart_update carries large ohlcv arrays; msgpack frames are roughly half the size of JSON text
+BINARY_CHART_UPDATES = bool(msgpack) and UI_CONFIG.get("binary_chart_updates", False)
 
 socketio_instance = None
 main_event_loop = None
 latest_total_volumes = {}
 # Track subscribers per (instrumentKey, interval)
 room_subscribers = {} # (instrumentKey, interval) -> set of sids
+# Secondary index over room_subscribers for O(1) per-tick lookups
+subs_by_ik = {} # instrumentKey -> {interval: set of sids}
+primary_interval_cache = {} # instrumentKey -> smallest active interval (str)
+# Guards subscription mutations only; tick-path readers use the immutable snapshots in subs_by_ik
+subscription_lock = threading.RLock()
 internal_tick_callbacks = []
 
 def register_tick_callback(callback):
@@ -36,73 +66,114 @@ def register_tick_callback(callback):
 
 def get_primary_interval(instrument_key: str) -> str:
     """Find the smallest active interval for an instrument to act as the primary tick source."""
-    instrument_key = instrument_key.upper()
-    active = []
-    for (ik, interval) in room_subscribers.keys():
-        if ik == instrument_key:
-            if interval.isdigit():
-                active.append(int(interval))
-            elif interval == 'D':
-                active.append(1440)
-    if not active: return "1"
-    return str(min(active))
+    return primary_interval_cache.get(instrument_key.upper(), "1")
+
+def _refresh_subscriber_index(instrument_key: str):
+    """
+    Rebuilds the per-instrument index entries after room_subscribers changes.
+    Call with subscription_lock held. Entries are replaced, never mutated, so readers need no lock.
+    """
+    intervals = {interval: frozenset(sids) for (ik, interval), sids in room_subscribers.items() if ik == instrument_key and sids}
+    if not intervals:
+        subs_by_ik.pop(instrument_key, None)
+        primary_interval_cache.pop(instrument_key, None)
+        return
+    subs_by_ik[instrument_key] = intervals
+    active = [int(i) if i.isdigit() else 1440 for i in intervals if i.isdigit() or i == 'D']
+    if active:
+        primary_interval_cache[instrument_key] = str(min(active))
+    else:
+        primary_interval_cache.pop(instrument_key, None)
+
+def _volume_deltas(curr, prev, has_vol, is_candle, is_index, new_ts):
+    """
+    Per-tick traded quantity from cumulative volumes, for a whole frame at once.
+    Mirrors the scalar rules: no delta on first sighting, candle resets count the new
+    volume, and indices get a synthetic 1 on a fresh candle timestamp with no volume.
+    """
+    with np.errstate(invalid='ignore'):
+        # Detect reset (common in candle volume at the start of a new candle); fmax maps NaN to 0 like max()
+        delta = np.where(is_candle & (curr < prev * 0.5), curr, np.fmax(curr - prev, 0.0))
+        # First time seeing this source for this instrument: no delta yet
+        delta = np.where(has_vol & (prev > 0), delta, 0.0)
+    return np.where(is_index & is_candle & (delta <= 0) & new_ts, 1.0, delta)
 
 # Track last processed state to avoid redundant ticks
-last_processed_tick = {} # instrumentKey -> {ts_ms, price, volume}
+# Bounded LRU so instruments that stop ticking don't accumulate forever
+LAST_TICK_CACHE_SIZE = 10000
+last_processed_tick = OrderedDict() # instrumentKey -> (ts_ms, price, volume)
+
+def _remember_tick(instrument_key: str, state: Tuple[int, float, float]):
+    last_processed_tick[instrument_key] = state
+    last_processed_tick.move_to_end(instrument_key)
+    if len(last_processed_tick) > LAST_TICK_CACHE_SIZE:
+        last_processed_tick.popitem(last=False)
 
 TICK_BATCH_SIZE = 100
-tick_buffer = []
-buffer_lock = threading.Lock()
+# deque append/extend/popleft are atomic, so producers never take a lock
+tick_buffer = deque()
 
 def set_socketio(sio, loop=None):
     global socketio_instance, main_event_loop
     socketio_instance = sio
     main_event_loop = loop
 
-def emit_event(event: str, data: Any, room: Optional[str] = None, hrn: Optional[str] = None):
+def _on_main_loop() -> bool:
+    """True when called from the thread running main_event_loop."""
+    try:
+        return asyncio.get_running_loop() is main_event_loop
+    except RuntimeError:
+        return False
+
+def has_room_subscribers(room: str) -> bool:
+    """True if any interval of this instrument room has subscribers, or the room is global."""
+    room_key = room.upper()
+    # Some rooms are not in room_subscribers because they are global
+    return bool(subs_by_ik.get(room_key)) or room_key in ["GLOBAL", "ALERTS"]
+
+def emit_event(event: str, data: Any, room: Optional[str] = None, hrn: Optional[str] = None, sanitized: bool = False):
     """
     Emits an event to a specific Socket.IO room.
     Optimized to only process and log if the room has active subscribers.
+    Pass sanitized=True when data is already JSON-native (e.g. shared across rooms).
     """
     global socketio_instance, main_event_loop
     if not socketio_instance: return
 
     # Optimization: If room is provided, check if it has active subscribers before heavy JSON serialization
-    if room:
-        room_key = room.upper()
-        # Find if any interval for this instrument has subscribers
-        has_subscribers = False
-        for (ik, interval), sids in room_subscribers.items():
-            if ik == room_key and len(sids) > 0:
-                has_subscribers = True
-                break
-
-        # Also check for exact room matches (some rooms might not be in room_subscribers dict if they are global)
-        if not has_subscribers and room_key not in ["GLOBAL", "ALERTS"]:
-            # If no one is listening to this specific instrument room, skip emission to save CPU/Network
-            return
+    if room and not has_room_subscribers(room):
+        # If no one is listening to this specific instrument room, skip emission to save CPU/Network
+        return
 
-    if isinstance(data, (dict, list)):
-        data = json.loads(json.dumps(data, cls=LocalDBJSONEncoder))
+    if not sanitized and isinstance(data, (dict, list)):
+        data = to_json_native(data)
     try:
         if main_event_loop and main_event_loop.is_running():
-            asyncio.run_coroutine_threadsafe(socketio_instance.emit(event, data, to=room), main_event_loop)
-            if room:
-                # Reduced log noise: only log if it's a primary instrument or has subscribers
-                log_msg = f"Emitted {event} to room {room}"
+            coro = socketio_instance.emit(event, data, to=room)
+            if _on_main_loop():
+                # Already on the loop (normal tick path): schedule directly, no cross-thread hop
+                main_event_loop.create_task(coro)
+            else:
+                asyncio.run_coroutine_threadsafe(coro, main_event_loop)
+            if room and logger.isEnabledFor(logging.DEBUG):
+                # Debug-only, so skip building the message when it would be filtered anyway
                 if hrn and hrn.upper() != room:
-                    log_msg += f" ({hrn})"
-                logger.debug(log_msg) # Changed to debug to keep console clean
+                    logger.debug("Emitted %s to room %s (%s)", event, room, hrn)
+                else:
+                    logger.debug("Emitted %s to room %s", event, room)
     except Exception as e:
         logger.error(f"Emit Error: {e}")
 
 def flush_tick_buffer():
-    global tick_buffer
+    # Drain only what is present now; ticks appended meanwhile wait for the next flush.
+    # A concurrent flush may drain the same items first, hence the IndexError guard.
     to_insert = []
-    with buffer_lock:
-        if tick_buffer:
-            to_insert = tick_buffer
-            tick_buffer = []
+    popleft = tick_buffer.popleft
+    for _ in range(len(tick_buffer)):
+        try:
+            to_insert.append(popleft())
+        except IndexError:
+            break
 
     if to_insert:
         # Retry logic for DB insertion
@@ -119,18 +190,26 @@ def flush_tick_buffer():
                 else:
                     # Final failure - put data back into buffer so it's not lost
                     logger.error("Final DB insert failure. Returning ticks to buffer.")
-                    with buffer_lock:
-                        tick_buffer = to_insert + tick_buffer
+                    tick_buffer.extendleft(reversed(to_insert))
+
+flush_event = threading.Event()
+stop_event = threading.Event()
 
 def periodic_flush():
-    """Background task to flush ticks every 10 seconds."""
-    while True:
+    """Single flush worker: runs every 10 seconds, or as soon as on_message signals a full batch."""
+    while not stop_event.is_set():
+        flush_event.wait(timeout=10)
+        flush_event.clear()
         try:
-            time.sleep(10)
             flush_tick_buffer()
         except Exception as e:
             logger.error(f"Error in periodic_flush: {e}")
-            time.sleep(5)
+            stop_event.wait(5)
+
+def stop_flush_worker():
+    """Stops the flush worker; callers should run a final flush_tick_buffer()."""
+    stop_event.set()
+    flush_event.set()
 
 def periodic_maintenance():
     """Background task to optimize DB and cleanup old data."""
@@ -153,12 +232,42 @@ threading.Thread(target=periodic_flush, daemon=True).start()
 threading.Thread(target=periodic_maintenance, daemon=True).start()
 
 last_emit_times = {}
+UI_EMIT_INTERVAL = 0.05 # seconds
+pending_ticks = {} # room -> {feed key: latest feed}, emitted once per UI_EMIT_INTERVAL
+_trailing_emit = None # loop timer that sends feeds left pending when the ticks stop
+
+def emit_pending_ticks():
+    """Emits every room's coalesced feeds as a single raw_tick payload."""
+    global pending_ticks, _trailing_emit
+    if _trailing_emit is not None:
+        _trailing_emit.cancel()
+        _trailing_emit = None
+    last_emit_times['GLOBAL_TICK'] = time.time()
+    batch, pending_ticks = pending_ticks, {}
+    for room, feeds in batch.items():
+        emit_event('raw_tick', feeds, room=room)
+
+def _schedule_trailing_emit(now: float):
+    """Makes sure feeds coalesced inside the current window go out even if no later tick arrives."""
+    global _trailing_emit
+    if _trailing_emit is None and pending_ticks and _on_main_loop():
+        delay = max(UI_EMIT_INTERVAL - (now - last_emit_times.get('GLOBAL_TICK', 0)), 0)
+        _trailing_emit = main_event_loop.call_later(delay, emit_pending_ticks)
+
+def on_message(message: Union[Dict, str, bytes]):
+    if isinstance(message, (str, bytes)):
+        try:
+            message = _json_loads(message)
+        except ValueError as e:
+            logger.error(f"Invalid JSON in data_engine on_message: {e}")
+            return
 
-def on_message(message: Union[Dict, str]):
-    global tick_buffer
     try:
-        data = json.loads(message) if isinstance(message, str) else message
+        data = message
         feeds_map = {}
+        # One clock read per message, shared by every timestamp fallback below
+        now = time.time()
+        now_ms = int(now * 1000)
 
         # Handle Chart/OHLCV Updates - Indices often update primarily here
         # This block extracts real-time OHLC data and converts it into synthetic ticks
@@ -177,32 +286,29 @@ def on_message(message: Union[Dict, str]):
                 # 1. Technical Key (e.g., NSE_INDEX|NIFTY 50) - used by low-level providers.
                 # 2. Canonical Key (e.g., NSE:NIFTY) - used by the Main Terminal/Strategy.
                 # 3. HRN (e.g., NIFTY) - used by the Options Dashboard for simplicity.
-                hrn = symbol_mapper.get_hrn(instrument_key)
-                internal_key = symbol_mapper.from_upstox_key(instrument_key)
-
-                # 1. Technical Room
-                emit_event('chart_update', payload, room=instrument_key.upper(), hrn=hrn)
+                hrn = symbol_mapper.get_route(instrument_key)[0]
+                rooms = [room for room, _ in symbol_mapper.get_rooms(instrument_key) if has_room_subscribers(room)]
 
-                # 2. Canonical Room (e.g. NSE:NIFTY)
-                if internal_key != instrument_key:
-                    emit_event('chart_update', payload, room=internal_key.upper(), hrn=hrn)
-
-                # 3. HRN Room (Human Readable Name)
-                if hrn and hrn != instrument_key and hrn != internal_key:
-                    emit_event('chart_update', payload, room=hrn.upper(), hrn=hrn)
+                if rooms:
+                    # Sanitize (and optionally pack) the ohlcv-heavy payload once for all rooms
+                    clean_payload = to_json_native(payload) if isinstance(payload, (dict, list)) else payload
+                    if BINARY_CHART_UPDATES:
+                        clean_payload = msgpack.packb(clean_payload, use_bin_type=True)
+                    for room in rooms:
+                        emit_event('chart_update', clean_payload, room=room, hrn=hrn, sanitized=True)
 
                 # Synthetic Tick Generation for indices from chart updates
                 # Only generate ticks from the most granular (primary) interval to avoid double-counting
                 if payload.get('ohlcv') and interval == get_primary_interval(instrument_key):
                     last_ohlcv = payload['ohlcv'][-1]
                     # Robust type casting using helpers
-                    ts_ms = safe_int(last_ohlcv[0] * 1000 if last_ohlcv[0] is not None else time.time() * 1000)
+                    ts_ms = safe_int(last_ohlcv[0] * 1000) if last_ohlcv[0] is not None else now_ms
                     price = safe_float(last_ohlcv[4])
                     volume = safe_float(last_ohlcv[5])
 
                     # Deduplicate: only process if price or volume or timestamp changed
-                    prev = last_processed_tick.get(instrument_key, {})
-                    if ts_ms != prev.get('ts_ms') or price != prev.get('price') or volume != prev.get('volume'):
+                    state = (ts_ms, price, volume)
+                    if last_processed_tick.get(instrument_key) != state:
                         # last_ohlcv format: [ts, o, h, l, c, v]
                         feeds_map[instrument_key] = {
                             'last_price': price,
@@ -211,115 +317,108 @@ def on_message(message: Union[Dict, str]):
                             'source': 'tv_chart_fallback',
                             'interval': interval
                         }
-                        last_processed_tick[instrument_key] = {'ts_ms': ts_ms, 'price': price, 'volume': volume}
+                        _remember_tick(instrument_key, state)
 
         # Handle Standard Live Feeds (Quote session)
         if not feeds_map:
             feeds_map = data.get('feeds', {})
         if not feeds_map: return
 
-        current_time = datetime.now()
         sym_feeds = {}
-        today_str = current_time.strftime("%Y-%m-%d")
+        today_str = datetime.fromtimestamp(now).strftime("%Y-%m-%d")
+
+        tracker_keys, curr_vols, has_vol, is_index, is_candle, new_ts = [], [], [], [], [], []
+
+        # Per-tick loop: bind hot globals and bound methods to locals (LOAD_FAST instead of LOAD_GLOBAL/attr lookups)
+        _safe_int, _safe_float, _remember = safe_int, safe_float, _remember_tick
+        _last_tick = last_processed_tick.get
+        _get_route = symbol_mapper.get_route
 
         for inst_key, feed_datum in feeds_map.items():
             # Standard Quote Feed Deduplication (in addition to Chart)
             if feed_datum.get('source') != 'tv_chart_fallback':
                 # Robust type casting for quote fields using helpers
-                ts_ms = safe_int(feed_datum.get('ts_ms') or time.time() * 1000)
-                price = safe_float(feed_datum.get('last_price'))
-                volume = safe_float(feed_datum.get('tv_volume'))
+                ts_ms = _safe_int(feed_datum.get('ts_ms') or now_ms)
+                price = _safe_float(feed_datum.get('last_price'))
+                volume = _safe_float(feed_datum.get('tv_volume'))
 
-                prev = last_processed_tick.get(inst_key, {})
-                if ts_ms == prev.get('ts_ms') and price == prev.get('price') and volume == prev.get('volume'):
+                state = (ts_ms, price, volume)
+                if _last_tick(inst_key) == state:
                     continue # Skip redundant quote
-                last_processed_tick[inst_key] = {'ts_ms': ts_ms, 'price': price, 'volume': volume}
+                _remember(inst_key, state)
 
             # Use technical symbol as is
             feed_datum.update({
                 'instrumentKey': inst_key,
                 'date': today_str,
-                'last_price': safe_float(feed_datum.get('last_price')),
+                'last_price': _safe_float(feed_datum.get('last_price')),
                 'source': feed_datum.get('source', 'tv_wss')
             })
 
-            ts_val = safe_int(feed_datum.get('ts_ms') or time.time() * 1000)
+            ts_val = _safe_int(feed_datum.get('ts_ms') or now_ms)
             if 0 < ts_val < 10000000000: ts_val *= 1000
             feed_datum['ts_ms'] = ts_val
 
-            delta_vol = 0
-            is_index = inst_key in UPSTOX_INDEX_MAP or "INDEX" in inst_key.upper()
             is_candle_source = feed_datum.get('source') == 'tv_chart_fallback'
-            interval = str(feed_datum.get('interval', '1'))
-
             # Track daily and candle volumes separately, and per-interval for candles
             if is_candle_source:
-                tracker_key = f"{inst_key}_{interval}_candle"
+                tracker_keys.append(f"{inst_key}_{str(feed_datum.get('interval', '1'))}_candle")
             else:
-                tracker_key = f"{inst_key}_daily"
+                tracker_keys.append(f"{inst_key}_daily")
 
             # Use tv_volume if present, otherwise try upstox_volume
             curr_vol = feed_datum.get('tv_volume')
             if curr_vol is None:
                 curr_vol = feed_datum.get('upstox_volume')
+            has_vol.append(curr_vol is not None)
+            curr_vols.append(_safe_float(curr_vol))
 
-            if curr_vol is not None:
-                curr_vol = safe_float(curr_vol)
-                prev_vol = latest_total_volumes.get(tracker_key, 0)
-
-                if prev_vol > 0:
-                    # Detect reset (common in candle volume at the start of a new candle)
-                    if is_candle_source and curr_vol < prev_vol * 0.5:
-                        delta_vol = curr_vol
-                    else:
-                        delta_vol = max(0, curr_vol - prev_vol)
-                else:
-                    # First time seeing this source for this instrument
-                    delta_vol = 0
-
-                latest_total_volumes[tracker_key] = curr_vol
+            is_index.append(_get_route(inst_key)[2])
+            is_candle.append(is_candle_source)
+            # Index synthetic volume is only forced on a new timestamp to avoid over-inflation
+            new_ts.append(ts_val != _last_tick(inst_key, (None,))[0])
+            sym_feeds[inst_key] = feed_datum
 
-            # Special case for Index synthetic volume:
-            # only force it if no other real volume has been detected for this tick
-            # and only if it's a new timestamp to avoid over-inflation from multiple updates to the same candle
-            if is_index and delta_vol <= 0 and is_candle_source:
-                prev_ts = last_processed_tick.get(inst_key, {}).get('ts_ms')
-                if ts_val != prev_ts:
-                    delta_vol = 1
+        if sym_feeds:
+            # Volume deltas for the whole frame in one vectorized step
+            has_vol = np.array(has_vol, dtype=bool)
+            curr = np.array(curr_vols, dtype=np.float64)
+            prev = np.fromiter((latest_total_volumes.get(k, 0) for k in tracker_keys), dtype=np.float64, count=len(tracker_keys))
+            is_index = np.array(is_index, dtype=bool)
+            deltas = _volume_deltas(curr, prev, has_vol, np.array(is_candle, dtype=bool), is_index, np.array(new_ts, dtype=bool))
 
             # Final safety check: Clamp extreme LTQ that would ruin chart scaling
             # Unless it's a known liquid stock, anything > 5M in a single tick is likely a calculation error
-            if delta_vol > 5000000:
-                logger.warning(f"Extreme volume detected for {inst_key}: {delta_vol}. Clamping.")
-                delta_vol = 100 if is_index else delta_vol % 10000
-
-            feed_datum['ltq'] = safe_int(delta_vol)
-            sym_feeds[inst_key] = feed_datum
-
-        # Throttled UI Emission
-        now = time.time()
-        if now - last_emit_times.get('GLOBAL_TICK', 0) > 0.05:
-            for inst_key, feed in sym_feeds.items():
-                hrn = symbol_mapper.get_hrn(inst_key)
-                internal_key = symbol_mapper.from_upstox_key(inst_key)
-
-                # 1. Emit to provider-specific room (Technical Key)
-                emit_event('raw_tick', {inst_key: feed}, room=inst_key.upper(), hrn=hrn)
-
-                # 2. Emit to internal canonical room (e.g. NSE:NIFTY)
-                if internal_key != inst_key:
-                    emit_event('raw_tick', {internal_key: feed}, room=internal_key.upper(), hrn=hrn)
-
-                # 3. Emit to HRN-based room (Human Readable Name)
-                if hrn and hrn != inst_key and hrn != internal_key:
-                    emit_event('raw_tick', {hrn: feed}, room=hrn.upper(), hrn=hrn)
-
-            last_emit_times['GLOBAL_TICK'] = now
-
-        with buffer_lock:
-            tick_buffer.extend(list(sym_feeds.values()))
-            if len(tick_buffer) >= TICK_BATCH_SIZE:
-                threading.Thread(target=flush_tick_buffer, daemon=True).start()
+            extreme = deltas > 5000000
+            if extreme.any():
+                keys = list(sym_feeds)
+                for i in np.flatnonzero(extreme):
+                    logger.warning(f"Extreme volume detected for {keys[i]}: {deltas[i]}. Clamping.")
+                with np.errstate(invalid='ignore'):
+                    deltas = np.where(extreme, np.where(is_index, 100, deltas % 10000), deltas)
+
+            _totals = latest_total_volumes
+            for i, feed_datum in enumerate(sym_feeds.values()):
+                if has_vol[i]:
+                    _totals[tracker_keys[i]] = curr_vols[i]
+                feed_datum['ltq'] = _safe_int(deltas[i])
+
+        # Throttled UI Emission: coalesce feeds per room, one payload per room per window
+        _get_rooms, _has_subscribers, _pending = symbol_mapper.get_rooms, has_room_subscribers, pending_ticks.setdefault
+        for inst_key, feed in sym_feeds.items():
+            # Technical, internal canonical (e.g. NSE:NIFTY) and HRN rooms; unwatched rooms are skipped
+            for room, room_key in _get_rooms(inst_key):
+                if _has_subscribers(room):
+                    _pending(room, {})[room_key] = feed
+
+        if now - last_emit_times.get('GLOBAL_TICK', 0) > UI_EMIT_INTERVAL:
+            emit_pending_ticks()
+        else:
+            _schedule_trailing_emit(now)
+
+        tick_buffer.extend(sym_feeds.values())
+        if len(tick_buffer) >= TICK_BATCH_SIZE:
+            flush_event.set()
 
         # Internal callbacks
         for cb in internal_tick_callbacks:
@@ -331,6 +430,17 @@ def on_message(message: Union[Dict, str]):
     except Exception as e:
         logger.error(f"Error in data_engine on_message: {e}")
 
+def dispatch_message(message: Union[Dict, str, bytes]):
+    """
+    Provider callback: hands each message to the main event loop, so that
+    on_message and all of its Socket.IO emits run on the loop thread with a
+    single cross-thread wake-up per message instead of one per emit.
+    """
+    if main_event_loop and main_event_loop.is_running() and not _on_main_loop():
+        main_event_loop.call_soon_threadsafe(on_message, message)
+    else:
+        on_message(message)
+
 def subscribe_instrument(instrument_key: str, sid: str, interval: str = "1"):
     instrument_key = instrument_key.upper()
 
@@ -342,14 +452,16 @@ def subscribe_instrument(instrument_key: str, sid: str, interval: str = "1"):
             instrument_key = resolved.upper()
 
     key = (instrument_key, str(interval))
-    if key not in room_subscribers:
-        room_subscribers[key] = set()
-    if sid not in room_subscribers[key]:
-        room_subscribers[key].add(sid)
-        logger.info(f"Room {instrument_key} ({interval}m) now has {len(room_subscribers[key])} subscribers")
+    with subscription_lock:
+        if key not in room_subscribers:
+            room_subscribers[key] = set()
+        if sid not in room_subscribers[key]:
+            room_subscribers[key].add(sid)
+            _refresh_subscriber_index(instrument_key)
+            logger.info(f"Room {instrument_key} ({interval}m) now has {len(room_subscribers[key])} subscribers")
     for provider in live_stream_registry.get_all():
         try:
-            provider.set_callback(on_message)
+            provider.set_callback(dispatch_message)
             provider.start()
             provider.subscribe([instrument_key], interval=interval)
         except Exception as e:
@@ -357,11 +469,7 @@ def subscribe_instrument(instrument_key: str, sid: str, interval: str = "1"):
 
 def is_sid_using_instrument(sid: str, instrument_key: str) -> bool:
     """Check if a specific client is still using this instrument in any interval."""
-    instrument_key = instrument_key.upper()
-    for (r_key, r_interval), sids in room_subscribers.items():
-        if r_key == instrument_key and sid in sids:
-            return True
-    return False
+    return any(sid in sids for sids in subs_by_ik.get(instrument_key.upper(), {}).values())
 
 def unsubscribe_instrument(instrument_key: str, sid: str, interval: str = "1"):
     instrument_key = instrument_key.upper()
@@ -373,24 +481,29 @@ def unsubscribe_instrument(instrument_key: str, sid: str, interval: str = "1"):
             instrument_key = resolved.upper()
 
     key = (instrument_key, str(interval))
-    if key in room_subscribers and sid in room_subscribers[key]:
+    with subscription_lock:
+        if key not in room_subscribers or sid not in room_subscribers[key]:
+            return
         room_subscribers[key].remove(sid)
         logger.info(f"Room {instrument_key} ({interval}m) now has {len(room_subscribers[key])} subscribers")
-        if len(room_subscribers[key]) == 0:
-            logger.info(f"Unsubscribing from {instrument_key} ({interval}m) as no more subscribers")
-            for provider in live_stream_registry.get_all():
-                try:
-                    provider.unsubscribe(instrument_key, interval=interval)
-                except Exception as e:
-                    logger.error(f"Error unsubscribing via provider: {e}")
+        emptied = len(room_subscribers[key]) == 0
+        if emptied:
             del room_subscribers[key]
+        _refresh_subscriber_index(instrument_key)
+
+    # Provider calls may block on the network, so they run outside the lock
+    if emptied:
+        logger.info(f"Unsubscribing from {instrument_key} ({interval}m) as no more subscribers")
+        for provider in live_stream_registry.get_all():
+            try:
+                provider.unsubscribe(instrument_key, interval=interval)
+            except Exception as e:
+                logger.error(f"Error unsubscribing via provider: {e}")
 
 def handle_disconnect(sid: str):
     """Cleanup all subscriptions for a disconnected client."""
-    to_cleanup = []
-    for (key, interval), sids in room_subscribers.items():
-        if sid in sids:
-            to_cleanup.append((key, interval))
+    with subscription_lock:
+        to_cleanup = [(key, interval) for (key, interval), sids in room_subscribers.items() if sid in sids]
 
     for key, interval in to_cleanup:
         unsubscribe_instrument(key, sid, interval)
@@ -402,7 +515,7 @@ def start_websocket_thread(keys: Optional[List[str]] = None):
     subscribe_keys = keys or INITIAL_INSTRUMENTS
     for provider in live_stream_registry.get_all():
         try:
-            provider.set_callback(on_message)
+            provider.set_callback(dispatch_message)
             provider.start()
             provider.subscribe(subscribe_keys)
         except Exception as e:
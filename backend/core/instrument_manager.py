@@ -63,6 +63,8 @@ class InstrumentManager:
                     logger.error(f"Error syncing instruments for {exchange}: {e}")
 
         logger.info(f"Instrument master sync complete. Total instruments: {total_count}")
+        # New metadata can change HRNs of keys already routed from fallbacks
+        symbol_mapper.invalidate_metadata()
 
     def _process_df(self, df: pd.DataFrame) -> int:
         """Processes the dataframe and updates metadata table in bulk."""
@@ -2,7 +2,7 @@
 import logging
 import pandas as pd
 from datetime import datetime
-from typing import Dict, Optional, Any
+from typing import Dict, Optional, Any, Tuple
 from db.local_db import db
 try:
     from config import UPSTOX_INDEX_MAP
@@ -11,6 +11,23 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# F&O underlyings (e.g. NIFTY26...) that get an NSE_FO| prefix by default, until metadata is loaded
+_DEFAULT_FO_PREFIXES = ('NIFTY', 'BANKNIFTY', 'FINNIFTY', 'RELIANCE', 'HDFCBANK')
+# Upper-cased Upstox index key -> correctly cased key (first mapping wins)
+_INDEX_KEYS_BY_UPPER: Dict[str, str] = {v.upper(): v for v in reversed(list(UPSTOX_INDEX_MAP.values()))}
+# Upper-cased Upstox index key -> internal symbol (first mapping wins)
+_INTERNAL_BY_INDEX_KEY: Dict[str, str] = {v.upper(): k for k, v in reversed(list(UPSTOX_INDEX_MAP.items()))}
+# Base symbol -> TradingView symbol for indices
+_TV_INDEX_MAP = {
+    "NIFTY": "NSE:NIFTY",
+    "NIFTY 50": "NSE:NIFTY",
+    "BANKNIFTY": "NSE:BANKNIFTY",
+    "NIFTY BANK": "NSE:BANKNIFTY",
+    "INDIA VIX": "NSE:INDIAVIX",
+    "INDIAVIX": "NSE:INDIAVIX",
+    "SENSEX": "BSE:SENSEX"
+}
+
 class SymbolMapper:
     _instance = None
     _upstox_to_internal: Dict[str, str] = {}
@@ -28,6 +45,15 @@ class SymbolMapper:
         "BANKNIFTY": "NSE|BANKNIFTY",
         "INDIA VIX": "NSE|INDIAVIX"
     } # HRN -> instrument_key
+    _route_cache: Dict[str, Tuple[str, str, bool]] = {} # instrument_key -> (hrn, internal_key, is_index)
+    _rooms_cache: Dict[str, Tuple[Tuple[str, str], ...]] = {} # instrument_key -> ((room, payload_key), ...)
+    _reverse_warmed: bool = False # True once the metadata HRN index is loaded into both caches
+    WARM_PAGE_SIZE = 50000
+    _fo_prefixes: Optional[Tuple[str, ...]] = None # F&O underlyings, longest first
+    # Memoized results that depend only on metadata; cleared by invalidate_metadata()
+    _fallback_hrn_cache: Dict[str, str] = {} # instrument_key -> normalized HRN for keys without metadata
+    _tv_symbol_cache: Dict[str, str] = {} # raw key -> TradingView symbol
+    mapping_version: int = 0 # bumped whenever any mapping changes, for callers memoizing derived lookups
 
     def __new__(cls):
         if cls._instance is None:
@@ -46,8 +72,11 @@ class SymbolMapper:
 
         if key in self._mapping_cache:
             return self._mapping_cache[key]
+        if metadata is None and key in self._fallback_hrn_cache:
+            return self._fallback_hrn_cache[key]
 
         # Try to find in Local DB
+        db_ok = True
         try:
             res = db.get_metadata(key)
             if res:
@@ -56,7 +85,7 @@ class SymbolMapper:
                 self._reverse_cache[hrn] = key
                 return hrn
         except:
-            pass
+            db_ok = False
 
         # If not found and metadata provided, generate and store
         if metadata:
@@ -66,11 +95,14 @@ class SymbolMapper:
                 return hrn
 
         # Fallback to simple normalization if no metadata
+        hrn = key.replace('|', ':').replace('NSE INDEX', '').strip()
         if '|' in key:
             parts = key.split('|')
             if len(parts) == 2 and parts[0] == 'NSE':
-                return parts[1] # Return just RELIANCE for NSE|RELIANCE
-        return key.replace('|', ':').replace('NSE INDEX', '').strip()
+                hrn = parts[1] # Return just RELIANCE for NSE|RELIANCE
+        if db_ok:
+            self._fallback_hrn_cache[key] = hrn
+        return hrn
 
     def _generate_hrn(self, instrument_key: str, meta: Dict[str, Any]) -> str:
         """
@@ -116,6 +148,42 @@ class SymbolMapper:
             pass
         self._mapping_cache[instrument_key] = hrn
         self._reverse_cache[hrn] = instrument_key
+        self._tv_symbol_cache.clear()
+        self.invalidate_routes()
+
+    def get_route(self, instrument_key: str) -> Tuple[str, str, bool]:
+        """
+        Returns the (hrn, internal_key, is_index) triple used to route a feed key.
+        Memoized per raw key so the per-tick path skips get_hrn/from_upstox_key.
+        """
+        route = self._route_cache.get(instrument_key)
+        if route is None:
+            is_index = instrument_key in UPSTOX_INDEX_MAP or "INDEX" in instrument_key.upper()
+            route = (self.get_hrn(instrument_key), self.from_upstox_key(instrument_key), is_index)
+            self._route_cache[instrument_key] = route
+        return route
+
+    def get_rooms(self, instrument_key: str) -> Tuple[Tuple[str, str], ...]:
+        """
+        Returns the deduped (room, payload_key) emission targets for a feed key:
+        technical key, internal canonical key (e.g. NSE:NIFTY) and HRN.
+        """
+        rooms = self._rooms_cache.get(instrument_key)
+        if rooms is None:
+            hrn, internal_key, _ = self.get_route(instrument_key)
+            rooms = [(instrument_key.upper(), instrument_key)]
+            if internal_key != instrument_key:
+                rooms.append((internal_key.upper(), internal_key))
+            if hrn and hrn != instrument_key and hrn != internal_key:
+                rooms.append((hrn.upper(), hrn))
+            rooms = self._rooms_cache[instrument_key] = tuple(rooms)
+        return rooms
+
+    def invalidate_routes(self):
+        """Drops memoized routes after mappings or instrument metadata change."""
+        self._route_cache.clear()
+        self._rooms_cache.clear()
+        self.mapping_version += 1
 
     def resolve_to_key(self, hrn: str) -> Optional[str]:
         """Resolves a Human Readable Name back to an instrument key."""
@@ -125,18 +193,66 @@ class SymbolMapper:
         if target in self._reverse_cache:
             return self._reverse_cache[target]
 
-        try:
-            rows = db.query("SELECT instrument_key FROM metadata WHERE hrn = ?", (target,))
-            if rows:
-                key = rows[0]['instrument_key']
-                self._mapping_cache[key] = target
-                self._reverse_cache[target] = key
-                return key
-        except:
-            pass
+        if not self._reverse_warmed:
+            self._warm_reverse_cache()
+            return self._reverse_cache.get(target)
 
         return None
 
+    def _warm_reverse_cache(self):
+        """Loads every metadata key <-> HRN pair once into both caches, so lookups never hit the DB per miss."""
+        try:
+            offset = 0
+            while True:
+                rows = db.query(
+                    "SELECT instrument_key, hrn FROM metadata ORDER BY instrument_key LIMIT ? OFFSET ?",
+                    (self.WARM_PAGE_SIZE, offset)
+                )
+                for r in rows:
+                    self._mapping_cache.setdefault(r['instrument_key'], r['hrn'])
+                    self._reverse_cache.setdefault(r['hrn'], r['instrument_key'])
+                if len(rows) < self.WARM_PAGE_SIZE:
+                    break
+                offset += self.WARM_PAGE_SIZE
+            self._reverse_warmed = True
+        except Exception as e:
+            logger.error(f"Failed to warm HRN index: {e}")
+
+    def invalidate_metadata(self):
+        """Forces a reload of the HRN index after the instrument master changes."""
+        self._reverse_warmed = False
+        self._fo_prefixes = None
+        self._fallback_hrn_cache.clear()
+        self._tv_symbol_cache.clear()
+        self.invalidate_routes()
+
+    def _get_fo_prefixes(self) -> Tuple[str, ...]:
+        """Loads the F&O underlyings from instrument metadata once, falling back to the defaults."""
+        if self._fo_prefixes is None:
+            prefixes = set(_DEFAULT_FO_PREFIXES)
+            try:
+                rows = db.query(
+                    "SELECT DISTINCT json_extract_string(meta, '$.symbol') AS underlying "
+                    "FROM metadata WHERE json_extract_string(meta, '$.segment') = 'NSE_FO'"
+                )
+                prefixes.update(r['underlying'].upper() for r in rows if r['underlying'])
+            except Exception as e:
+                logger.error(f"Failed to load F&O underlyings: {e}")
+            self._fo_prefixes = tuple(sorted(prefixes, key=len, reverse=True))
+        return self._fo_prefixes
+
+    def _is_fo_symbol(self, symbol: str) -> bool:
+        """True for an F&O underlying followed by a 2-digit year (e.g. NIFTY26...)."""
+        prefixes = self._get_fo_prefixes()
+        if not symbol.startswith(prefixes):
+            return False
+        for p in prefixes:
+            if symbol.startswith(p):
+                tail = symbol[len(p):len(p) + 2]
+                if len(tail) == 2 and tail.isdigit():
+                    return True
+        return False
+
     def get_symbol(self, key_or_hrn: str) -> str:
         """Extracts the base symbol (NIFTY, BANKNIFTY) from a key or HRN."""
         if not key_or_hrn: return ""
@@ -164,6 +280,7 @@ class SymbolMapper:
         u_key = upstox_key.upper()
         self._internal_to_upstox[int_key] = upstox_key
         self._upstox_to_internal[u_key] = internal_symbol
+        self.invalidate_routes()
         logger.debug(f"Registered mapping: {internal_symbol} <-> {upstox_key}")
 
     def to_upstox_key(self, internal_key: str) -> str:
@@ -173,11 +290,8 @@ class SymbolMapper:
         # If it already looks like an Upstox key, return it as is (preserving case)
         if '|' in internal_key and not internal_key.startswith('NSE:'):
             # Check if it's a known index but incorrectly cased
-            upper_key = internal_key.upper()
-            for k, v in UPSTOX_INDEX_MAP.items():
-                if v.upper() == upper_key:
-                    return v # Return correctly cased index key
-            return internal_key
+            # Return correctly cased index key
+            return _INDEX_KEYS_BY_UPPER.get(internal_key.upper(), internal_key)
 
         key = internal_key.upper().replace('|', ':')
 
@@ -185,20 +299,21 @@ class SymbolMapper:
         no_prefix_key = key.split(':')[-1]
         prefixed_key = f"NSE:{no_prefix_key}"
 
+        candidates = (prefixed_key, no_prefix_key, key)
+
         # 1. Check dynamic mapping (both variations)
-        for k in [prefixed_key, no_prefix_key, key]:
+        for k in candidates:
             if k in self._internal_to_upstox:
                 return self._internal_to_upstox[k]
 
         # 2. Check Static Index Map
-        for k in [prefixed_key, no_prefix_key, key]:
+        for k in candidates:
             if k in UPSTOX_INDEX_MAP:
                 return UPSTOX_INDEX_MAP[k]
 
         # Default mapping for equity/options if they follow common patterns
         # If it looks like an F&O symbol (e.g. NIFTY26...) and has no prefix, add NSE_FO|
-        import re
-        if re.match(r'^(NIFTY|BANKNIFTY|FINNIFTY|RELIANCE|HDFCBANK)\d{2}', no_prefix_key):
+        if self._is_fo_symbol(no_prefix_key):
             return f"NSE_FO|{no_prefix_key}"
 
         return key.replace(':', '|')
@@ -210,25 +325,25 @@ class SymbolMapper:
         """
         if not internal_key: return ""
 
+        tv_symbol = self._tv_symbol_cache.get(internal_key)
+        if tv_symbol is None:
+            tv_symbol, cacheable = self._resolve_tv_symbol(internal_key)
+            if cacheable:
+                self._tv_symbol_cache[internal_key] = tv_symbol
+        return tv_symbol
+
+    def _resolve_tv_symbol(self, internal_key: str) -> Tuple[str, bool]:
+        """Returns (tv_symbol, cacheable); results are not cached if the DB lookup failed."""
         # Standardize key for lookup/comparison
         key = internal_key.upper().replace(':', '|')
 
         # 1. Fast path for Indices
-        index_map = {
-            "NIFTY": "NSE:NIFTY",
-            "NIFTY 50": "NSE:NIFTY",
-            "BANKNIFTY": "NSE:BANKNIFTY",
-            "NIFTY BANK": "NSE:BANKNIFTY",
-            "INDIA VIX": "NSE:INDIAVIX",
-            "INDIAVIX": "NSE:INDIAVIX",
-            "SENSEX": "BSE:SENSEX"
-        }
-
         base_symbol = key.split('|')[-1]
-        if base_symbol in index_map:
-            return index_map[base_symbol]
+        if base_symbol in _TV_INDEX_MAP:
+            return _TV_INDEX_MAP[base_symbol], True
 
         # 2. Database Lookup for technical/numeric keys (e.g., NSE_FO|54910)
+        cacheable = True
         try:
             # Try original key and standardized key
             for k in [internal_key, key, key.replace('|', ':')]:
@@ -240,21 +355,22 @@ class SymbolMapper:
                         exch = meta.get('exchange', 'NSE')
                         # TradingView uses 'NSE' for both NSE and NFO segments
                         tv_exch = 'NSE' if exch in ['NSE', 'NFO'] else 'BSE' if exch in ['BSE', 'BFO'] else exch
-                        return f"{tv_exch}:{tsym}"
+                        return f"{tv_exch}:{tsym}", True
         except Exception as e:
             logger.debug(f"TV symbol resolution DB lookup failed: {e}")
+            cacheable = False
 
         # 3. Heuristic fallbacks if DB lookup fails
-        if "BANKNIFTY" in key: return "NSE:BANKNIFTY"
-        if "NIFTY" in key: return "NSE:NIFTY"
+        if "BANKNIFTY" in key: return "NSE:BANKNIFTY", cacheable
+        if "NIFTY" in key: return "NSE:NIFTY", cacheable
 
         # If it already looks like a TV symbol, return it
         if ':' in internal_key and not internal_key.startswith('NSE_'):
-            return internal_key.upper()
+            return internal_key.upper(), cacheable
 
         # Last resort: Strip prefix and assume NSE
         clean_sym = key.split('|')[-1]
-        return f"NSE:{clean_sym}"
+        return f"NSE:{clean_sym}", cacheable
 
     def from_upstox_key(self, upstox_key: str) -> str:
         """Translates Upstox key to internal canonical symbol."""
@@ -265,10 +381,9 @@ class SymbolMapper:
             return self._upstox_to_internal[u_key]
 
         # Reverse lookup in UPSTOX_INDEX_MAP
-        for int_key, val in UPSTOX_INDEX_MAP.items():
-            if val.upper() == u_key:
-                return int_key
+        if u_key in _INTERNAL_BY_INDEX_KEY:
+            return _INTERNAL_BY_INDEX_KEY[u_key]
 
-        return upstox_key.replace('|', ':').upper()
+        return u_key.replace('|', ':')
 
 symbol_mapper = SymbolMapper()
@@ -16,6 +16,11 @@ logger = logging.getLogger(__name__)
 
 import numpy as np
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 class LocalDBJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime): return obj.isoformat()
@@ -23,6 +28,18 @@ class LocalDBJSONEncoder(json.JSONEncoder):
             if not np.isfinite(obj): return None
         return super().default(obj)
 
+_json_default = LocalDBJSONEncoder().default
+
+def to_json_native(data: Any) -> Any:
+    """
+    Converts a payload to plain JSON types (dict/list/str/int/float/None).
+    Uses orjson's C encoder/decoder when available, else the stdlib round-trip.
+    """
+    if orjson is not None:
+        return orjson.loads(orjson.dumps(data, default=_json_default,
+                                         option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY))
+    return json.loads(json.dumps(data, cls=LocalDBJSONEncoder))
+
 # Resolve absolute path relative to project root
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 DB_PATH = os.getenv('DUCKDB_PATH', os.path.join(BASE_DIR, 'data', 'pro_trade.db'))
@@ -211,23 +228,17 @@ class LocalDB:
         """
         if not ticks: return
         cols = ['date', 'instrumentKey', 'ts_ms', 'price', 'qty', 'source']
-        data = []
-        for t in ticks:
+        today = datetime.now().strftime('%Y-%m-%d')
+        # Build columns directly (one pass, no per-row dicts) and hand them to DuckDB as a frame
+        df = pd.DataFrame({
+            'date': [t.get('date', today) for t in ticks],
+            'instrumentKey': [t.get('instrumentKey') for t in ticks],
             # Robust type casting using shared utilities
-            price = safe_float(t.get('last_price'))
-            qty = safe_int(t.get('ltq'))
-            ts_ms = safe_int(t.get('ts_ms'))
-
-            data.append({
-                'date': t.get('date', datetime.now().strftime('%Y-%m-%d')),
-                'instrumentKey': t.get('instrumentKey'),
-                'ts_ms': ts_ms,
-                'price': price,
-                'qty': qty,
-                'source': t.get('source', 'live')
-            })
-
-        df = pd.DataFrame(data)[cols]
+            'ts_ms': [safe_int(t.get('ts_ms')) for t in ticks],
+            'price': [safe_float(t.get('last_price')) for t in ticks],
+            'qty': [safe_int(t.get('ltq')) for t in ticks],
+            'source': [t.get('source', 'live') for t in ticks],
+        }, columns=cols)
         with self._execute_lock:
             # Register the dataframe and use explicit column names for the INSERT
             self.conn.register('df_ticks', df)
@@ -278,9 +289,13 @@ class LocalDB:
         with self._execute_lock:
             self.conn.execute(sql, params)
 
-    def query(self, sql: str, params: tuple = (), json_serialize: bool = False) -> List[Dict[str, Any]]:
+    def query_df(self, sql: str, params: tuple = ()) -> pd.DataFrame:
+        """Runs a query and returns the raw result frame, for callers that work column-wise."""
         with self._execute_lock:
-            df = self.conn.execute(sql, params).fetch_df()
+            return self.conn.execute(sql, params).fetch_df()
+
+    def query(self, sql: str, params: tuple = (), json_serialize: bool = False) -> List[Dict[str, Any]]:
+        df = self.query_df(sql, params)
 
         # Ensure all datetime columns are UTC-aware
         for col in df.select_dtypes(include=['datetime64']).columns:
@@ -173,7 +173,7 @@ class NSEOptionsProvider(IOptionsDataProvider):
 class TradingViewHistoricalProvider(IHistoricalDataProvider):
     """TradingView Historical Data Implementation."""
     async def get_hist_candles(self, symbol: str, interval: str, count: int) -> List[List]:
-        return await asyncio.to_thread(tv_api.get_hist_candles, symbol, interval, count)
+        return await tv_api.get_hist_candles_async(symbol, interval, count)
 
 
 class UpstoxLiveStreamProvider(ILiveStreamProvider):
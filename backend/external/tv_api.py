@@ -1,22 +1,135 @@
-import logging
 try:
     from tvDatafeed import TvDatafeed, Interval
 except ImportError:
     TvDatafeed = None
     Interval = None
 from tradingview_scraper.symbols.stream import Streamer
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+try:
+    import ciso8601
+except ImportError:
+    ciso8601 = None
+try:
+    import redis
+except ImportError:
+    redis = None
+import asyncio
+import json
 import logging
 import os
+import random
 import contextlib
-import io
 import time
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import re
+import string
 import inspect
-from config import TV_COOKIE
+import threading
+import struct
+import numpy as np
+import pandas as pd
+from config import TV_COOKIE, CANDLE_CACHE_REDIS_URL
+from core.symbol_mapper import symbol_mapper
+from db.local_db import db
 
 logger = logging.getLogger(__name__)
 
+# Bar duration per interval, also used as the cache TTL (capped) for that interval
+_INTERVAL_SECONDS = {
+    '1': 60, '3': 180, '5': 300, '15': 900, '30': 1800, '45': 2700,
+    '60': 3600, '120': 7200, '240': 14400,
+    'D': 86400, '1d': 86400, 'W': 604800, '1w': 604800
+}
+CANDLE_CACHE_MAX_TTL = 300 # seconds; the forming bar should never be older than this
+DB_FALLBACK_CACHE_TTL = 5 # seconds local-DB fallback candles are cached, so TV is retried soon
+INFLIGHT_WAIT_TIMEOUT = 60 # seconds a duplicate caller waits for the in-flight fetch
+MAX_CONCURRENT_FETCHES = 8 # parallel TV requests per batch, to stay under TV session rate limits
+BATCH_FETCH_RETRIES = 3
+TV_FAILURE_TTL = 30 # seconds to go straight to the local DB after tvDatafeed and Streamer both failed
+DELTA_MAX_BARS = 100 # refresh a stale cache with a delta fetch when at most this many bars are missing
+WS_FETCH_TIMEOUT = 20 # seconds for one websocket history download
+RESOLVE_CACHE_SIZE = 4096 # memoized symbol resolutions before the memo is reset
+_EPOCH = pd.Timestamp(0, tz='UTC')
+# One packed candle in the shared cache: ts, open, high, low, close, volume
+_CANDLE_STRUCT = struct.Struct('>qddddd')
+# Sink for the Streamer's chatty prints: discarded rather than buffered
+_DEVNULL = open(os.devnull, 'w')
+_IST = timezone(timedelta(hours=5, minutes=30), 'IST') # no DST, so a fixed offset is exact
+
+def _supports_cookies():
+    try:
+        return bool(TvDatafeed) and 'cookies' in inspect.signature(TvDatafeed.__init__).parameters
+    except (TypeError, ValueError):
+        return False
+
+# Checked once at import: only some tvDatafeed forks accept a cookie jar
+_TV_SUPPORTS_COOKIES = _supports_cookies()
+
+# Requested interval -> tvDatafeed Interval (anything else falls back to 1 minute)
+_TV_INTERVALS = {
+    '1': Interval.in_1_minute, '3': Interval.in_3_minute, '5': Interval.in_5_minute,
+    '15': Interval.in_15_minute, '30': Interval.in_30_minute, '45': Interval.in_45_minute,
+    '60': Interval.in_1_hour, '120': Interval.in_2_hour, '240': Interval.in_4_hour,
+    'D': Interval.in_daily, '1d': Interval.in_daily, 'W': Interval.in_weekly, '1w': Interval.in_weekly
+} if Interval else {}
+
+# Requested interval -> Streamer timeframe (other minute intervals map to '<n>m')
+_STREAMER_TIMEFRAMES = {
+    '1': '1m', '3': '3m', '5': '5m', '15': '15m', '30': '30m', '45': '45m',
+    '60': '1h', '120': '2h', '240': '4h',
+    'D': '1d', '1d': '1d', 'W': '1w', '1w': '1w'
+}
+
+# TradingView chart websocket (same protocol as tv_live_wss) used for non-blocking history downloads
+TV_WS_URL = "wss://data.tradingview.com/socket.io/websocket?type=chart"
+TV_WS_HEADERS = {
+    "Origin": "https://www.tradingview.com",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+# Requested interval -> chart session resolution (minute intervals pass through as-is)
+_TV_WS_RESOLUTIONS = {'D': '1D', '1d': '1D', 'W': '1W', '1w': '1W'}
+_TV_WS_ERRORS = ('symbol_error', 'series_error', 'critical_error', 'protocol_error')
+_TV_WS_SPLIT = re.compile(r"~m~\d+~m~")
+
+def _tv_ws_frame(func, params):
+    message = json.dumps({"m": func, "p": params}, separators=(',', ':'))
+    return f"~m~{len(message)}~m~{message}"
+
+def _parse_iso(ts):
+    """ISO-8601 string -> datetime, via the ciso8601 C parser when it is installed."""
+    if ciso8601:
+        return ciso8601.parse_datetime(ts)
+    return datetime.fromisoformat(ts.replace('Z', '+00:00'))
+
+def _cookie_dict(cookie):
+    """TV_COOKIE is either a raw 'k=v; k2=v2' header string or a cookie jar."""
+    if not cookie:
+        return {}
+    if isinstance(cookie, str):
+        pairs = (part.strip().split('=', 1) for part in cookie.split(';') if '=' in part)
+        return {k: v for k, v in pairs}
+    return {c.name: c.value for c in cookie}
+
+def _resolve_waiter(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Inflight:
+    """
+    One in-flight fetch. Blocking callers wait on the event; coroutines register a future on
+    their own loop instead, so waiting never parks an executor thread.
+    """
+    __slots__ = ('event', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.waiters = [] # (loop, future)
+
+
 class TradingViewAPI:
     def __init__(self):
         username = os.getenv('TV_USERNAME')
@@ -24,8 +137,7 @@ class TradingViewAPI:
         if TvDatafeed:
             # Safely initialize TvDatafeed based on supported arguments
             try:
-                sig = inspect.signature(TvDatafeed.__init__)
-                if 'cookies' in sig.parameters and TV_COOKIE:
+                if _TV_SUPPORTS_COOKIES and TV_COOKIE:
                     self.tv = TvDatafeed(username, password) if username and password else TvDatafeed(cookies=TV_COOKIE)
                     logger.info("TradingViewAPI initialized with tvDatafeed (using cookies)")
                 else:
@@ -38,6 +150,26 @@ class TradingViewAPI:
             self.tv = None
             logger.warning("tvDatafeed not installed, falling back to Streamer only")
 
+        # (exchange, symbol, interval) -> (fetched_at, candles newest first, bars requested, ttl)
+        self._candle_cache = {}
+        # (exchange, symbol, interval) -> _Inflight released when the fetch finishes
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        # symbol_or_hrn -> (mapping_version, (tv_exchange, tv_symbol, possible_keys))
+        self._resolve_cache = {}
+        # (exchange, symbol, interval) -> time both TV sources last failed for it
+        self._tv_failures = {}
+        # Optional second tier shared by all workers: one ZSET per cache key scored by bar time
+        self._redis = None
+        if redis and CANDLE_CACHE_REDIS_URL:
+            try:
+                self._redis = redis.Redis.from_url(CANDLE_CACHE_REDIS_URL, socket_timeout=0.5)
+                logger.info("TradingViewAPI sharing its candle cache via Redis")
+            except Exception as e:
+                logger.warning(f"Redis candle cache unavailable: {e}")
+        # Lazily created aiohttp session shared by all websocket history downloads
+        self._http = None
+        self._auth_token = None
         self._init_streamer()
 
     def _init_streamer(self):
@@ -47,160 +179,534 @@ class TradingViewAPI:
             logger.error(f"Failed to initialize TV Streamer: {e}")
             self.streamer = None
 
+    def _cache_ttl(self, interval_min):
+        return min(_INTERVAL_SECONDS.get(interval_min, 60), CANDLE_CACHE_MAX_TTL)
+
+    @staticmethod
+    def _covers(candles, requested, n_bars):
+        """
+        Whether cached candles answer a request for n_bars: either there are enough of them, or
+        the source returned fewer than it was asked for (all it has) and no more is asked now.
+        """
+        return len(candles) >= n_bars or (len(candles) < requested and n_bars <= requested)
+
+    def _get_cached(self, cache_key, interval_min, n_bars):
+        """Returns a copy of up to n_bars fresh cached candles, or None."""
+        cached = self._candle_cache.get(cache_key)
+        if cached and time.time() - cached[0] < cached[3] and self._covers(cached[1], cached[2], n_bars):
+            # Callers may edit candles in place, so never hand out the cached rows
+            return [list(c) for c in cached[1][:n_bars]]
+        if self._redis is not None:
+            return self._get_shared(cache_key, interval_min, n_bars)
+        return None
+
+    def _store_cached(self, cache_key, interval_min, candles, requested):
+        """
+        Caches candles (newest first) fetched for a request of `requested` bars, locally and, when
+        configured, for the other workers. While TV is marked down for the key the candles came
+        from the local DB, so they are kept only DB_FALLBACK_CACHE_TTL seconds.
+        """
+        ttl = DB_FALLBACK_CACHE_TTL if self._tv_down(cache_key) else self._cache_ttl(interval_min)
+        self._candle_cache[cache_key] = (time.time(), [list(c) for c in candles], requested, ttl)
+        if self._redis is None:
+            return
+        try:
+            key = self._redis_key(cache_key)
+            # Replace the whole series so a re-fetched forming bar never leaves a stale twin
+            pipe = self._redis.pipeline()
+            pipe.delete(key)
+            pipe.zadd(key, {_CANDLE_STRUCT.pack(int(c[0]), *map(float, c[1:6])): c[0] for c in candles})
+            pipe.expire(key, ttl)
+            pipe.set(key + ":requested", requested, ex=ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to share candles for {cache_key}: {e}")
+
+    def _get_shared(self, cache_key, interval_min, n_bars):
+        """Reads fresh candles another worker cached; the key's expiry doubles as the TTL."""
+        try:
+            key = self._redis_key(cache_key)
+            pipe = self._redis.pipeline()
+            pipe.zrevrange(key, 0, n_bars - 1)
+            pipe.pttl(key)
+            pipe.get(key + ":requested")
+            members, pttl, requested = pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to read shared candles for {cache_key}: {e}")
+            return None
+        requested = int(requested) if requested else n_bars
+        if pttl <= 0 or not members or not self._covers(members, requested, n_bars):
+            return None
+        candles = [list(_CANDLE_STRUCT.unpack(m)) for m in members]
+        # Adopt locally for what is left of the shared copy's TTL
+        self._candle_cache[cache_key] = (time.time(), [list(c) for c in candles], requested, pttl / 1000)
+        return candles
+
+    @staticmethod
+    def _redis_key(cache_key):
+        return "tv:candles:" + ":".join(cache_key)
+
+    def _resolve(self, symbol_or_hrn):
+        """
+        Returns (tv_exchange, tv_symbol, local DB keys to try) for a requested symbol,
+        memoized until the symbol mapper's mappings change.
+        """
+        version = symbol_mapper.mapping_version
+        entry = self._resolve_cache.get(symbol_or_hrn)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        # Centralized mapping to TV symbol (e.g. NSE:NIFTY)
+        tv_full_symbol = symbol_mapper.to_tv_symbol(symbol_or_hrn)
+        if ':' in tv_full_symbol:
+            parts = tv_full_symbol.split(':')
+            tv_exchange = parts[0].upper()
+            tv_symbol = parts[1].upper()
+        else:
+            tv_exchange = 'NSE'
+            tv_symbol = tv_full_symbol.upper()
+
+        # Try with multiple variations for matching, plus the Upstox mapped key
+        possible_keys = [symbol_or_hrn, f"{tv_exchange}:{tv_symbol}", tv_symbol, f"{tv_exchange}|{tv_symbol}"]
+        up_key = symbol_mapper.to_upstox_key(symbol_or_hrn)
+        if up_key not in possible_keys: possible_keys.append(up_key)
+
+        resolved = (tv_exchange, tv_symbol, tuple(possible_keys))
+        if len(self._resolve_cache) >= RESOLVE_CACHE_SIZE:
+            self._resolve_cache.clear()
+        self._resolve_cache[symbol_or_hrn] = (version, resolved)
+        return resolved
+
     def get_hist_candles(self, symbol_or_hrn, interval_min='1', n_bars=5000):
         try:
-            from core.symbol_mapper import symbol_mapper
             logger.info(f"Fetching historical candles for {symbol_or_hrn} (bars={n_bars})")
             if not symbol_or_hrn: return None
 
-            # Centralized mapping to TV symbol (e.g. NSE:NIFTY)
-            tv_full_symbol = symbol_mapper.to_tv_symbol(symbol_or_hrn)
+            tv_exchange, tv_symbol, _ = self._resolve(symbol_or_hrn)
+            logger.info(f"Mapped {symbol_or_hrn} -> {tv_exchange}:{tv_symbol}")
 
-            if ':' in tv_full_symbol:
-                parts = tv_full_symbol.split(':')
-                tv_exchange = parts[0].upper()
-                tv_symbol = parts[1].upper()
-            else:
-                tv_exchange = 'NSE'
-                tv_symbol = tv_full_symbol.upper()
+            # Serve repeat/overlapping requests from the cache while the newest bar is still fresh
+            cache_key = (tv_exchange, tv_symbol, str(interval_min))
+            candles = self._get_cached(cache_key, interval_min, n_bars)
+            if candles is not None:
+                logger.info(f"Serving {n_bars} cached candles for {tv_exchange}:{tv_symbol}")
+                return candles
 
-            logger.info(f"Mapped {symbol_or_hrn} -> {tv_exchange}:{tv_symbol}")
+            # Singleflight: concurrent callers for the same key wait for one fetch instead of each hitting TV
+            leader, flight = self._join_inflight(cache_key)
+            if not leader:
+                flight.event.wait(INFLIGHT_WAIT_TIMEOUT)
+                candles = self._get_cached(cache_key, interval_min, n_bars)
+                if candles is not None:
+                    logger.info(f"Served {tv_exchange}:{tv_symbol} from a concurrent fetch")
+                    return candles
+                # The other fetch failed or returned fewer bars than needed: fetch independently
+                return self._fetch_hist_candles(symbol_or_hrn, tv_exchange, tv_symbol, interval_min, n_bars)
 
-            # 1. Try tvDatafeed first for historical data (more stable for one-offs)
-            if self.tv:
-                try:
-                    tv_interval = Interval.in_1_minute
-                    if interval_min == '3': tv_interval = Interval.in_3_minute
-                    elif interval_min == '5': tv_interval = Interval.in_5_minute
-                    elif interval_min == '15': tv_interval = Interval.in_15_minute
-                    elif interval_min == '30': tv_interval = Interval.in_30_minute
-                    elif interval_min == '45': tv_interval = Interval.in_45_minute
-                    elif interval_min == '60': tv_interval = Interval.in_1_hour
-                    elif interval_min == '120': tv_interval = Interval.in_2_hour
-                    elif interval_min == '240': tv_interval = Interval.in_4_hour
-                    elif interval_min == 'D' or interval_min == '1d': tv_interval = Interval.in_daily
-                    elif interval_min == 'W' or interval_min == '1w': tv_interval = Interval.in_weekly
-
-                    # tvDatafeed can be sensitive to case and exchange
-                    df = self.tv.get_hist(symbol=tv_symbol, exchange=tv_exchange, interval=tv_interval, n_bars=n_bars)
-                    if df is not None and not df.empty:
-                        candles = []
-                        import pytz
-                        ist = pytz.timezone('Asia/Kolkata')
-                        for ts, row in df.iterrows():
-                            try:
-                                ts_ist = ist.localize(ts) if ts.tzinfo is None else ts.astimezone(ist)
-                                unix_ts = int(ts_ist.timestamp())
-                            except:
-                                unix_ts = int(ts.timestamp())
-
-                            candles.append([
-                                unix_ts,
-                                float(row['open']), float(row['high']), float(row['low']), float(row['close']),
-                                float(row['volume'])
-                            ])
-                        logger.info(f"Retrieved {len(candles)} candles via tvDatafeed for {tv_exchange}:{tv_symbol}")
-                        return candles[::-1] # Newest first
-                except Exception as tv_e:
-                    logger.warning(f"tvDatafeed failed for {tv_symbol}: {tv_e}")
-
-            # 2. Fallback to Streamer
             try:
-                tf = f"{interval_min}m"
-                if interval_min == 'D': tf = '1d'
-                elif interval_min == 'W': tf = '1w'
-                elif interval_min == '60': tf = '1h'
-                elif interval_min == '120': tf = '2h'
-                elif interval_min == '240': tf = '4h'
-
-                logger.info(f"Using timeframe {tf} for Streamer fallback (interval_min={interval_min})")
-                if not self.streamer: self._init_streamer()
-
-                with contextlib.redirect_stdout(io.StringIO()):
-                    stream = self.streamer.stream(
-                        exchange=tv_exchange,
-                        symbol=tv_symbol,
-                        timeframe=tf,
-                        numb_price_candles=n_bars
-                    )
-
-                data = None
-                for item in stream:
-                    if 'ohlc' in item:
-                        data = item
-                        break
-
-                if data and 'ohlc' in data:
-                    candles = []
-                    import pytz
-                    ist = pytz.timezone('Asia/Kolkata')
-                    for row in data['ohlc']:
-                        ts = row.get('timestamp') or row.get('datetime')
-                        if not isinstance(ts, (int, float)):
-                            try:
-                                # TradingView Scraper often returns timestamps in local exchange time
-                                # if they are string-formatted without offset.
-                                # For NSE, it's usually IST.
-                                dt = datetime.fromisoformat(ts.replace('Z', '+00:00'))
-                                if 'Z' not in ts and '+' not in ts:
-                                    # Assume it was IST if no offset provided
-                                    dt = ist.localize(dt.replace(tzinfo=None))
-                                ts = int(dt.timestamp())
-                            except Exception as e:
-                                logger.debug(f"TV Streamer timestamp parse error: {e}")
-
-                        candles.append([
-                            int(ts),
-                            float(row['open']), float(row['high']), float(row['low']), float(row['close']),
-                            float(row['volume'])
-                        ])
-                    logger.info(f"Retrieved {len(candles)} candles via Streamer")
-                    return candles[::-1] # Newest first
-            except Exception as e:
-                logger.warning(f"Streamer failed for {tv_symbol}: {e}")
+                candles = self._refresh_candles(cache_key, symbol_or_hrn, tv_exchange, tv_symbol, interval_min, n_bars)
+                if candles:
+                    self._store_cached(cache_key, interval_min, candles, n_bars)
+                    candles = candles[:n_bars]
+            finally:
+                self._release_inflight(cache_key, flight)
+            return candles
+        except Exception as e:
+            logger.error(f"Error fetching TradingView data: {e}")
+            return None
 
-            # 3. Final Fallback to Local DB (for Replay support or when TV is down)
+    def _join_inflight(self, cache_key):
+        """Returns (leader, flight): the first caller for a key leads the fetch, later ones wait on flight."""
+        with self._inflight_lock:
+            flight = self._inflight.get(cache_key)
+            if flight is not None:
+                return False, flight
+            flight = self._inflight[cache_key] = _Inflight()
+            return True, flight
+
+    def _release_inflight(self, cache_key, flight):
+        with self._inflight_lock:
+            self._inflight.pop(cache_key, None)
+            flight.event.set()
+            waiters, flight.waiters = flight.waiters, []
+        for loop, future in waiters:
             try:
-                from db.local_db import db
-                orig_key = symbol_or_hrn
-                # Try with multiple variations for matching
-                possible_keys = [orig_key, f"{tv_exchange}:{tv_symbol}", tv_symbol, f"{tv_exchange}|{tv_symbol}"]
-                # Also try Upstox mapped key
-                up_key = symbol_mapper.to_upstox_key(orig_key)
-                if up_key not in possible_keys: possible_keys.append(up_key)
-
-                res = None
-                for k in possible_keys:
-                    logger.info(f"Falling back to local DB for {k}")
-                    interval_map = {'1': 60, '5': 300, '15': 900, '30': 1800, '60': 3600, 'D': 86400}
-                    duration = interval_map.get(interval_min, 60)
-
-                    res = db.query(f"""
-                        SELECT
-                            (ts_ms / 1000 / {duration}) * {duration} as bucket,
-                            arg_min(price, ts_ms) as o,
-                            MAX(price) as h,
-                            MIN(price) as l,
-                            arg_max(price, ts_ms) as c,
-                            SUM(qty) as v
-                        FROM ticks
-                        WHERE instrumentKey = ?
-                        GROUP BY bucket
-                        ORDER BY bucket DESC
-                        LIMIT ?
-                    """, (k, n_bars))
-                    if res: break
-
-                if res:
-                    candles = [[int(r['bucket']), float(r['o']), float(r['h']), float(r['l']), float(r['c']), float(r['v'])] for r in res]
-                    logger.info(f"Retrieved {len(candles)} candles via local DB")
-                    return candles # Already newest first from query
-            except Exception as db_e:
-                logger.warning(f"Local DB fallback failed: {db_e}")
+                loop.call_soon_threadsafe(_resolve_waiter, future)
+            except RuntimeError:
+                pass # the waiter's loop is closed
+
+    async def _wait_inflight(self, flight):
+        """Waits up to INFLIGHT_WAIT_TIMEOUT for the fetch on the running loop, without a thread."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._inflight_lock:
+            if flight.event.is_set():
+                return
+            flight.waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, INFLIGHT_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+
+    def _delta_plan(self, cache_key, interval_min, n_bars):
+        """
+        Returns (history, needed) when the cache already holds enough history and at most
+        DELTA_MAX_BARS bars are missing since its newest bar, else (None, 0).
+        """
+        cached = self._candle_cache.get(cache_key)
+        if cached and self._covers(cached[1], cached[2], n_bars):
+            history = cached[1]
+            duration = _INTERVAL_SECONDS.get(interval_min, 60)
+            # +2 re-fetches the (possibly still forming) newest cached bar plus a safety bar
+            needed = max(2, int(time.time() - history[0][0]) // duration + 2)
+            if needed <= DELTA_MAX_BARS:
+                return history, needed
+        return None, 0
+
+    def _refresh_candles(self, cache_key, symbol_or_hrn, tv_exchange, tv_symbol, interval_min, n_bars):
+        """
+        Returns fresh candles (newest first). When the cache already holds enough history,
+        only the bars since its newest bar are downloaded and merged in front of it.
+        """
+        history, needed = self._delta_plan(cache_key, interval_min, n_bars)
+        if needed:
+            delta = self._fetch_hist_candles(symbol_or_hrn, tv_exchange, tv_symbol, interval_min, needed)
+            if delta:
+                return self._merge_delta(history, delta, tv_exchange, tv_symbol)
 
+        return self._fetch_hist_candles(symbol_or_hrn, tv_exchange, tv_symbol, interval_min, n_bars)
+
+    @staticmethod
+    def _merge_delta(history, delta, tv_exchange, tv_symbol):
+        """
+        Puts delta-fetched bars in front of the cached history (both newest first). A delta
+        older than the cache (e.g. from a stale local-DB fallback) is dropped, keeping the history.
+        """
+        if delta[0][0] < history[0][0]:
+            logger.info(f"Delta for {tv_exchange}:{tv_symbol} is older than the cache, keeping cached candles")
+            return history
+        oldest_new = delta[-1][0]
+        logger.info(f"Delta-fetched {len(delta)} candles for {tv_exchange}:{tv_symbol}")
+        return (delta + [c for c in history if c[0] < oldest_new])[:len(history)]
+
+    def _tv_down(self, failure_key):
+        """When both TV sources failed for the key within TV_FAILURE_TTL, the failure time, else None."""
+        failed_at = self._tv_failures.get(failure_key)
+        if failed_at is not None and time.time() - failed_at < TV_FAILURE_TTL:
+            return failed_at
+        return None
+
+    def _fetch_hist_candles(self, symbol_or_hrn, tv_exchange, tv_symbol, interval_min, n_bars):
+        """
+        Fetches candles (newest first) via tvDatafeed, then Streamer, then the local DB.
+        After both TV sources fail for a key, TV is skipped for TV_FAILURE_TTL seconds so
+        an outage costs a DB query instead of two TV timeouts per request.
+        """
+        try:
+            failure_key = (tv_exchange, tv_symbol, str(interval_min))
+            failed_at = self._tv_down(failure_key)
+            if failed_at is None:
+                candles = self._fetch_from_tv(tv_exchange, tv_symbol, interval_min, n_bars)
+                if candles:
+                    self._tv_failures.pop(failure_key, None)
+                    return candles
+                self._tv_failures[failure_key] = time.time()
+            else:
+                logger.info(f"Skipping TV for {tv_exchange}:{tv_symbol}, it failed {time.time() - failed_at:.0f}s ago")
+
+            # 3. Final Fallback to Local DB (for Replay support or when TV is down)
+            return self._fetch_from_db(symbol_or_hrn, interval_min, n_bars)
+        except Exception as e:
+            logger.error(f"Error fetching TradingView data: {e}")
             return None
+
+    def _fetch_from_tv(self, tv_exchange, tv_symbol, interval_min, n_bars):
+        """Candles (newest first) from tvDatafeed, then the Streamer, or None."""
+        # 1. Try tvDatafeed first for historical data (more stable for one-offs)
+        if self.tv:
+            try:
+                tv_interval = _TV_INTERVALS.get(interval_min, Interval.in_1_minute)
+
+                # tvDatafeed can be sensitive to case and exchange
+                df = self.tv.get_hist(symbol=tv_symbol, exchange=tv_exchange, interval=tv_interval, n_bars=n_bars)
+                if df is not None and not df.empty:
+                    # Columnar conversion: naive bar times are IST, aware ones are converted
+                    idx = pd.DatetimeIndex(df.index)
+                    idx = idx.tz_localize('Asia/Kolkata') if idx.tz is None else idx.tz_convert('Asia/Kolkata')
+                    # Reversed array views, so the rows come out newest first without a second list
+                    unix_ts = ((idx - _EPOCH) // pd.Timedelta(seconds=1)).to_numpy()[::-1].tolist()
+                    ohlcv = df[['open', 'high', 'low', 'close', 'volume']].to_numpy(dtype=np.float64)[::-1].tolist()
+                    candles = [[ts, *row] for ts, row in zip(unix_ts, ohlcv)]
+                    logger.info(f"Retrieved {len(candles)} candles via tvDatafeed for {tv_exchange}:{tv_symbol}")
+                    return candles
+            except Exception as tv_e:
+                logger.warning(f"tvDatafeed failed for {tv_symbol}: {tv_e}")
+
+        # 2. Fallback to Streamer
+        try:
+            tf = _STREAMER_TIMEFRAMES.get(interval_min) or f"{interval_min}m"
+
+            logger.info(f"Using timeframe {tf} for Streamer fallback (interval_min={interval_min})")
+            if not self.streamer: self._init_streamer()
+
+            with contextlib.redirect_stdout(_DEVNULL):
+                stream = self.streamer.stream(
+                    exchange=tv_exchange,
+                    symbol=tv_symbol,
+                    timeframe=tf,
+                    numb_price_candles=n_bars
+                )
+
+            data = None
+            for item in stream:
+                if 'ohlc' in item:
+                    data = item
+                    break
+
+            if data and 'ohlc' in data:
+                candles = []
+                # Rows arrive oldest first; walk them backwards to build the list newest first
+                for row in reversed(data['ohlc']):
+                    ts = row.get('timestamp') or row.get('datetime')
+                    if not isinstance(ts, (int, float)):
+                        try:
+                            # TradingView Scraper often returns timestamps in local exchange time
+                            # if they are string-formatted without offset.
+                            # For NSE, it's usually IST.
+                            dt = _parse_iso(ts)
+                            if dt.tzinfo is None:
+                                # Assume it was IST if no offset provided
+                                dt = dt.replace(tzinfo=_IST)
+                            ts = int(dt.timestamp())
+                        except Exception as e:
+                            logger.debug(f"TV Streamer timestamp parse error: {e}")
+
+                    candles.append([
+                        int(ts),
+                        float(row['open']), float(row['high']), float(row['low']), float(row['close']),
+                        float(row['volume'])
+                    ])
+                logger.info(f"Retrieved {len(candles)} candles via Streamer")
+                return candles
+        except Exception as e:
+            logger.warning(f"Streamer failed for {tv_symbol}: {e}")
+
+        return None
+
+    def _fetch_from_db(self, symbol_or_hrn, interval_min, n_bars):
+        """Candles (newest first) aggregated from locally recorded ticks, or None."""
+        try:
+            possible_keys = self._resolve(symbol_or_hrn)[2]
+
+            logger.info(f"Falling back to local DB for {possible_keys}")
+            duration = _INTERVAL_SECONDS.get(interval_min, 60)
+            placeholders = ", ".join("?" * len(possible_keys))
+            priority = " ".join(f"WHEN ? THEN {i}" for i in range(len(possible_keys)))
+
+            # One statement: pick the first candidate key that has ticks, then bucket its ticks
+            res = db.query_df(f"""
+                SELECT
+                    (ts_ms // 1000 // {duration}) * {duration} as bucket,
+                    arg_min(price, ts_ms) as o,
+                    MAX(price) as h,
+                    MIN(price) as l,
+                    arg_max(price, ts_ms) as c,
+                    SUM(qty) as v
+                FROM ticks
+                WHERE instrumentKey = (
+                    SELECT instrumentKey
+                    FROM ticks
+                    WHERE instrumentKey IN ({placeholders})
+                    GROUP BY instrumentKey
+                    ORDER BY CASE instrumentKey {priority} END
+                    LIMIT 1
+                )
+                GROUP BY bucket
+                ORDER BY bucket DESC
+                LIMIT ?
+            """, (*possible_keys, *possible_keys, n_bars))
+
+            if not res.empty:
+                # Columnar conversion straight from the result frame
+                buckets = res['bucket'].to_numpy(dtype=np.int64).tolist()
+                ohlcv = res[['o', 'h', 'l', 'c', 'v']].to_numpy(dtype=np.float64).tolist()
+                candles = [[ts, *row] for ts, row in zip(buckets, ohlcv)]
+                logger.info(f"Retrieved {len(candles)} candles via local DB")
+                return candles # Already newest first from query
+        except Exception as db_e:
+            logger.warning(f"Local DB fallback failed: {db_e}")
+
+        return None
+
+    async def get_hist_candles_async(self, symbol_or_hrn, interval_min='1', n_bars=5000):
+        """
+        Event-loop variant of get_hist_candles: same cache, singleflight and delta refresh,
+        but TV is downloaded over aiohttp without a worker thread. The blocking
+        tvDatafeed/Streamer/DB chain only runs (on a thread) when the websocket fails.
+        """
+        if not aiohttp:
+            return await asyncio.to_thread(self.get_hist_candles, symbol_or_hrn, interval_min, n_bars)
+        try:
+            if not symbol_or_hrn: return None
+
+            tv_exchange, tv_symbol, _ = self._resolve(symbol_or_hrn)
+            cache_key = (tv_exchange, tv_symbol, str(interval_min))
+            candles = self._get_cached(cache_key, interval_min, n_bars)
+            if candles is not None:
+                return candles
+
+            leader, flight = self._join_inflight(cache_key)
+            if not leader:
+                await self._wait_inflight(flight)
+                candles = self._get_cached(cache_key, interval_min, n_bars)
+                if candles is not None:
+                    logger.info(f"Served {tv_exchange}:{tv_symbol} from a concurrent fetch")
+                    return candles
+                return await self._fetch_hist_candles_async(symbol_or_hrn, tv_exchange, tv_symbol, interval_min, n_bars)
+
+            try:
+                candles = await self._refresh_candles_async(cache_key, symbol_or_hrn, tv_exchange, tv_symbol, interval_min, n_bars)
+                if candles:
+                    self._store_cached(cache_key, interval_min, candles, n_bars)
+                    candles = candles[:n_bars]
+            finally:
+                self._release_inflight(cache_key, flight)
+            return candles
         except Exception as e:
             logger.error(f"Error fetching TradingView data: {e}")
             return None
 
+    async def _refresh_candles_async(self, cache_key, symbol_or_hrn, tv_exchange, tv_symbol, interval_min, n_bars):
+        history, needed = self._delta_plan(cache_key, interval_min, n_bars)
+        if needed:
+            delta = await self._fetch_hist_candles_async(symbol_or_hrn, tv_exchange, tv_symbol, interval_min, needed)
+            if delta:
+                return self._merge_delta(history, delta, tv_exchange, tv_symbol)
+
+        return await self._fetch_hist_candles_async(symbol_or_hrn, tv_exchange, tv_symbol, interval_min, n_bars)
+
+    async def _fetch_hist_candles_async(self, symbol_or_hrn, tv_exchange, tv_symbol, interval_min, n_bars):
+        """
+        Websocket variant of _fetch_hist_candles, sharing its TV failure cache: while TV is
+        marked down only the local DB is queried, and a websocket failure falls back to the
+        blocking chain, which records the failure if tvDatafeed and Streamer fail too.
+        """
+        failure_key = (tv_exchange, tv_symbol, str(interval_min))
+        failed_at = self._tv_down(failure_key)
+        if failed_at is not None:
+            logger.info(f"Skipping TV for {tv_exchange}:{tv_symbol}, it failed {time.time() - failed_at:.0f}s ago")
+            return await asyncio.to_thread(self._fetch_from_db, symbol_or_hrn, interval_min, n_bars)
+
+        try:
+            candles = await self._fetch_hist_ws(tv_exchange, tv_symbol, interval_min, n_bars)
+            if candles:
+                logger.info(f"Retrieved {len(candles)} candles via websocket for {tv_exchange}:{tv_symbol}")
+                self._tv_failures.pop(failure_key, None)
+                return candles
+        except Exception as e:
+            logger.warning(f"Websocket history fetch failed for {tv_exchange}:{tv_symbol}: {e}")
+        return await asyncio.to_thread(self._fetch_hist_candles, symbol_or_hrn, tv_exchange, tv_symbol, interval_min, n_bars)
+
+    async def _get_http(self):
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(headers=TV_WS_HEADERS, cookies=_cookie_dict(TV_COOKIE))
+        return self._http
+
+    async def _get_auth_token(self, http):
+        """
+        Resolves the chart auth token once per process; anonymous sessions get delayed data.
+        A failed lookup with a cookie is not memoized, so the next fetch retries it.
+        """
+        if self._auth_token is not None:
+            return self._auth_token
+        if not TV_COOKIE:
+            self._auth_token = "unauthorized_user_token"
+            return self._auth_token
+        try:
+            async with http.get("https://www.tradingview.com/", timeout=aiohttp.ClientTimeout(total=15)) as resp:
+                match = re.search(r'"auth_token":"(.*?)"', await resp.text())
+                if match:
+                    self._auth_token = match.group(1)
+                    return self._auth_token
+                logger.warning("No auth_token on the TV page, using an anonymous session for now")
+        except Exception as e:
+            logger.warning(f"Failed to fetch TV auth token: {e}")
+        return "unauthorized_user_token"
+
+    async def _fetch_hist_ws(self, tv_exchange, tv_symbol, interval_min, n_bars):
+        """Downloads n_bars candles (newest first) over one chart websocket session."""
+        http = await self._get_http()
+        token = await self._get_auth_token(http)
+        session = "cs_" + "".join(random.choices(string.ascii_lowercase + string.digits, k=12))
+        resolution = _TV_WS_RESOLUTIONS.get(interval_min, str(interval_min))
+        symbol_spec = "=" + json.dumps({"symbol": f"{tv_exchange}:{tv_symbol}", "adjustment": "splits"})
+        bars = {}
+
+        async with http.ws_connect(TV_WS_URL, heartbeat=None) as ws:
+            for func, params in (
+                ("set_auth_token", [token]),
+                ("chart_create_session", [session, ""]),
+                ("resolve_symbol", [session, "sds_sym_1", symbol_spec]),
+                ("create_series", [session, "sds_1", "s1", "sds_sym_1", resolution, n_bars, ""]),
+            ):
+                await ws.send_str(_tv_ws_frame(func, params))
+
+            async def read_series():
+                async for msg in ws:
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        # A close or error before series_completed leaves a partial series
+                        raise ConnectionError(f"TV websocket ended with {msg.type.name} before series_completed")
+                    for payload in _TV_WS_SPLIT.split(msg.data):
+                        if not payload:
+                            continue
+                        if payload.startswith("~h~"):
+                            # Echo heartbeats or TV drops the connection
+                            await ws.send_str(f"~m~{len(payload)}~m~{payload}")
+                            continue
+                        data = json.loads(payload)
+                        m = data.get("m")
+                        p = data.get("p", [])
+                        if m == "timescale_update" and len(p) > 1:
+                            for item in p[1].get("sds_1", {}).get("s", []):
+                                v = item["v"]
+                                # Indices carry no volume column
+                                bars[int(v[0])] = [int(v[0]), float(v[1]), float(v[2]), float(v[3]), float(v[4]),
+                                                   float(v[5]) if len(v) > 5 else 0.0]
+                        elif m == "series_completed":
+                            return
+                        elif m in _TV_WS_ERRORS:
+                            raise RuntimeError(f"{m}: {p}")
+                raise ConnectionError("TV websocket closed before series_completed")
+
+            await asyncio.wait_for(read_series(), WS_FETCH_TIMEOUT)
+
+        return [bars[ts] for ts in sorted(bars, reverse=True)]
+
+    async def close(self):
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+        self._http = None
+
+    async def get_hist_candles_many(self, symbols, interval_min='1', n_bars=5000):
+        """
+        Fetches candles for many symbols concurrently (bounded), retrying failed
+        symbols with jittered exponential backoff. Returns {symbol: candles or None}.
+        """
+        sem = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+
+        async def fetch(symbol):
+            for attempt in range(BATCH_FETCH_RETRIES):
+                async with sem:
+                    candles = await self.get_hist_candles_async(symbol, interval_min, n_bars)
+                if candles:
+                    return candles
+                if attempt < BATCH_FETCH_RETRIES - 1:
+                    # Back off outside the semaphore so other symbols keep flowing
+                    await asyncio.sleep(random.uniform(0, 2 ** attempt))
+            logger.warning(f"Batch fetch gave up on {symbol} after {BATCH_FETCH_RETRIES} attempts")
+            return None
+
+        results = await asyncio.gather(*(fetch(s) for s in symbols))
+        return dict(zip(symbols, results))
+
 tv_api = TradingViewAPI()
@@ -1,5 +1,4 @@
 
-import asyncio
 import sys
 import os
 
@@ -10,7 +9,7 @@ from symmetry_engine.strategy import StrategyEngine
 from core.options_manager import options_manager
 from core.greeks_calculator import greeks_calculator
 
-async def test_components():
+def test_components():
     print("Testing Greeks Calculator...")
     greeks = greeks_calculator.calculate_all_greeks(25000, 25000, 0.01, 0.20, 'call', 200)
     print(f"Greeks: {greeks}")
@@ -29,4 +28,4 @@ async def test_components():
     print("\nSmoke test passed!")
 
 if __name__ == "__main__":
-    asyncio.run(test_components())
+    test_components()
@@ -38,6 +38,8 @@ class DataManager {
         });
 
         this.socket.on('chart_update', (data) => {
+            // Binary frames are msgpack-encoded (UI_CONFIG.binary_chart_updates)
+            if (data instanceof ArrayBuffer) data = MessagePack.decode(new Uint8Array(data));
             const key = (data.instrumentKey || "").toUpperCase();
             const interval = String(data.interval || "");
             this.engine.charts.forEach(c => {
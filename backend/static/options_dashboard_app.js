@@ -61,6 +61,8 @@ class OptionsDashboardManager {
         });
 
         this.socket.on('chart_update', (data) => {
+            // Binary frames are msgpack-encoded (UI_CONFIG.binary_chart_updates)
+            if (data instanceof ArrayBuffer) data = MessagePack.decode(new Uint8Array(data));
             this.underlyings.forEach(u => {
                 if (data.instrumentKey === u && data.ohlcv?.length > 0) {
                     const prefix = u.includes('BANK') ? 'banknifty' : 'nifty';
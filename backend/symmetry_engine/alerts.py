@@ -1,25 +1,56 @@
 import aiohttp
+import asyncio
+import json
 import os
+import time
 import datetime
 from .database import get_session, Notification, AppSetting
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FLUSH_INTERVAL = 0.2 # seconds to collect an alert burst before one DB commit / Telegram message
+TELEGRAM_MAX_LEN = 4096 # Telegram sendMessage text limit
+TELEGRAM_KEEPALIVE = 60 # seconds an idle connection to Telegram is kept open for the next alert
+ALERTS_ENABLED_TTL = 30 # seconds the ENABLE_ALERTS setting is cached between DB reads
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Shared across AlertManager instances; the TTL also covers writes from another process
+_ENABLED_CACHE = {'value': None, 'ts': 0.0}
+
+def invalidate_alerts_enabled():
+    """Drops the cached ENABLE_ALERTS value after the setting is written."""
+    _ENABLED_CACHE['value'] = None
 
 class AlertManager:
     def __init__(self):
         self.bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
         self.chat_id = os.getenv('TELEGRAM_CHAT_ID')
+        # Created lazily on the running loop by the first notification
+        self._queue = None
+        self._flusher_task = None
+        # Alerts the flusher has taken off the queue but not saved yet, flushed by close() too
+        self._batch = []
+        self._closed = False
+        # One keep-alive session for every Telegram send, so alerts skip DNS + TLS setup
+        self._http = None
 
     def check_alerts_enabled(self):
+        now = time.time()
+        if _ENABLED_CACHE['value'] is not None and now - _ENABLED_CACHE['ts'] < ALERTS_ENABLED_TTL:
+            return _ENABLED_CACHE['value']
+
         session = get_session()
         try:
             setting = session.query(AppSetting).filter_by(key='ENABLE_ALERTS').first()
-            if setting and setting.value == 'True':
-                return True
             # Default to True if not set
-            if not setting:
-                return True
-            return False
+            enabled = not setting or setting.value == 'True'
         finally:
             session.close()
+        _ENABLED_CACHE['value'] = enabled
+        _ENABLED_CACHE['ts'] = now
+        return enabled
 
     async def send_notification(self, message):
         if not self.check_alerts_enabled():
@@ -27,30 +58,98 @@ class AlertManager:
 
         print(f"ALERT: {message}")
 
-        # Save to DB for dashboard
+        if self._closed:
+            # Shutting down: keep the alert for the dashboard, but start no new flusher
+            self._save_batch([(message, datetime.datetime.utcnow())])
+            return
+
+        # Persisting and delivery happen in batches on the background flusher
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._flusher_task is None or self._flusher_task.done():
+            self._flusher_task = asyncio.create_task(self._flusher())
+        self._queue.put_nowait((message, datetime.datetime.utcnow()))
+
+    async def _flusher(self):
+        while True:
+            # Sleep until an alert arrives, then give the rest of the burst a moment to queue up
+            self._batch = [await self._queue.get()]
+            await asyncio.sleep(FLUSH_INTERVAL)
+            batch, self._batch = self._batch + self._drain_queue(), []
+            await self._deliver(batch)
+
+    def _drain_queue(self):
+        batch = []
+        while self._queue is not None and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _deliver(self, batch):
+        self._save_batch(batch)
+        for text in self._chunk_messages(message for message, _ in batch):
+            await self._send_telegram(text)
+
+    @staticmethod
+    def _chunk_messages(messages):
+        """Joins alerts into as few Telegram messages as fit the length limit."""
+        chunk = ""
+        for message in messages:
+            message = message[:TELEGRAM_MAX_LEN]
+            if chunk and len(chunk) + 2 + len(message) > TELEGRAM_MAX_LEN:
+                yield chunk
+                chunk = message
+            else:
+                chunk = f"{chunk}\n\n{message}" if chunk else message
+        if chunk:
+            yield chunk
+
+    def _save_batch(self, batch):
+        # Save to DB for dashboard, one commit per burst
         session = get_session()
         try:
-            notification = Notification(message=message, timestamp=datetime.datetime.utcnow())
-            session.add(notification)
+            session.add_all([Notification(message=message, timestamp=ts) for message, ts in batch])
             session.commit()
         except Exception as e:
-            print(f"Error saving notification to DB: {e}")
+            print(f"Error saving notifications to DB: {e}")
         finally:
             session.close()
 
+    async def _send_telegram(self, text):
         # Optional: Keep Telegram as secondary if configured, but prioritizing dashboard now
         if self.bot_token and self.chat_id:
             url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
             payload = {
                 "chat_id": self.chat_id,
-                "text": message,
+                "text": text,
                 "parse_mode": "HTML"
             }
+            # Encode once here rather than through aiohttp's stdlib json encoder
+            body = orjson.dumps(payload) if orjson else json.dumps(payload).encode()
 
             try:
-                async with aiohttp.ClientSession() as session_http:
-                    async with session_http.post(url, json=payload) as resp:
-                        if resp.status != 200:
-                            pass
+                if self._http is None or self._http.closed:
+                    self._http = aiohttp.ClientSession(
+                        connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=TELEGRAM_KEEPALIVE)
+                    )
+                async with self._http.post(url, data=body, headers=_JSON_HEADERS) as resp:
+                    if resp.status != 200:
+                        pass
             except Exception as e:
                 print(f"Error sending telegram alert: {e}")
+
+    async def close(self):
+        """Stops the flusher, delivers the alerts still pending, then closes the Telegram session."""
+        self._closed = True
+        if self._flusher_task is not None and not self._flusher_task.done():
+            self._flusher_task.cancel()
+            try:
+                await self._flusher_task
+            except asyncio.CancelledError:
+                pass
+        self._flusher_task = None
+        batch, self._batch = self._batch + self._drain_queue(), []
+        if batch:
+            await self._deliver(batch)
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+        self._http = None
@@ -1,12 +1,27 @@
 import pandas as pd
+import numpy as np
 import datetime
 import asyncio
+import hashlib
+import logging
+import os
+import re
+from sqlalchemy import event
 from .data_provider import DataProvider
-from .strategy import StrategyEngine
+from .strategy import StrategyEngine, SWING_HIGH
 from .database import get_session, Trade, Signal, ReferenceLevel, Candle
 from .execution import ExecutionEngine
 from .risk_manager import RiskManager
 from config import SYMMETRY_INDICES as INDICES, SYMMETRY_ENABLE_INDEX_SYNC as ENABLE_INDEX_SYNC
+try:
+    import pyarrow # parquet engine for the on-disk history cache
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+IST_OFFSET = np.timedelta64(19800, 's') # UTC -> IST (+5:30)
+HIST_FETCH_CONCURRENCY = 8 # historical requests in flight at once while prefetching a backtest range
 
 class Backtester:
     def __init__(self, index_name, db_path=None):
@@ -14,15 +29,19 @@ class Backtester:
         self.data_provider = DataProvider()
 
         # Use a separate database for backtest results to avoid destroying live data
-        from .database import create_engine, sessionmaker, Base
-        import os
+        from .database import create_engine, sessionmaker, Base, set_sqlite_pragmas
 
         self.db_path = db_path or "data/backtest_results.db"
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         self.engine = create_engine(f'sqlite:///{self.db_path}')
+        # Results are rebuilt on every run; same WAL + NORMAL sync tuning as the live DB
+        event.listen(self.engine, 'connect', set_sqlite_pragmas)
         self.Session = sessionmaker(bind=self.engine)
         Base.metadata.create_all(self.engine)
 
+        # Completed days of history, kept next to the results DB so repeated runs skip the provider
+        self.history_cache_dir = os.path.join(os.path.dirname(self.db_path), "backtest_cache")
+
         def bt_session_factory():
             return self.Session()
 
@@ -32,6 +51,7 @@ class Backtester:
         self.execution = ExecutionEngine(session_factory=bt_session_factory)
         self.risk_manager = RiskManager()
         self.params = {}
+        self.history = {} # (instrument_key, date_str) -> day of 1m candles, filled per run
 
     def apply_params(self):
         """Applies dynamic parameters to all engines."""
@@ -51,6 +71,128 @@ class Backtester:
     def get_backtest_session(self):
         return self.Session()
 
+    def save_signals(self, signals):
+        """Persists a day's traded signals in a single transaction."""
+        if not signals:
+            return
+        session = self.get_backtest_session()
+        try:
+            session.bulk_save_objects(signals)
+            session.commit()
+        except Exception as e:
+            print(f"Error saving backtest signals: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    async def prefetch_history(self, pairs):
+        """Fetches single-day history for (instrument_key, date_str) pairs concurrently into self.history."""
+        pairs = [p for p in dict.fromkeys(pairs) if p not in self.history]
+        for pair in pairs:
+            df = self.read_cached_history(*pair)
+            if df is not None:
+                self.history[pair] = df
+        pairs = [p for p in pairs if p not in self.history]
+        if not pairs:
+            return
+        semaphore = asyncio.Semaphore(HIST_FETCH_CONCURRENCY)
+
+        async def fetch(key, date_str):
+            async with semaphore:
+                return await self.data_provider.get_historical_data(key, from_date=date_str, to_date=date_str)
+
+        results = await asyncio.gather(*(fetch(key, date_str) for key, date_str in pairs))
+        self.history.update(zip(pairs, results))
+        for (key, date_str), df in zip(pairs, results):
+            if df is not None:
+                self.write_cached_history(key, date_str, df)
+
+    def history_cache_path(self, key, date_str):
+        # Keys like 'NSE_INDEX|Nifty 50' are not valid file names; the digest keeps sanitised names unique
+        safe_key = re.sub(r'[^\w.-]', '_', key)
+        digest = hashlib.md5(key.encode()).hexdigest()[:8]
+        return os.path.join(self.history_cache_dir, f"{safe_key}_{digest}_{date_str}.parquet")
+
+    def read_cached_history(self, key, date_str):
+        if pyarrow is None:
+            return None
+        path = self.history_cache_path(key, date_str)
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_parquet(path)
+        except Exception as e:
+            print(f"Error reading cached history {path}: {e}")
+            return None
+
+    def write_cached_history(self, key, date_str, df):
+        # Only finished days are cached; today's candles are still coming in
+        if pyarrow is None or date_str >= datetime.datetime.now().strftime('%Y-%m-%d'):
+            return
+        try:
+            os.makedirs(self.history_cache_dir, exist_ok=True)
+            df.to_parquet(self.history_cache_path(key, date_str), index=False)
+        except Exception as e:
+            print(f"Error caching history for {key} on {date_str}: {e}")
+
+    def clear_history_cache(self):
+        """Deletes the on-disk history cache; clean_db leaves it alone so reruns stay cheap."""
+        if not os.path.isdir(self.history_cache_dir):
+            return
+        for name in os.listdir(self.history_cache_dir):
+            if name.endswith('.parquet'):
+                os.remove(os.path.join(self.history_cache_dir, name))
+
+    async def discover_instruments(self, date_str):
+        """Finds the day's ATM instruments from the index price at market open."""
+        index_key = INDICES[self.index_name]['index_key']
+        idx_morning = self.history.get((index_key, date_str))
+
+        # If today and empty, try to get LTP for discovery
+        if (idx_morning is None or idx_morning.empty) and date_str == datetime.datetime.now().strftime('%Y-%m-%d'):
+            print(f"No historical data for today ({date_str}), using live LTP for discovery...")
+            quotes = self.data_provider.get_market_quote([index_key])
+            if quotes and index_key in quotes:
+                open_price = quotes[index_key].last_price
+            else:
+                return None
+        elif idx_morning is not None and not idx_morning.empty:
+            # Upstox returns candles sorted DESC usually, let's sort ASC
+            idx_morning = idx_morning.sort_values('timestamp')
+            open_price = idx_morning.iloc[0]['close']
+        else:
+            return None
+
+        # We need ATM at open (approx 9:15-9:20)
+
+        # Use morning price to find instruments for the day
+        # Mocking ltp for discovery
+        original_ltp_method = self.data_provider.get_market_quote
+        self.data_provider.get_market_quote = lambda x: {index_key: type('obj', (object,), {'last_price': open_price})}
+
+        details = await self.data_provider.get_instrument_details(self.index_name, reference_date=date_str)
+        self.data_provider.get_market_quote = original_ltp_method # Restore
+        return details
+
+    @staticmethod
+    def timestamp_indexed(df, suffix):
+        """Indexes a candle frame by timestamp and suffixes its columns for the combined day frame."""
+        return df.drop_duplicates('timestamp').set_index('timestamp').add_suffix(f'_{suffix}')
+
+    @staticmethod
+    def column_lists(frame, suffix):
+        """The open/high/low/close columns of one suffixed instrument, as plain lists indexed by bar."""
+        return tuple(frame[f'{field}_{suffix}'].tolist() for field in ('open', 'high', 'low', 'close'))
+
+    @staticmethod
+    def day_keys(details):
+        """Instrument keys a day's simulation reads: index, future and the full option chain."""
+        keys = [details['index'], details['fut']]
+        for opt in details['option_chain']:
+            keys.append(opt['ce'])
+            keys.append(opt['pe'])
+        return keys
+
     def clean_db(self):
         print(f"Cleaning backtest database at {self.db_path}...")
         session = self.get_backtest_session()
@@ -78,135 +220,173 @@ class Backtester:
         date_range = pd.date_range(start=start_dt, end=to_date)
         all_combined = []
 
-        for current_date in date_range:
+        # Fetch every day's history up front in two wide batches instead of day by day:
+        # first the index candles (needed for instrument discovery), then each day's instruments
+        self.history = {}
+        date_strs = [d.strftime('%Y-%m-%d') for d in date_range]
+        index_key = INDICES[self.index_name]['index_key']
+        sync_keys = [cfg['index_key'] for name, cfg in INDICES.items() if name != self.index_name] if enable_sync else []
+        await self.prefetch_history([(k, d) for d in date_strs for k in [index_key, *sync_keys]])
+
+        day_details = {}
+        for date_str in date_strs:
+            details = await self.discover_instruments(date_str)
+            if details:
+                day_details[date_str] = details
+        logger.debug("Fetching historical data for %d days in parallel...", len(day_details))
+        await self.prefetch_history([(k, d) for d, details in day_details.items() for k in self.day_keys(details)])
+
+        for current_date, date_str in zip(date_range, date_strs):
             is_warmup = current_date < pd.to_datetime(from_date)
-            date_str = current_date.strftime('%Y-%m-%d')
-            print(f"Processing date: {date_str}")
+            logger.debug("Processing date: %s", date_str)
 
             # Reset strategy state for the new day
             for engine in self.engines.values():
                 engine.reference_levels = {'High': None, 'Low': None}
                 engine.reset_trailing_sl()
 
-            # 1. Fetch historical data for Index to get ATM at market open
-            idx_morning = await self.data_provider.get_historical_data(INDICES[self.index_name]['index_key'], from_date=date_str, to_date=date_str)
-
-            # If today and empty, try to get LTP for discovery
-            if (idx_morning is None or idx_morning.empty) and date_str == datetime.datetime.now().strftime('%Y-%m-%d'):
-                print(f"No historical data for today ({date_str}), using live LTP for discovery...")
-                quotes = self.data_provider.get_market_quote([INDICES[self.index_name]['index_key']])
-                if quotes and INDICES[self.index_name]['index_key'] in quotes:
-                    open_price = quotes[INDICES[self.index_name]['index_key']].last_price
-                else:
-                    continue
-            elif idx_morning is not None and not idx_morning.empty:
-                # Upstox returns candles sorted DESC usually, let's sort ASC
-                idx_morning = idx_morning.sort_values('timestamp')
-                open_price = idx_morning.iloc[0]['close']
-            else:
-                continue
-
-            # We need ATM at open (approx 9:15-9:20)
-
-            # Use morning price to find instruments for the day
-            # Mocking ltp for discovery
-            original_ltp_method = self.data_provider.get_market_quote
-            self.data_provider.get_market_quote = lambda x: {INDICES[self.index_name]['index_key']: type('obj', (object,), {'last_price': open_price})}
-
-            details = await self.data_provider.get_instrument_details(self.index_name, reference_date=date_str)
-            self.data_provider.get_market_quote = original_ltp_method # Restore
-
+            details = day_details.get(date_str)
             if not details:
                 continue
 
-            print(f"Instruments for {date_str}: CE={details['ce']}, PE={details['pe']}, ATM={details['strike']}")
+            logger.debug("Instruments for %s: CE=%s, PE=%s, ATM=%s", date_str, details['ce'], details['pe'], details['strike'])
 
-            idx_hist = await self.data_provider.get_historical_data(details['index'], from_date=date_str, to_date=date_str)
+            idx_hist = self.history[(details['index'], date_str)]
 
             # Fetch other index data if sync is enabled
             other_indices_hist = {}
-            if ENABLE_INDEX_SYNC:
+            if enable_sync:
                 for name, cfg in INDICES.items():
                     if name != self.index_name:
-                        oh = await self.data_provider.get_historical_data(cfg['index_key'], from_date=date_str, to_date=date_str)
+                        oh = self.history[(cfg['index_key'], date_str)]
                         if oh is not None:
                             other_indices_hist[name] = oh
 
-            # To support dynamic strike updates, we fetch the whole 7-strike chain
-            # Also fetch data for any active positions carried over from previous day
+            # To support dynamic strike updates, the whole 7-strike chain was prefetched;
+            # positions carried over from the previous day may still need their keys fetched
             chain_data = {}
             target_keys = set()
             for opt in details['option_chain']:
                 target_keys.add(opt['ce'])
                 target_keys.add(opt['pe'])
 
-            # Add keys from active positions
             for pos in self.execution.positions.values():
-                if pos.get('ce_key'): target_keys.add(pos['ce_key'])
-                if pos.get('pe_key'): target_keys.add(pos['pe_key'])
-
-            # Parallelize historical data fetching for efficiency
-            keys_list = list(target_keys)
-            print(f"Fetching historical data for {len(keys_list)} instruments in parallel...")
+                if pos.ce_key: target_keys.add(pos.ce_key)
+                if pos.pe_key: target_keys.add(pos.pe_key)
 
-            tasks = [self.data_provider.get_historical_data(k, from_date=date_str, to_date=date_str) for k in keys_list]
-            # Include Future data in the parallel fetch
-            tasks.append(self.data_provider.get_historical_data(details['fut'], from_date=date_str, to_date=date_str))
+            await self.prefetch_history([(k, date_str) for k in target_keys])
+            for key in target_keys:
+                if self.history[(key, date_str)] is not None: chain_data[key] = self.history[(key, date_str)]
 
-            results = await asyncio.gather(*tasks)
-
-            # Map results back
-            for i, key in enumerate(keys_list):
-                if results[i] is not None: chain_data[key] = results[i]
-
-            fut_hist = results[-1]
+            fut_hist = self.history[(details['fut'], date_str)]
 
             if idx_hist is None or idx_hist.empty:
-                print(f"Skipping {date_str} due to missing index data.")
+                logger.info("Skipping %s due to missing index data.", date_str)
                 continue
 
-            # Align data
-            combined = idx_hist.rename(columns={c: f"{c}_idx" for c in idx_hist.columns if c != 'timestamp'})
-
+            # Align data: a single outer concat on timestamp rather than one merge (and full copy) per instrument
+            frames = [self.timestamp_indexed(idx_hist, 'idx')]
             for name, oh in other_indices_hist.items():
-                oh = oh.rename(columns={c: f"{c}_{name}" for c in oh.columns if c != 'timestamp'})
-                combined = pd.merge(combined, oh, on='timestamp', how='outer')
-
+                frames.append(self.timestamp_indexed(oh, name))
             for k, df in chain_data.items():
-                df = df.rename(columns={c: f"{c}_{k}" for c in df.columns if c != 'timestamp'})
-                combined = pd.merge(combined, df, on='timestamp', how='outer')
+                frames.append(self.timestamp_indexed(df, k))
+            has_fut = fut_hist is not None and not fut_hist.empty
+            if has_fut:
+                frames.append(self.timestamp_indexed(fut_hist, 'fut'))
 
-            if fut_hist is not None and not fut_hist.empty:
-                fut_hist = fut_hist.rename(columns={c: f"{c}_fut" for c in fut_hist.columns if c != 'timestamp'})
-                combined = pd.merge(combined, fut_hist, on='timestamp', how='outer')
-            else:
+            combined = pd.concat(frames, axis=1).rename_axis('timestamp').reset_index()
+            if not has_fut:
                 combined['volume_fut'] = 0
 
             # Convert UTC to IST (+5:30) for alignment with market hours
-            combined['timestamp'] = combined['timestamp'] + datetime.timedelta(hours=5, minutes=30)
+            combined['timestamp'] = combined['timestamp'].to_numpy() + IST_OFFSET
 
             # Use forward fill for prices and OI to handle missing candles, then fill remaining NaNs with 0
             combined = combined.dropna(subset=['close_idx'])
             combined = combined.sort_values('timestamp').drop_duplicates('timestamp').ffill().fillna(0)
 
-            # Pre-calculate 5m candles for backtest
-            combined_5m = combined.resample('5min', on='timestamp').agg({
-                'open_idx': 'first', 'high_idx': 'max', 'low_idx': 'min', 'close_idx': 'last'
-            }).ffill()
+            # Pre-calculate 5m candles for backtest: the index and every sync index in one resample
+            agg_5m = {}
+            for suffix in ['idx', *other_indices_hist]:
+                agg_5m.update({f'open_{suffix}': 'first', f'high_{suffix}': 'max',
+                               f'low_{suffix}': 'min', f'close_{suffix}': 'last'})
+            combined_5m = combined.resample('5min', on='timestamp').agg(agg_5m).ffill()
             combined_5m.index = combined_5m.index.tz_localize(None)
 
-            other_5m = {}
+            # Struct-of-arrays view of the day: per-column lists indexed by bar, so the
+            # loop below never builds a pandas Series per row
+            bar_times = [t.replace(tzinfo=None) for t in combined['timestamp'].dt.to_pydatetime()]
+            open_idx = combined['open_idx'].tolist()
+            high_idx = combined['high_idx'].tolist()
+            low_idx = combined['low_idx'].tolist()
+            close_idx = combined['close_idx'].tolist()
+            volume_fut = combined['volume_fut'].tolist()
+
+            # Sync indices as (engine, index_key, open, high, low, close, volume), resolved once per day
+            sync_feeds = []
             for name in other_indices_hist:
-                other_5m[name] = combined.resample('5min', on='timestamp').agg({
-                    f'open_{name}': 'first', f'high_{name}': 'max', f'low_{name}': 'min', f'close_{name}': 'last'
-                }).ffill()
-                other_5m[name].index = other_5m[name].index.tz_localize(None)
+                volume = combined[f'volume_{name}'].tolist() if f'volume_{name}' in combined else [0] * len(combined)
+                sync_feeds.append((self.engines[name], INDICES[name]['index_key'],
+                                   *self.column_lists(combined, name), volume))
+
+            # instrument_key -> (open, high, low, close, oi, oi_delta); oi_delta[i] = oi[i] - oi[i-1]
+            opt_cols = {}
+            for key in chain_data:
+                oi = combined[f'oi_{key}'].to_numpy()
+                opt_cols[key] = (*self.column_lists(combined, key), oi.tolist(), np.diff(oi, prepend=oi[:1]).tolist())
+
+            # 5m candle each bar publishes: at a 5-minute boundary the row of the 5m frame that started
+            # 5 minutes earlier (09:20 -> the 09:15 candle), otherwise -1.
+            minute_starts = pd.DatetimeIndex(bar_times).floor('min')
+            prev_5m = combined_5m.index.get_indexer(minute_starts - pd.Timedelta(minutes=5))
+            prev_5m[minute_starts.minute % 5 != 0] = -1
+            prev_5m = prev_5m.tolist()
+            idx_5m = self.column_lists(combined_5m, 'idx')
+            sync_5m = [self.column_lists(combined_5m, name) for name in other_indices_hist]
+
+            # Swings for every prefix of the day in one pass; entry i is identify_swing(candles[:i])
+            swing_frame = combined[['open_idx', 'high_idx', 'low_idx', 'close_idx']].rename(
+                columns={'open_idx': 'open', 'high_idx': 'high', 'low_idx': 'low', 'close_idx': 'close'})
+            swing_types, swing_prices = self.strategy.identify_swings(swing_frame)
+            swing_types = swing_types.tolist()
+            swing_prices = swing_prices.tolist()
+
+            # Nearest strike per bar in one vectorised pass (argmin keeps min()'s first-wins ties)
+            option_chain = details['option_chain']
+            strikes = np.array([opt['strike'] for opt in option_chain], dtype=np.float64)
+            atm_per_bar = np.abs(np.asarray(close_idx)[:, None] - strikes[None, :]).argmin(axis=1).tolist()
+
+            # Chain keys with data today, and for each field one row per bar across those keys
+            opt_keys = [opt[side] for opt in option_chain for side in ('ce', 'pe') if opt[side] in opt_cols]
+            opt_open, opt_high, opt_low, opt_close, opt_oi, opt_oi_delta = (
+                list(zip(*(opt_cols[key][f] for key in opt_keys))) for f in range(6)
+            )
+            update_options = self.strategy.option_bar_updater(opt_keys)
+
+            # Multi-index sync gate per bar and side. Other engines only move with the sync feeds
+            # during a day (their reference levels stay reset), so their trend state is known up front.
+            sync_ok = {'BUY_CE': np.ones(len(combined), dtype=bool), 'BUY_PE': np.ones(len(combined), dtype=bool)}
+            if enable_sync:
+                feeds = {id(engine): (o_open, o_close) for engine, _, o_open, _, _, o_close, _ in sync_feeds}
+                for name, engine in self.engines.items():
+                    if name == self.index_name:
+                        continue
+                    if id(engine) in feeds:
+                        o_open, o_close = feeds[id(engine)]
+                        ce, pe = engine.trend_states(o_open[50:], o_close[50:])
+                        sync_ok['BUY_CE'][50:] &= ce
+                        sync_ok['BUY_PE'][50:] &= pe
+                    else:
+                        # Not fed today: its state holds for the whole day
+                        for side, ok in sync_ok.items():
+                            if not engine.get_trend_state(side):
+                                ok[:] = False
+            sync_ok = {side: ok.tolist() for side, ok in sync_ok.items()}
 
             last_signal_min = None
+            traded_signals = []
             for i in range(50, len(combined)):
-                subset = combined.iloc[:i]
-                current = combined.iloc[i]
-                current_time = current['timestamp']
+                current_time = bar_times[i]
 
                 # Market Hour Filter (IST: 09:17 to 15:27)
                 is_trade_window = (current_time.hour == 9 and current_time.minute >= 17) or \
@@ -216,94 +396,73 @@ class Backtester:
                 is_eod = (current_time.hour == 15 and current_time.minute >= 27) or (current_time.hour > 15)
 
                 # Dynamic ATM Selection
-                current_idx_price = current['close_idx']
-                best_strike = min(details['option_chain'], key=lambda x: abs(x['strike'] - current_idx_price))
+                best_strike = option_chain[atm_per_bar[i]]
                 details['ce'] = best_strike['ce']
                 details['pe'] = best_strike['pe']
                 details['strike'] = best_strike['strike']
 
-                if hasattr(current_time, 'to_pydatetime'):
-                    current_time = current_time.to_pydatetime().replace(tzinfo=None)
-
                 # Update main strategy engine
                 self.strategy.update_data(details['index'], {
-                    'ltp': current['close_idx'],
-                    'volume': current.get('volume_fut', 0)
+                    'ltp': close_idx[i],
+                    'volume': volume_fut[i]
                 })
 
                 # Update other engines for sync
-                for name in other_indices_hist:
-                    self.engines[name].update_data(INDICES[name]['index_key'], {
-                        'ltp': current[f'close_{name}'],
-                        'volume': current.get(f'volume_{name}', 0)
+                for engine, key, _, _, _, o_close, o_vol in sync_feeds:
+                    engine.update_data(key, {
+                        'ltp': o_close[i],
+                        'volume': o_vol[i]
                     })
 
-                for opt in details['option_chain']:
-                    for side in ['ce', 'pe']:
-                        key = opt[side]
-                        if f'close_{key}' in current:
-                            # Avoid huge OI spikes due to missing data by using current OI if i-1 is missing
-                            prev_oi = combined.iloc[i-1].get(f'oi_{key}', current[f'oi_{key}']) if i > 0 else current[f'oi_{key}']
-                            self.strategy.update_data(key, {
-                                'ltp': current[f'close_{key}'],
-                                'oi': current[f'oi_{key}'],
-                                'oi_delta': current[f'oi_{key}'] - prev_oi
-                            })
-                            self.strategy.update_candle(key, {
-                                'open': current[f'open_{key}'], 'high': current[f'high_{key}'],
-                                'low': current[f'low_{key}'], 'close': current[f'close_{key}']
-                            })
+                if opt_keys:
+                    update_options(opt_open[i], opt_high[i], opt_low[i], opt_close[i], opt_oi[i], opt_oi_delta[i])
 
                 self.strategy.update_candle(details['index'], {
-                    'open': current['open_idx'], 'high': current['high_idx'],
-                    'low': current['low_idx'], 'close': current['close_idx'],
-                    'volume': current.get('volume_fut', 0)
+                    'open': open_idx[i], 'high': high_idx[i],
+                    'low': low_idx[i], 'close': close_idx[i],
+                    'volume': volume_fut[i]
                 })
 
-                for name in other_indices_hist:
-                    self.engines[name].update_candle(INDICES[name]['index_key'], {
-                        'open': current[f'open_{name}'], 'high': current[f'high_{name}'],
-                        'low': current[f'low_{name}'], 'close': current[f'close_{name}'],
-                        'volume': current.get(f'volume_{name}', 0)
+                for engine, key, o_open, o_high, o_low, o_close, o_vol in sync_feeds:
+                    engine.update_candle(key, {
+                        'open': o_open[i], 'high': o_high[i],
+                        'low': o_low[i], 'close': o_close[i],
+                        'volume': o_vol[i]
                     })
 
                 # Update 5m candle if at 5m boundary (Avoid look-ahead bias)
                 # At 09:20, we update the candle that started at 09:15 and ended at 09:19:59
-                if current_time.minute % 5 == 0:
-                    ts = current_time.replace(second=0, microsecond=0)
-                    prev_ts = ts - datetime.timedelta(minutes=5)
-
-                    if prev_ts in combined_5m.index:
-                        c5 = combined_5m.loc[prev_ts]
-                        self.strategy.update_candle(details['index'], {
-                            'open': c5['open_idx'], 'high': c5['high_idx'],
-                            'low': c5['low_idx'], 'close': c5['close_idx']
+                j = prev_5m[i]
+                if j >= 0:
+                    o5, h5, l5, c5 = idx_5m
+                    self.strategy.update_candle(details['index'], {
+                        'open': o5[j], 'high': h5[j],
+                        'low': l5[j], 'close': c5[j]
+                    }, interval=5)
+
+                    for (engine, key, *_), (o5, h5, l5, c5) in zip(sync_feeds, sync_5m):
+                        engine.update_candle(key, {
+                            'open': o5[j], 'high': h5[j],
+                            'low': l5[j], 'close': c5[j]
                         }, interval=5)
 
-                        for name in other_indices_hist:
-                            if prev_ts in other_5m[name].index:
-                                c5o = other_5m[name].loc[prev_ts]
-                                self.engines[name].update_candle(INDICES[name]['index_key'], {
-                                    'open': c5o[f'open_{name}'], 'high': c5o[f'high_{name}'],
-                                    'low': c5o[f'low_{name}'], 'close': c5o[f'close_{name}']
-                                }, interval=5)
-
                 # Identify Swings
-                swing_data = subset.rename(columns={'open_idx': 'open', 'high_idx': 'high', 'low_idx': 'low', 'close_idx': 'close'})
-                swing = self.strategy.identify_swing(swing_data[['open', 'high', 'low', 'close']])
-                if swing:
+                swing_type = swing_types[i]
+                if swing_type:
                     ce_key = details['ce']
                     pe_key = details['pe']
                     # Correct Reference Level: Use the actual peak prices from the swing
-                    # Peak is expected at index -4 in identify_swing logic
-                    peak_candle = subset.iloc[-4]
+                    # Peak is expected at index -4 in identify_swing logic (bar i-4, as the window ends at i-1)
+                    peak = i - 4
+                    ce_cols = opt_cols.get(ce_key)
+                    pe_cols = opt_cols.get(pe_key)
 
                     self.strategy.save_reference_level(
-                        swing['type'],
-                        swing['price'],
-                        peak_candle.get(f'close_{ce_key}', 0),
-                        peak_candle.get(f'close_{pe_key}', 0),
-                        ce_key, pe_key, timestamp=peak_candle['timestamp'].to_pydatetime().replace(tzinfo=None)
+                        'High' if swing_type == SWING_HIGH else 'Low',
+                        swing_prices[i],
+                        ce_cols[3][peak] if ce_cols else 0,
+                        pe_cols[3][peak] if pe_cols else 0,
+                        ce_key, pe_key, timestamp=bar_times[peak]
                     )
 
                 # Signals (Only if not warmup and within trade window)
@@ -317,29 +476,19 @@ class Backtester:
                             continue
 
                         # Enhancement: Multi-Index Sync Check
-                        if enable_sync:
-                            other_sync = True
-                            for other_name, other_engine in self.engines.items():
-                                if other_name == self.index_name: continue
-                                if not other_engine.get_trend_state(signal.side):
-                                    other_sync = False
-                                    break
-                            if not other_sync:
-                                continue
+                        if enable_sync and signal.side in sync_ok and not sync_ok[signal.side][i]:
+                            continue
 
                         signal.timestamp = current_time
                         if self.index_name not in self.execution.positions:
                             # Risk Check
                             can_trade, _ = self.risk_manager.can_trade(len(self.execution.positions), timestamp=current_time)
                             if can_trade:
-                                if self.execution.execute_signal(signal, timestamp=current_time, index_price=current['close_idx']):
+                                if await self.execution.execute_signal_async(signal, timestamp=current_time, index_price=close_idx[i]):
                                     self.strategy.reset_trailing_sl()
                                     last_signal_min = current_min
-                                    # ONLY SAVE SIGNAL IF WE ACTUALLY TRADED
-                                    session = self.get_backtest_session()
-                                    session.add(signal)
-                                    session.commit()
-                                    session.close()
+                                    # ONLY SAVE SIGNAL IF WE ACTUALLY TRADED (written once per day below)
+                                    traded_signals.append(signal)
 
                 # Exits
                 if not is_warmup and self.index_name in self.execution.positions:
@@ -349,25 +498,26 @@ class Backtester:
                     force_close = is_eod
 
                     # Use the entry strike's data for exit, even if ATM shifted
-                    entry_ce_key = pos['ce_key']
-                    entry_pe_key = pos['pe_key']
-
-                    idx_data = {'ltp': current['close_idx']}
+                    entry_ce_key = pos.ce_key
+                    entry_pe_key = pos.pe_key
 
-                    prev_oi_ce = combined.iloc[i-1].get(f'oi_{entry_ce_key}', current.get(f'oi_{entry_ce_key}', 0)) if i > 0 else current.get(f'oi_{entry_ce_key}', 0)
-                    prev_oi_pe = combined.iloc[i-1].get(f'oi_{entry_pe_key}', current.get(f'oi_{entry_pe_key}', 0)) if i > 0 else current.get(f'oi_{entry_pe_key}', 0)
+                    idx_data = {'ltp': close_idx[i]}
 
-                    ce_data = {'ltp': current.get(f'close_{entry_ce_key}', 0),
-                               'oi_delta': current.get(f'oi_{entry_ce_key}', 0) - prev_oi_ce}
-                    pe_data = {'ltp': current.get(f'close_{entry_pe_key}', 0),
-                               'oi_delta': current.get(f'oi_{entry_pe_key}', 0) - prev_oi_pe}
+                    # Keys without data for the day read as 0 price / 0 OI change
+                    ce_cols = opt_cols.get(entry_ce_key)
+                    pe_cols = opt_cols.get(entry_pe_key)
+                    ce_data = {'ltp': ce_cols[3][i] if ce_cols else 0,
+                               'oi_delta': ce_cols[5][i] if ce_cols else 0}
+                    pe_data = {'ltp': pe_cols[3][i] if pe_cols else 0,
+                               'oi_delta': pe_cols[5][i] if pe_cols else 0}
 
-                    from types import SimpleNamespace
-                    if force_close or self.strategy.check_exit_condition(SimpleNamespace(**pos), idx_data, ce_data, pe_data, current_time=current_time):
-                        exit_price = ce_data['ltp'] if pos['side'] == 'BUY_CE' else pe_data['ltp']
+                    if force_close or self.strategy.check_exit_condition(pos, idx_data, ce_data, pe_data, current_time=current_time):
+                        exit_price = ce_data['ltp'] if pos.side == 'BUY_CE' else pe_data['ltp']
 
                         if exit_price > 0:
-                            trade = self.execution.close_position(self.index_name, exit_price, timestamp=current_time, index_price=current['close_idx'])
+                            trade = self.execution.close_position(self.index_name, exit_price, timestamp=current_time, index_price=close_idx[i])
+                            # The position is released once its close commits; the next bar may re-enter
+                            await self.execution.flush_trades_async()
 
                             if trade:
                                 self.strategy.reset_trailing_sl()
@@ -376,15 +526,20 @@ class Backtester:
                             # If price is 0 (missing data), don't exit yet to avoid ruined stats
                             pass
 
+            self.save_signals(traded_signals)
+
             if not is_warmup:
                 all_combined.append(combined[['timestamp', 'open_idx', 'high_idx', 'low_idx', 'close_idx']])
 
+        self.history = {}
+        await self.execution.flush_trades_async()
+
         if not all_combined:
             print("No data processed for the given date range.")
             return None
 
         final_df = pd.concat(all_combined).sort_values('timestamp').drop_duplicates('timestamp')
-        print(f"Backtest complete for {self.index_name}")
+        print(f"Backtest complete for {self.index_name} ({len(all_combined)} days)")
 
         # Calculate Performance KPIs
         session = self.get_backtest_session()
@@ -399,15 +554,15 @@ class Backtester:
             avg_trade = total_pnl / len(pnls)
 
             # Simplified Drawdown
-            cumulative = pd.Series(pnls).cumsum()
-            max_pnl = cumulative.expanding().max()
+            cumulative = np.cumsum(pnls)
+            max_pnl = np.maximum.accumulate(cumulative)
             drawdown = cumulative - max_pnl
             max_dd = drawdown.min()
 
             # Sharpe Ratio (Daily proxy)
             sharpe = 0
             if len(pnls) > 1:
-                std = pd.Series(pnls).std()
+                std = np.std(pnls, ddof=1)
                 sharpe = (avg_trade / std) * (252**0.5) if std != 0 else 0
 
             print("\n" + "="*30)
@@ -8,6 +8,7 @@ import json
 import plotly.graph_objects as go
 from config import SYMMETRY_DB_PATH as DB_PATH
 from .database import get_session, AppSetting, Notification
+from .alerts import invalidate_alerts_enabled
 import uvicorn
 app = FastAPI(title="Symmetry Engine Dashboard")
 # Templates are in the root templates directory
@@ -26,11 +27,17 @@ async def home(request: Request):
     conn = sqlite3.connect(DB_PATH)
     try:
         # Fetch data for display
-        trades_display = pd.read_sql("SELECT * FROM trades ORDER BY timestamp DESC LIMIT 50", conn)
+        # Money columns are whole paise; read them back as rupees under their usual names
+        trades_display = pd.read_sql(
+            "SELECT id, timestamp, index_name, instrument_key, instrument_ce, instrument_pe, side, "
+            "price_paise / 100.0 AS price, index_price_paise / 100.0 AS index_price, quantity, status, "
+            "pnl_paise / 100.0 AS pnl, exit_price_paise / 100.0 AS exit_price, trailing_sl_paise / 100.0 AS trailing_sl "
+            "FROM trades ORDER BY timestamp DESC LIMIT 50", conn
+        )
         signals = pd.read_sql("SELECT * FROM signals ORDER BY timestamp DESC LIMIT 50", conn)
 
         # Fetch data for summary calculations (full history of closed trades)
-        all_closed_trades = pd.read_sql("SELECT pnl, timestamp FROM trades WHERE side = 'SELL' AND status = 'CLOSED' ORDER BY timestamp", conn)
+        all_closed_trades = pd.read_sql("SELECT pnl_paise / 100.0 AS pnl, timestamp FROM trades WHERE side = 'SELL' AND status = 'CLOSED' ORDER BY timestamp", conn)
 
         # Calculate summary
         total_pnl = all_closed_trades['pnl'].sum() if not all_closed_trades.empty else 0
@@ -107,6 +114,7 @@ async def toggle_alerts(enabled: str = Form(...)):
         session.commit()
     finally:
         session.close()
+    invalidate_alerts_enabled()
     return RedirectResponse(url="/", status_code=303)
 
 def run_dashboard():
@@ -1,7 +1,11 @@
-from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, ForeignKey, JSON, Boolean
+from sqlalchemy import create_engine, event, func, text, Column, Integer, Float, String, DateTime, ForeignKey, JSON, Boolean, Index
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
+from pathlib import Path
 import datetime
+import os
 from config import SYMMETRY_DB_PATH as DB_PATH
 
 Base = declarative_base()
@@ -39,24 +43,58 @@ class Signal(Base):
     index_price = Column(Float)
     option_price = Column(Float)
     confluence_score = Column(Integer)
+    # Strikes the signal was taken on, as plain columns rather than keys inside details
+    ce_key = Column(String)
+    pe_key = Column(String)
     details = Column(JSON)
 
+    # Latest-signal lookups per index/side walk this newest-first
+    __table_args__ = (
+        Index('ix_signals_idx_side_ts', 'index_name', 'side', timestamp.desc()),
+    )
+
+def _rupee_property(paise_attr):
+    """Rupee view of an Integer paise column, settable and usable in queries like a plain column."""
+    def fget(self):
+        paise = getattr(self, paise_attr)
+        return None if paise is None else paise / 100
+
+    def fset(self, rupees):
+        setattr(self, paise_attr, None if rupees is None else round(rupees * 100))
+
+    def expr(cls):
+        return getattr(cls, paise_attr) / 100.0
+
+    return hybrid_property(fget, fset, expr=expr)
+
 class Trade(Base):
     __tablename__ = 'trades'
     id = Column(Integer, primary_key=True)
-    timestamp = Column(DateTime)
+    timestamp = Column(DateTime, server_default=func.current_timestamp())
     index_name = Column(String)
     instrument_key = Column(String)
     instrument_ce = Column(String)
     instrument_pe = Column(String)
     side = Column(String)  # 'BUY' or 'SELL'
-    price = Column(Float)
-    index_price = Column(Float)
+    # Money is stored as whole paise so sums are exact; the rupee properties below wrap them
+    price_paise = Column(Integer)
+    index_price_paise = Column(Integer)
     quantity = Column(Integer)
     status = Column(String)  # 'OPEN', 'CLOSED'
-    pnl = Column(Float, default=0.0)
-    exit_price = Column(Float, default=0.0)
-    trailing_sl = Column(Float, default=0.0)
+    pnl_paise = Column(Integer, default=0)
+    exit_price_paise = Column(Integer, default=0)
+    trailing_sl_paise = Column(Integer, default=0)
+
+    price = _rupee_property('price_paise')
+    index_price = _rupee_property('index_price_paise')
+    pnl = _rupee_property('pnl_paise')
+    exit_price = _rupee_property('exit_price_paise')
+    trailing_sl = _rupee_property('trailing_sl_paise')
+
+    # Partial index: only the handful of OPEN rows, so recovery never scans closed history
+    __table_args__ = (
+        Index('ix_trades_status', 'status', sqlite_where=text("status = 'OPEN'")),
+    )
 
 class Notification(Base):
     __tablename__ = 'notifications'
@@ -70,37 +108,131 @@ class AppSetting(Base):
     key = Column(String, primary_key=True)
     value = Column(String)
 
-engine = create_engine(f'sqlite:///{DB_PATH}')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Per-connection SQLite tuning: WAL so readers don't block the writer, one fsync per checkpoint."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def set_sqlite_read_pragmas(dbapi_connection, connection_record):
+    """set_sqlite_pragmas for read-only connections, which cannot change the journal mode."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def set_sqlite_writer(dbapi_connection, connection_record):
+    """Hands transaction control to SQLAlchemy so begin_immediate can open every write transaction."""
+    dbapi_connection.isolation_level = None
+
+def begin_immediate(conn):
+    # Take the write lock up front: a deferred transaction that reads first can fail its
+    # lock upgrade with SQLITE_BUSY instead of waiting out busy_timeout
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+# General sessions (dashboard/API reads, alerts, candles) go through the pooled main engine
+engine = create_engine(f'sqlite:///{DB_PATH}', poolclass=QueuePool, pool_size=5, max_overflow=10)
+event.listen(engine, 'connect', set_sqlite_pragmas)
 Session = sessionmaker(bind=engine)
 
+# Trade writes go through a single pooled connection whose transactions begin IMMEDIATE.
+# pool_recycle only bounds connection age; pre-ping is left off, a local file has no stale sockets.
+write_engine = create_engine(
+    f'sqlite:///{DB_PATH}', poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=30, pool_recycle=3600
+)
+event.listen(write_engine, 'connect', set_sqlite_pragmas)
+event.listen(write_engine, 'connect', set_sqlite_writer)
+event.listen(write_engine, 'begin', begin_immediate)
+# Thread-scoped: writers never nest, so each thread reuses one Session; close() after a write
+# only hands the connection back. Call WriteSession.remove() when a thread is done writing.
+WriteSession = scoped_session(sessionmaker(bind=write_engine))
+
+# Read-only engine for pure reads such as startup recovery; WAL lets it run alongside the writer
+# Sized like the main engine at minimum so a 1-CPU host still gets several concurrent readers
+read_engine = create_engine(
+    f'sqlite:///file:{Path(DB_PATH).as_posix()}?mode=ro&uri=true',
+    poolclass=QueuePool, pool_size=max(os.cpu_count() or 1, 5), max_overflow=10
+)
+event.listen(read_engine, 'connect', set_sqlite_read_pragmas)
+ReadSession = sessionmaker(bind=read_engine)
+
+# Bump whenever migrate_db gains a step; databases already at this version skip migration
+SCHEMA_VERSION = '5'
+
 def migrate_db():
     """
-    Manually add missing columns to the trades table if they don't exist.
+    Manually add missing columns to the trades and signals tables if they don't exist.
     SqlAlchemy create_all doesn't handle migrations.
     """
-    from sqlalchemy import text
     try:
         with engine.begin() as conn:
-            # Check for columns in trades table
-            res = conn.execute(text("PRAGMA table_info(trades)"))
-            columns = [row[1] for row in res]
+            # Up-to-date databases cost one primary-key lookup instead of PRAGMA + index checks
+            version = conn.execute(
+                text("SELECT value FROM settings WHERE key = 'schema_version'")
+            ).scalar()
+            if version == SCHEMA_VERSION:
+                return
 
             required_columns = {
-                'instrument_ce': 'VARCHAR',
-                'instrument_pe': 'VARCHAR',
-                'exit_price': 'FLOAT DEFAULT 0.0',
-                'trailing_sl': 'FLOAT DEFAULT 0.0'
+                'trades': {
+                    'instrument_ce': 'VARCHAR',
+                    'instrument_pe': 'VARCHAR',
+                    'price_paise': 'INTEGER',
+                    'index_price_paise': 'INTEGER',
+                    'pnl_paise': 'INTEGER DEFAULT 0',
+                    'exit_price_paise': 'INTEGER DEFAULT 0',
+                    'trailing_sl_paise': 'INTEGER DEFAULT 0'
+                },
+                'signals': {
+                    'ce_key': 'VARCHAR',
+                    'pe_key': 'VARCHAR'
+                }
             }
 
-            for col, col_type in required_columns.items():
-                if col not in columns:
-                    print(f"Migration: Adding missing column {col} to trades table...")
-                    conn.execute(text(f"ALTER TABLE trades ADD COLUMN {col} {col_type}"))
+            existing = {}
+            for table, table_columns in required_columns.items():
+                # Check for columns in each table
+                res = conn.execute(text(f"PRAGMA table_info({table})"))
+                columns = existing[table] = [row[1] for row in res]
+
+                for col, col_type in table_columns.items():
+                    if col not in columns:
+                        print(f"Migration: Adding missing column {col} to {table} table...")
+                        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}"))
+
+            # Older databases keep money in FLOAT rupee columns: copy them into the paise columns.
+            # The legacy columns stay in place, unused, so nothing is lost if a copy looks wrong.
+            legacy = [col for col in ('price', 'index_price', 'pnl', 'exit_price', 'trailing_sl') if col in existing['trades']]
+            if legacy:
+                assignments = ", ".join(f"{col}_paise = CAST(ROUND({col} * 100) AS INTEGER)" for col in legacy)
+                conn.execute(text(f"UPDATE trades SET {assignments} WHERE price_paise IS NULL"))
+
+            # Signals written before the typed columns carry their strikes only inside details
+            conn.execute(text(
+                "UPDATE signals SET ce_key = json_extract(details, '$.ce_key'), "
+                "pe_key = json_extract(details, '$.pe_key') "
+                "WHERE ce_key IS NULL AND details IS NOT NULL"
+            ))
+
+            # create_all skips indexes on tables that already exist
+            for table in (Trade.__table__, Signal.__table__):
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+
+            # Same transaction as the ALTERs, so a failed migration is retried on next start
+            conn.execute(
+                text("INSERT OR REPLACE INTO settings (key, value) VALUES ('schema_version', :version)"),
+                {'version': SCHEMA_VERSION}
+            )
     except Exception as e:
         print(f"Migration Error: {e}")
 
 def init_db():
-    import os
     db_dir = os.path.dirname(DB_PATH)
     if db_dir and not os.path.exists(db_dir):
         os.makedirs(db_dir, exist_ok=True)
@@ -112,3 +244,9 @@ def init_db():
 
 def get_session():
     return Session()
+
+def get_write_session():
+    return WriteSession()
+
+def get_read_session():
+    return ReadSession()
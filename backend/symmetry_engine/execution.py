@@ -1,52 +1,154 @@
-from .database import get_session, Trade
+from sqlalchemy import insert, select, update, bindparam, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .database import get_write_session, get_read_session, Trade, AppSetting
 from config import SYMMETRY_INDICES as INDICES
-import datetime
 import asyncio
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TRADE_FLUSH_DELAY = 0.05 # seconds a close or SL change waits so a burst shares one commit
+TRADE_FLUSH_BATCH = 50 # queued closes that force an immediate flush
+TRADE_FLUSH_MAX_DELAY = 5.0 # cap on the retry backoff after a failed flush
+
+def _paise(amount):
+    """Whole paise (int) for a rupee amount. Costs, PnL and the balance add up in paise, exactly."""
+    return round(amount * 100)
+
+def _rupees(paise):
+    return paise / 100
+
+# Trade money columns: rows are built in rupees and written as Integer paise
+_MONEY_FIELDS = ('price', 'index_price', 'pnl', 'exit_price', 'trailing_sl')
+
+def _paise_row(row):
+    """Insert parameters for a trade row given in rupees."""
+    params = dict(row)
+    for name in _MONEY_FIELDS:
+        params[name + '_paise'] = _paise(params.pop(name))
+    return params
+
+# Lot size per index, flattened once from the config
+_LOT_SIZES = {name: cfg.get('lot_size', 1) for name, cfg in INDICES.items()}
+
+# Per-trade statements, built once at import; every call only binds parameters
+_trades = Trade.__table__
+# Rows given no timestamp (b_ts=None) take SQLite's clock
+_TRADE_INSERT = insert(_trades).values(
+    timestamp=func.coalesce(bindparam('b_ts', type_=_trades.c.timestamp.type), func.current_timestamp())
+)
+_ENTRY_INSERT = _TRADE_INSERT.returning(_trades.c.id, _trades.c.timestamp)
+_CLOSE_UPDATE = (
+    update(_trades)
+    .where(_trades.c.id == bindparam('b_id'))
+    .values(status='CLOSED', pnl_paise=bindparam('b_pnl'), exit_price_paise=bindparam('b_exit_price'))
+)
+_SL_UPDATE = update(_trades).where(_trades.c.id == bindparam('b_id')).values(trailing_sl_paise=bindparam('b_sl'))
+_balance_insert = sqlite_insert(AppSetting.__table__).values(key='paper_balance', value=bindparam('b_value'))
+_BALANCE_UPSERT = _balance_insert.on_conflict_do_update(
+    index_elements=['key'], set_={'value': _balance_insert.excluded.value}
+)
+
+class Position:
+    """An open paper position. Slots keep the per-tick field reads to plain attribute access."""
+    __slots__ = ('trade_id', 'timestamp', 'side', 'entry_price', 'quantity', 'ce_key', 'pe_key', 'trailing_sl', 'closing')
+
+    def __init__(self, trade_id, timestamp, side, entry_price, quantity, ce_key=None, pe_key=None, trailing_sl=0.0):
+        self.trade_id = trade_id
+        self.timestamp = timestamp
+        self.side = side
+        self.entry_price = entry_price
+        self.quantity = quantity
+        self.ce_key = ce_key
+        self.pe_key = pe_key
+        self.trailing_sl = trailing_sl
+        # Set once the close is queued; the position is removed only after that close commits
+        self.closing = False
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class _TradeWrite:
+    """A queued entry insert (trade_id None) or close of trade_id, written in event order by a flush."""
+    __slots__ = ('index_name', 'trade_id', 'row', 'cost', 'future', 'result')
+
+    def __init__(self, index_name, trade_id, row, cost=0):
+        self.index_name = index_name
+        self.trade_id = trade_id
+        self.row = row
+        self.cost = cost # entry cost in paise, refunded if the entry is not written
+        self.future = None # set by execute_signal_async, resolved when the flush ends
+        self.result = None # (trade_id, timestamp) once an entry is written
 
 class ExecutionEngine:
     def __init__(self, session_factory=None, initial_balance=1000000, slippage=0.001, commission_rate=0.0005, fixed_charge=20):
-        self.get_session = session_factory or get_session
+        self.get_session = session_factory or get_write_session
+        # Pure reads use the read-only pool unless a custom factory (e.g. a backtest DB) is given
+        self.get_read_session = session_factory or get_read_session
         self.initial_balance = initial_balance
-        self.balance = initial_balance
+        self.balance = initial_balance # kept as whole paise in _balance_paise
         self.slippage = slippage # 0.1% default
         self.commission_rate = commission_rate # 0.05%
         self.fixed_charge = fixed_charge # Flat INR 20 per trade
         self.positions = {} # index_name -> position
+        # Entries and closes in event order, and trade_id -> latest trailing SL, waiting for a flush
+        self._pending = []
+        self._pending_sl = {}
+        self._opening = set() # indices whose entry is queued but not yet written
+        self._flush_handle = None
+        # The one off-loop flush in progress; flushes never overlap, so rows commit in queue order
+        self._flush_task = None
+        self._flush_failures = 0 # consecutive failed flushes, drives the retry backoff
+
+    @property
+    def balance(self):
+        return _rupees(self._balance_paise)
+
+    @balance.setter
+    def balance(self, rupees):
+        self._balance_paise = _paise(rupees)
 
     def recover_positions(self):
         """
         Recovers open positions and current balance from the database on startup.
         """
-        session = self.get_session()
+        session = self.get_read_session()
         try:
             # 1. Recover Balance
-            from .database import AppSetting
             balance_setting = session.query(AppSetting).filter_by(key='paper_balance').first()
             if balance_setting:
                 self.balance = float(balance_setting.value)
-                print(f"State Recovery: Recovered Paper Balance: ₹{self.balance:.2f}")
+                logger.info("State Recovery: Recovered Paper Balance: ₹%.2f", self.balance)
             else:
-                print(f"State Recovery: No saved balance found. Using initial: ₹{self.balance:.2f}")
+                logger.info("State Recovery: No saved balance found. Using initial: ₹%.2f", self.balance)
 
             # 2. Recover Positions
-            open_trades = session.query(Trade).filter_by(status='OPEN').all()
+            # One plain-row query for every open trade; ordered so the newest entry per index wins
+            open_trades = session.execute(
+                select(Trade.id, Trade.timestamp, Trade.index_name, Trade.instrument_key, Trade.price_paise,
+                       Trade.quantity, Trade.instrument_ce, Trade.instrument_pe, Trade.trailing_sl_paise)
+                .where(Trade.status == 'OPEN')
+                .order_by(Trade.timestamp, Trade.id)
+            ).all()
             for trade in open_trades:
-                self.positions[trade.index_name] = {
-                    'trade_id': trade.id,
-                    'side': trade.instrument_key,
-                    'entry_price': trade.price, # Use the actual price stored in DB
-                    'quantity': trade.quantity,
-                    'ce_key': trade.instrument_ce,
-                    'pe_key': trade.instrument_pe,
-                    'trailing_sl': trade.trailing_sl
-                }
+                self.positions[trade.index_name] = Position(
+                    trade_id=trade.id,
+                    timestamp=trade.timestamp,
+                    side=trade.instrument_key,
+                    entry_price=_rupees(trade.price_paise), # Use the actual price stored in DB
+                    quantity=trade.quantity,
+                    ce_key=trade.instrument_ce,
+                    pe_key=trade.instrument_pe,
+                    trailing_sl=_rupees(trade.trailing_sl_paise or 0)
+                )
 
             if self.positions:
-                print(f"State Recovery: Successfully reloaded {len(self.positions)} open positions into ExecutionEngine.")
+                logger.info("State Recovery: Successfully reloaded %d open positions into ExecutionEngine.", len(self.positions))
             else:
-                print("State Recovery: No open positions to recover.")
+                logger.info("State Recovery: No open positions to recover.")
         except Exception as e:
-            print(f"Error recovering positions: {e}")
+            logger.error("Error recovering positions: %s", e)
         finally:
             session.close()
 
@@ -54,160 +156,375 @@ class ExecutionEngine:
         """Internal helper to persist balance to DB."""
         session = self.get_session()
         try:
-            from .database import AppSetting
-            balance_setting = session.query(AppSetting).filter_by(key='paper_balance').first()
-            if not balance_setting:
-                balance_setting = AppSetting(key='paper_balance', value=str(self.balance))
-                session.add(balance_setting)
-            else:
-                balance_setting.value = str(self.balance)
+            self._write_balance(session, self._balance_paise)
             session.commit()
         except Exception as e:
-            print(f"Error saving balance: {e}")
+            logger.error("Error saving balance: %s", e)
             session.rollback()
         finally:
             session.close()
 
+    def _write_balance(self, session, balance_paise):
+        # Stored as an exact 2-decimal rupee string, which recover_positions reads back
+        session.execute(_BALANCE_UPSERT, {'b_value': f"{_rupees(balance_paise):.2f}"})
+
     def execute_signal(self, signal, timestamp=None, index_price=None):
         """
-        Executes a signal by entering a paper trade.
+        Executes a signal by entering a paper trade, written through before returning.
+        For callers without a running event loop; on the loop use execute_signal_async.
+        """
+        write = self._queue_entry(signal, timestamp, index_price)
+        if write is None:
+            return None
+        self.flush_trades()
+        return self._entry_trade(write)
+
+    async def execute_signal_async(self, signal, timestamp=None, index_price=None):
+        """
+        execute_signal for the event loop: the entry is queued behind earlier closes and
+        written by the off-loop flush, so ids stay in event order and the loop never commits.
         """
-        if signal.index_name in self.positions:
-            return None # Already in a position for this index
+        write = self._queue_entry(signal, timestamp, index_price)
+        if write is None:
+            return None
+        write.future = asyncio.get_running_loop().create_future()
+        self._schedule_flush(0)
+        await asyncio.shield(write.future)
+        return self._entry_trade(write)
+
+    def _queue_entry(self, signal, timestamp, index_price):
+        if signal.index_name in self.positions or signal.index_name in self._opening:
+            return None # Already in (or entering) a position for this index
 
         # Dynamic Slippage Modeling: Use ask price for BUY if available, else fallback
         ask = signal.details.get('ask')
         if ask and ask > 0:
             entry_price = ask
             actual_slippage = (ask - signal.option_price) / signal.option_price
-            print(f"Dynamic Slippage (Entry): {actual_slippage:.4%}")
+            logger.debug("Dynamic Slippage (Entry): %.4f%%", actual_slippage * 100)
         else:
             entry_price = signal.option_price * (1 + self.slippage)
+        # Fills are whole paise, so the stored price and the position agree
+        entry_price = _rupees(_paise(entry_price))
 
         # Use proper lot size
-        lot_size = INDICES.get(signal.index_name, {}).get('lot_size', 1)
-        quantity = lot_size
+        quantity = _LOT_SIZES.get(signal.index_name, 1)
 
         # Turnover-based commission + fixed charge
-        entry_cost = (entry_price * quantity * self.commission_rate) + self.fixed_charge
-        self.balance -= entry_cost
-        self._save_balance()
+        entry_cost = _paise((entry_price * quantity * self.commission_rate) + self.fixed_charge)
+        self._balance_paise -= entry_cost
 
-        session = self.get_session()
-        ts = timestamp if timestamp else (signal.timestamp if signal.timestamp else datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))
-        trade = Trade(
-            timestamp=ts,
-            index_name=signal.index_name,
-            instrument_key=signal.side, # Simplified for paper trading
-            instrument_ce=signal.details.get('ce_key'),
-            instrument_pe=signal.details.get('pe_key'),
-            side='BUY',
-            price=entry_price,
-            index_price=index_price if index_price is not None else signal.index_price,
-            quantity=quantity,
-            status='OPEN',
-            pnl=0.0,
-            exit_price=0.0,
-            trailing_sl=0.0
-        )
-        session.add(trade)
-        session.commit()
-
-        self.positions[signal.index_name] = {
-            'trade_id': trade.id,
-            'timestamp': ts,
-            'side': signal.side,
-            'entry_price': entry_price, # Use the actual slippage-adjusted entry price
+        # Without a caller-supplied time SQLite stamps the row itself and RETURNING hands it back
+        row = {
+            'b_ts': timestamp or signal.timestamp,
+            'index_name': signal.index_name,
+            'instrument_key': signal.side, # Simplified for paper trading
+            'instrument_ce': signal.ce_key,
+            'instrument_pe': signal.pe_key,
+            'side': 'BUY',
+            'price': entry_price,
+            'index_price': index_price if index_price is not None else signal.index_price,
             'quantity': quantity,
-            'ce_key': signal.details.get('ce_key'),
-            'pe_key': signal.details.get('pe_key'),
+            'status': 'OPEN',
+            'pnl': 0.0,
+            'exit_price': 0.0,
             'trailing_sl': 0.0
         }
+        write = _TradeWrite(signal.index_name, None, row, entry_cost)
+        self._opening.add(signal.index_name)
+        self._pending.append(write)
+        return write
 
-        print(f"Executed BUY for {signal.index_name}: {signal.side} at {signal.option_price}")
-        session.close()
-        return trade
+    def _entry_trade(self, write):
+        """The entry's Trade once its flush ended, or None when the write failed."""
+        if write.result is None:
+            return None
+        trade_id, ts = write.result
+        row = dict(write.row)
+        del row['b_ts']
+        logger.info("Executed BUY for %s: %s at %s", write.index_name, row['instrument_key'], row['price'])
+        return Trade(id=trade_id, timestamp=ts, **row)
 
     def update_trailing_sl(self, index_name, new_sl):
         """
         Updates the trailing stop loss for an open position in the database.
         """
-        if index_name not in self.positions:
+        pos = self.positions.get(index_name)
+        # Unchanged SLs (and positions already closing) never reach the write queue
+        if pos is None or pos.closing or pos.trailing_sl == new_sl:
             return
+        pos.trailing_sl = new_sl
 
-        pos = self.positions[index_name]
-        pos['trailing_sl'] = new_sl
-
-        def do_update():
-            session = self.get_session()
-            try:
-                trade = session.query(Trade).filter_by(id=pos['trade_id']).first()
-                if trade:
-                    trade.trailing_sl = new_sl
-                    session.commit()
-            except Exception as e:
-                print(f"Error updating trailing SL in DB: {e}")
-                session.rollback()
-            finally:
-                session.close()
-
-        try:
-            loop = asyncio.get_running_loop()
-            loop.create_task(asyncio.to_thread(do_update))
-        except RuntimeError:
-            # No running loop, perform update synchronously
-            do_update()
+        # Coalesced per trade: a burst of ratchets writes only the latest SL on the next flush
+        self._pending_sl[pos.trade_id] = new_sl
+        self._schedule_flush()
 
     def close_position(self, index_name, current_price, timestamp=None, index_price=None, bid=None):
         """
-        Closes an open position.
+        Closes an open position. The exit row and the entry's CLOSED update are queued and
+        written by the next flush, so a burst of exits shares one commit. The position stays
+        in self.positions, marked closing, until that commit lands, so a failed write is
+        retried and no new entry can start on the index meanwhile.
         """
-        if index_name not in self.positions:
+        # A second exit on the next tick finds the position already closing
+        pos = self.positions.get(index_name)
+        if pos is None or pos.closing:
             return None
-
-        pos = self.positions.pop(index_name)
-        session = self.get_session()
-        trade = session.query(Trade).filter_by(id=pos['trade_id']).first()
+        pos.closing = True
 
         # Dynamic Slippage Modeling: Use bid price for SELL if available, else fallback
         if bid and bid > 0:
             exit_price = bid
             actual_slippage = (current_price - bid) / current_price
-            print(f"Dynamic Slippage (Exit): {actual_slippage:.4%}")
+            logger.debug("Dynamic Slippage (Exit): %.4f%%", actual_slippage * 100)
         else:
             exit_price = current_price * (1 - self.slippage)
+        exit_price = _rupees(_paise(exit_price))
 
-        exit_cost = (exit_price * pos['quantity'] * self.commission_rate) + self.fixed_charge
-
-        pnl_gross = (exit_price - pos['entry_price']) * pos['quantity']
-        pnl_net = pnl_gross - exit_cost
-
-        self.balance += pnl_net
-        self._save_balance()
-
-        exit_trade = Trade(
-            timestamp=timestamp if timestamp else datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None),
-            index_name=index_name,
-            instrument_key=pos['side'],
-            instrument_ce=pos.get('ce_key'),
-            instrument_pe=pos.get('pe_key'),
-            side='SELL',
-            price=exit_price,
-            index_price=index_price if index_price is not None else 0.0,
-            quantity=pos['quantity'],
-            status='CLOSED',
-            pnl=pnl_net,
-            exit_price=exit_price,
-            trailing_sl=pos.get('trailing_sl', 0.0)
-        )
+        exit_cost = (exit_price * pos.quantity * self.commission_rate) + self.fixed_charge
+
+        pnl_gross = (exit_price - pos.entry_price) * pos.quantity
+        pnl_paise = _paise(pnl_gross - exit_cost)
+        pnl_net = _rupees(pnl_paise)
+
+        self._balance_paise += pnl_paise
+
+        exit_row = self._queue_close(index_name, pos, exit_price, pnl_net, timestamp, index_price)
+        self._schedule_flush()
+
+        logger.info("Closed %s position: %s at %s, PnL: %s", index_name, pos.side, current_price, pnl_net)
+        # Unsaved copy of the exit row for callers (PnL, alerts); the row itself is written on flush
+        return Trade(**exit_row)
+
+    def close_positions_bulk(self, index_names, current_prices, timestamp=None, index_prices=None, bids=None):
+        """
+        close_position for several indices exiting on the same tick: the exit prices, costs and
+        PnL are computed as arrays, and all rows are queued for one flush.
+        """
+        names, prices, idx_prices, bid_prices, positions = [], [], [], [], []
+        for i, index_name in enumerate(index_names):
+            pos = self.positions.get(index_name)
+            if pos is None or pos.closing:
+                continue
+            pos.closing = True
+            names.append(index_name)
+            positions.append(pos)
+            prices.append(current_prices[i])
+            idx_prices.append(index_prices[i] if index_prices is not None else None)
+            bid_prices.append((bids[i] or 0.0) if bids is not None else 0.0)
+        if not positions:
+            return []
 
-        trade.status = 'CLOSED'
-        trade.pnl = exit_trade.pnl
-        trade.exit_price = exit_price
+        px = np.array(prices, dtype=float)
+        bid = np.array(bid_prices, dtype=float)
+        qty = np.array([pos.quantity for pos in positions], dtype=float)
+        entry = np.array([pos.entry_price for pos in positions], dtype=float)
 
-        session.add(exit_trade)
-        session.commit()
+        # Same formulas as close_position: bid when quoted, else the slippage model
+        exit_px = np.rint(np.where(bid > 0, bid, px * (1 - self.slippage)) * 100) / 100
+        exit_cost = (exit_px * qty * self.commission_rate) + self.fixed_charge
+        pnl_paise = [_paise(p) for p in ((exit_px - entry) * qty - exit_cost).tolist()]
+        self._balance_paise += sum(pnl_paise)
+        pnl = [_rupees(p) for p in pnl_paise]
 
-        print(f"Closed {index_name} position: {pos['side']} at {current_price}, PnL: {exit_trade.pnl}")
-        session.close()
-        return exit_trade
+        trades = []
+        for index_name, pos, current_price, exit_price, pnl_net, index_price in zip(
+            names, positions, prices, exit_px.tolist(), pnl, idx_prices
+        ):
+            exit_row = self._queue_close(index_name, pos, exit_price, pnl_net, timestamp, index_price)
+            logger.info("Closed %s position: %s at %s, PnL: %s", index_name, pos.side, current_price, pnl_net)
+            trades.append(Trade(**exit_row))
+        self._schedule_flush()
+        return trades
+
+    def _queue_close(self, index_name, pos, exit_price, pnl_net, timestamp, index_price):
+        exit_row = {
+            'timestamp': timestamp, # None: stamped by SQLite when the row is flushed
+            'index_name': index_name,
+            'instrument_key': pos.side,
+            'instrument_ce': pos.ce_key,
+            'instrument_pe': pos.pe_key,
+            'side': 'SELL',
+            'price': exit_price,
+            'index_price': index_price if index_price is not None else 0.0,
+            'quantity': pos.quantity,
+            'status': 'CLOSED',
+            'pnl': pnl_net,
+            'exit_price': exit_price,
+            'trailing_sl': pos.trailing_sl
+        }
+        self._pending.append(_TradeWrite(index_name, pos.trade_id, exit_row))
+        return exit_row
+
+    def _schedule_flush(self, delay=TRADE_FLUSH_DELAY):
+        """
+        Flushes queued writes after delay on a worker thread, so the commit (which may wait on
+        the SQLite write lock) never blocks the event loop. Without a running loop it writes through.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No running loop to flush later, write through
+            self.flush_trades()
+            return
+        if len(self._pending) >= TRADE_FLUSH_BATCH:
+            delay = 0
+        if self._flush_handle is not None:
+            if delay:
+                return
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(delay, self._start_flush, loop)
+
+    def _start_flush(self, loop):
+        if self._flush_handle is not None:
+            # A direct call (flush_trades_async) supersedes the scheduled one, so no stale timer cuts a backoff short
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is not None:
+            # One flush at a time; the running one reschedules for this batch when it ends
+            return None
+        batch = self._take_pending()
+        if batch:
+            self._flush_task = loop.create_task(self._flush_off_loop(*batch))
+        return self._flush_task
+
+    async def _flush_off_loop(self, writes, pending_sl, balance_paise):
+        try:
+            entries = await asyncio.to_thread(self._write_trades, writes, pending_sl, balance_paise)
+        finally:
+            self._flush_task = None
+        self._flush_done(entries, writes, pending_sl)
+        # Writes queued meanwhile have already waited out a commit
+        if entries is not None and (self._pending or self._pending_sl):
+            self._schedule_flush(0)
+
+    def flush_trades(self):
+        """Writes everything queued, synchronously. For callers without a running event loop."""
+        batch = self._take_pending()
+        if batch:
+            self._flush_done(self._write_trades(*batch), *batch[:2])
+
+    async def flush_trades_async(self):
+        """Writes everything queued so far through the off-loop flush and waits for it, e.g. at shutdown."""
+        while self._flush_task is not None:
+            await asyncio.shield(self._flush_task)
+        task = self._start_flush(asyncio.get_running_loop())
+        if task is not None:
+            await asyncio.shield(task)
+
+    def _take_pending(self):
+        """
+        Cancels any scheduled flush and hands over the queued writes with the balance they
+        leave behind, or None if nothing is queued.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending and not self._pending_sl:
+            return None
+        writes, self._pending = self._pending, []
+        pending_sl, self._pending_sl = self._pending_sl, {}
+        return writes, pending_sl, self._balance_paise
+
+    def _flush_done(self, entries, writes, pending_sl):
+        """
+        Applies a flush's outcome on the caller's thread: entries get their positions or are refunded,
+        committed closes release their positions, failed closes are queued again.
+        """
+        if entries is not None:
+            self._flush_failures = 0
+            results = iter(entries)
+        retry = []
+        for write in writes:
+            if write.trade_id is not None:
+                if entries is None:
+                    retry.append(write)
+                    continue
+                # The close is committed: only now does the position go away
+                pos = self.positions.get(write.index_name)
+                if pos is not None and pos.trade_id == write.trade_id:
+                    del self.positions[write.index_name]
+                continue
+            self._opening.discard(write.index_name)
+            if entries is None:
+                # The entry never happened: give back its cost
+                self._balance_paise += write.cost
+                logger.error("Entry for %s was not saved", write.index_name)
+            else:
+                write.result = trade_id, ts = next(results)
+                row = write.row
+                self.positions[write.index_name] = Position(
+                    trade_id=trade_id,
+                    timestamp=ts,
+                    side=row['instrument_key'],
+                    entry_price=row['price'], # Use the actual slippage-adjusted entry price
+                    quantity=row['quantity'],
+                    ce_key=row['instrument_ce'],
+                    pe_key=row['instrument_pe']
+                )
+            if write.future is not None and not write.future.done():
+                write.future.set_result(None)
+        if entries is not None:
+            return
+
+        # Closing positions stay in place until their rows land, so keep them queued and retry with backoff
+        self._pending[:0] = retry
+        for trade_id, sl in pending_sl.items():
+            self._pending_sl.setdefault(trade_id, sl)
+        self._flush_failures += 1
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return # Without a loop the rows go out with the next write-through
+        self._schedule_flush(min(TRADE_FLUSH_DELAY * 2 ** self._flush_failures, TRADE_FLUSH_MAX_DELAY))
+
+    def _write_trades(self, writes, pending_sl, balance_paise):
+        """
+        Writes trailing SLs, then entries and closes in queue order, and the balance in a single
+        commit. Returns the (id, timestamp) of each entry, or None if nothing was saved.
+        """
+        session = self.get_session()
+        try:
+            conn = session.connection()
+            if pending_sl:
+                conn.execute(
+                    _SL_UPDATE,
+                    [{'b_id': trade_id, 'b_sl': _paise(sl)} for trade_id, sl in pending_sl.items()]
+                )
+            entries, closes = [], []
+            for write in writes:
+                if write.trade_id is not None:
+                    closes.append(write)
+                    continue
+                # Closes queued before this entry go first, so trade ids follow event order
+                self._write_closes(conn, closes)
+                closes = []
+                entries.append(tuple(conn.execute(_ENTRY_INSERT, _paise_row(write.row)).one()))
+            self._write_closes(conn, closes)
+            if writes:
+                self._write_balance(session, balance_paise)
+            session.commit()
+            return entries
+        except Exception as e:
+            logger.error("Error saving trades: %s", e)
+            session.rollback()
+            return None
+        finally:
+            session.close()
+
+    @staticmethod
+    def _write_closes(conn, closes):
+        """Exit rows and the entries' CLOSED updates for a run of queued closes, one executemany each."""
+        if not closes:
+            return
+        conn.execute(
+            _CLOSE_UPDATE,
+            [{'b_id': write.trade_id, 'b_pnl': _paise(write.row['pnl']), 'b_exit_price': _paise(write.row['exit_price'])} for write in closes]
+        )
+        exit_rows = []
+        for write in closes:
+            row = _paise_row(write.row)
+            row['b_ts'] = row.pop('timestamp')
+            exit_rows.append(row)
+        # Exit rows closed without a timestamp take SQLite's clock at flush time
+        conn.execute(_TRADE_INSERT, exit_rows)
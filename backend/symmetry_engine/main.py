@@ -1,8 +1,9 @@
 import asyncio
 import datetime
+import itertools
 import pandas as pd
 from .data_provider import DataProvider
-from .strategy import StrategyEngine
+from .strategy import StrategyEngine, SWING_HIGH
 from .execution import ExecutionEngine
 from .risk_manager import RiskManager
 from .alerts import AlertManager
@@ -29,7 +30,8 @@ class TradingBot:
     def __init__(self, loop=None):
         self.data_provider = DataProvider(ACCESS_TOKEN)
         self.engines = {name: StrategyEngine(name, session_factory=get_session) for name in INDICES}
-        self.execution = ExecutionEngine(session_factory=get_session)
+        # Default factories: writes on the BEGIN IMMEDIATE write engine, recovery on the read-only pool
+        self.execution = ExecutionEngine()
         self.risk_manager = RiskManager()
         self.alert_manager = AlertManager()
         self.instruments = {}
@@ -62,7 +64,7 @@ class TradingBot:
                 is_pos_key = False
                 if index_name in self.execution.positions:
                     pos = self.execution.positions[index_name]
-                    if key in [pos.get('ce_key'), pos.get('pe_key')]:
+                    if key in [pos.ce_key, pos.pe_key]:
                         is_pos_key = True
 
                 if is_atm or is_pos_key:
@@ -192,7 +194,7 @@ class TradingBot:
 
             # For live, we can use current index price
             idx_data = engine.current_data.get(instruments['index'], {})
-            if self.execution.execute_signal(signal, index_price=idx_data.get('ltp')):
+            if await self.execution.execute_signal_async(signal, index_price=idx_data.get('ltp')):
                  engine.reset_trailing_sl()
                  self.last_signal_time[index_name] = minute
 
@@ -201,28 +203,27 @@ class TradingBot:
                 f"<b>SIGNAL: {signal.side}</b>\nIndex: {signal.index_name}\nPrice: {signal.index_price}"
             ))
 
-        # Check exits
-        if index_name in self.execution.positions:
-            pos = self.execution.positions[index_name]
+        # Check exits; a position whose close is still being written is left alone
+        pos = self.execution.positions.get(index_name)
+        if pos is not None and not pos.closing:
             idx_data = engine.current_data.get(instruments['index'], {})
 
             # Use the specific strikes from the position, not the current ATM
             # This ensures we check exit conditions on the strike we actually own
-            pos_ce_key = pos.get('ce_key')
-            pos_pe_key = pos.get('pe_key')
+            pos_ce_key = pos.ce_key
+            pos_pe_key = pos.pe_key
 
             ce_data = engine.current_data.get(pos_ce_key, {}) if pos_ce_key else engine.current_data.get(instruments['ce'], {})
             pe_data = engine.current_data.get(pos_pe_key, {}) if pos_pe_key else engine.current_data.get(instruments['pe'], {})
 
             # Sync trailing SL from StrategyEngine to ExecutionEngine/DB
             current_sl = engine.trailing_sl.get(index_name, 0)
-            if current_sl != pos.get('trailing_sl', 0):
+            if current_sl != pos.trailing_sl:
                 self.execution.update_trailing_sl(index_name, current_sl)
 
-            from types import SimpleNamespace
-            if engine.check_exit_condition(SimpleNamespace(**pos), idx_data, ce_data, pe_data):
+            if engine.check_exit_condition(pos, idx_data, ce_data, pe_data):
                 # Ensure we have a valid price for exit
-                active_data = ce_data if pos['side'] == 'BUY_CE' else pe_data
+                active_data = ce_data if pos.side == 'BUY_CE' else pe_data
                 exit_price = active_data.get('ltp', 0)
                 bid = active_data.get('bid', 0)
 
@@ -253,16 +254,21 @@ class TradingBot:
         session = await asyncio.to_thread(get_session)
         try:
             from .database import ReferenceLevel
-            for index_name, engine in self.engines.items():
-                # Recover last known High and Low levels for today
-                today_sod = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+            # Recover last known High and Low levels for today: one query for every index,
+            # newest first, keeping the first row seen per (index, type)
+            today_sod = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+            todays_refs = session.query(ReferenceLevel).filter(
+                ReferenceLevel.index_name.in_(list(self.engines)),
+                ReferenceLevel.type.in_(['High', 'Low']),
+                ReferenceLevel.timestamp >= today_sod
+            ).order_by(ReferenceLevel.timestamp.desc()).all()
+            latest_refs = {}
+            for ref in todays_refs:
+                latest_refs.setdefault((ref.index_name, ref.type), ref)
 
+            for index_name, engine in self.engines.items():
                 for level_type in ['High', 'Low']:
-                    last_ref = session.query(ReferenceLevel).filter(
-                        ReferenceLevel.index_name == index_name,
-                        ReferenceLevel.type == level_type,
-                        ReferenceLevel.timestamp >= today_sod
-                    ).order_by(ReferenceLevel.timestamp.desc()).first()
+                    last_ref = latest_refs.get((index_name, level_type))
 
                     if last_ref:
                         engine.reference_levels[level_type] = {
@@ -286,12 +292,12 @@ class TradingBot:
                 print("State Recovery: Step 3/3 - Warming up historical data for active position strikes...")
                 if index_name in self.execution.positions:
                     pos = self.execution.positions[index_name]
-                    if pos.get('trailing_sl'):
-                        engine.trailing_sl[index_name] = pos['trailing_sl']
-                        print(f"State Recovery: Recovered trailing SL for {index_name}: {pos['trailing_sl']}")
+                    if pos.trailing_sl:
+                        engine.trailing_sl[index_name] = pos.trailing_sl
+                        print(f"State Recovery: Recovered trailing SL for {index_name}: {pos.trailing_sl}")
 
                     # Parallelize history fetching for position strikes
-                    pos_keys = [pos.get(k) for k in ['ce_key', 'pe_key'] if pos.get(k)]
+                    pos_keys = [k for k in (pos.ce_key, pos.pe_key) if k]
                     if pos_keys:
                         print(f"State Recovery: Fetching history for position strikes {pos_keys}")
                         hist_results = await asyncio.gather(*[self.data_provider.get_historical_data(k, interval=1) for k in pos_keys])
@@ -337,8 +343,8 @@ class TradingBot:
                     # Protect active position strikes from unsubscription
                     protected_keys = []
                     for pos in self.execution.positions.values():
-                        if pos.get('ce_key'): protected_keys.append(pos['ce_key'])
-                        if pos.get('pe_key'): protected_keys.append(pos['pe_key'])
+                        if pos.ce_key: protected_keys.append(pos.ce_key)
+                        if pos.pe_key: protected_keys.append(pos.pe_key)
 
                     if old_details:
                         old_keys = [old_details['ce'], old_details['pe']]
@@ -398,43 +404,55 @@ class TradingBot:
 
                 combined_5m = combined.resample('5min', on='timestamp').agg(agg_dict).dropna()
 
-                for _, row in combined_5m.iterrows():
+                for o5, h5, l5, c5 in combined_5m[['open_idx', 'high_idx', 'low_idx', 'close_idx']].itertuples(index=False, name=None):
                     engine.update_candle(details['index'], {
-                        'open': row['open_idx'], 'high': row['high_idx'],
-                        'low': row['low_idx'], 'close': row['close_idx']
+                        'open': o5, 'high': h5,
+                        'low': l5, 'close': c5
                     }, interval=5)
 
-                for i in range(SWING_WINDOW + 2, len(combined)):
-                    subset = combined.iloc[:i]
-                    current = combined.iloc[i]
+                # Swings for every prefix in one pass; entry i is identify_swing(combined[:i])
+                swing_types, swing_prices = engine.identify_swings(combined[['open_idx', 'high_idx', 'low_idx', 'close_idx']].rename(
+                    columns={'open_idx': 'open', 'high_idx': 'high', 'low_idx': 'low', 'close_idx': 'close'}))
+
+                # Plain tuples per row rather than a Series per iloc; the option columns are fixed per frame
+                has_ce = 'close_ce' in combined.columns
+                has_pe = 'close_pe' in combined.columns
+                columns = ['timestamp', 'open_idx', 'high_idx', 'low_idx', 'close_idx']
+                if has_ce: columns += ['open_ce', 'high_ce', 'low_ce', 'close_ce']
+                if has_pe: columns += ['open_pe', 'high_pe', 'low_pe', 'close_pe']
+                rows = combined[columns].itertuples(index=False, name=None)
+
+                start = SWING_WINDOW + 2
+                for i, row in enumerate(itertools.islice(rows, start, None), start):
+                    ts, o, h, l, c = row[:5]
+                    ce = row[5:9] if has_ce else None
+                    pe = row[-4:] if has_pe else None
 
                     # Update engine candle history
                     engine.update_candle(details['index'], {
-                        'open': current['open_idx'], 'high': current['high_idx'],
-                        'low': current['low_idx'], 'close': current['close_idx']
+                        'open': o, 'high': h,
+                        'low': l, 'close': c
                     })
-                    if 'close_ce' in current:
+                    if ce:
                         engine.update_candle(details['ce'], {
-                            'open': current['open_ce'], 'high': current['high_ce'],
-                            'low': current['low_ce'], 'close': current['close_ce']
+                            'open': ce[0], 'high': ce[1],
+                            'low': ce[2], 'close': ce[3]
                         })
-                    if 'close_pe' in current:
+                    if pe:
                         engine.update_candle(details['pe'], {
-                            'open': current['open_pe'], 'high': current['high_pe'],
-                            'low': current['low_pe'], 'close': current['close_pe']
+                            'open': pe[0], 'high': pe[1],
+                            'low': pe[2], 'close': pe[3]
                         })
 
                     # Identify Swings
-                    swing_data = subset.rename(columns={'open_idx': 'open', 'high_idx': 'high', 'low_idx': 'low', 'close_idx': 'close'})
-                    swing = engine.identify_swing(swing_data[['open', 'high', 'low', 'close']])
-                    if swing:
+                    if swing_types[i]:
                         engine.save_reference_level(
-                            swing['type'],
-                            current['close_idx'],
-                            current.get('close_ce', 0),
-                            current.get('close_pe', 0),
+                            'High' if swing_types[i] == SWING_HIGH else 'Low',
+                            c,
+                            ce[3] if ce else 0,
+                            pe[3] if pe else 0,
                             details['ce'], details['pe'],
-                            timestamp=current['timestamp'].to_pydatetime()
+                            timestamp=ts.to_pydatetime()
                         )
 
                 # Save historical candles to DB if not present (Optimized: offload to thread)
@@ -473,8 +491,8 @@ class TradingBot:
 
         # Ensure recovered position keys are subscribed
         for pos in self.execution.positions.values():
-            if pos.get('ce_key'): all_keys.append(pos['ce_key'])
-            if pos.get('pe_key'): all_keys.append(pos['pe_key'])
+            if pos.ce_key: all_keys.append(pos.ce_key)
+            if pos.pe_key: all_keys.append(pos.pe_key)
 
         all_keys = list(set(all_keys)) # Deduplicate
 
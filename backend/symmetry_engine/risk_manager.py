@@ -11,22 +11,23 @@ class RiskManager:
         """
         Recovers today's realized PnL from the database.
         """
-        from .database import get_session, Trade
+        from .database import get_read_session, Trade
         from sqlalchemy import func
         import datetime
 
-        session = get_session()
+        session = get_read_session()
         try:
             today = datetime.date.today()
             # Start of day UTC
             sod = datetime.datetime.combine(today, datetime.time.min)
 
-            pnl_sum = session.query(func.sum(Trade.pnl)).filter(
+            # Summed in whole paise, exactly
+            pnl_sum = session.query(func.sum(Trade.pnl_paise)).filter(
                 Trade.status == 'CLOSED',
                 Trade.timestamp >= sod
             ).scalar()
 
-            self.daily_pnl = float(pnl_sum) if pnl_sum else 0.0
+            self.daily_pnl = pnl_sum / 100 if pnl_sum else 0.0
             self.current_date = today
             if self.daily_pnl != 0:
                 print(f"State Recovery: Recovered today's realized PnL: {self.daily_pnl:.2f}")
@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import datetime
 from .database import get_session, ReferenceLevel, Signal
 from config import (
@@ -7,6 +8,56 @@ from config import (
     SYMMETRY_INDICES as INDICES,
     SYMMETRY_SL_TRAILING as SL_TRAILING
 )
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+SWING_HIGH = 1
+SWING_LOW = -1
+CANDLE_HISTORY_LIMIT = 100 # 1m candles kept per instrument
+
+def _scan_swings(open_, high, low, close, window, swing_type, swing_price):
+    """
+    Fills swing_type[n]/swing_price[n] with what identify_swing returns for the first n
+    candles, for every n. Same arithmetic in the same order (14-bar ATR, magnitude
+    filter, 3-candle pullback), so results match the per-call method exactly.
+    """
+    n_bars = len(close)
+    tr = np.zeros(n_bars)
+    for j in range(1, n_bars):
+        pc = close[j - 1]
+        tr[j] = max(high[j] - low[j], abs(high[j] - pc), abs(low[j] - pc))
+
+    for n in range(max(window, 4), n_bars + 1):
+        # calculate_atr over candles[:n]: mean of the last min(14, n - 1) true ranges
+        period = min(14, n - 1)
+        atr = 0.0
+        for j in range(n - period, n):
+            atr += tr[j]
+        atr = atr / period
+        atr_threshold = atr * 1.5 if atr > 0 else 5.0
+
+        current_high = high[n - window]
+        current_low = low[n - window]
+        for j in range(n - window + 1, n):
+            if high[j] > current_high: current_high = high[j]
+            if low[j] < current_low: current_low = low[j]
+
+        window_start_price = open_[n - window]
+        if abs(current_high - window_start_price) < atr_threshold and abs(current_low - window_start_price) < atr_threshold:
+            continue
+
+        c, p, pp, ppp = n - 1, n - 2, n - 3, n - 4
+        if high[ppp] == current_high and high[p] < high[ppp] and high[c] < high[p] and high[pp] < high[ppp]:
+            swing_type[n] = SWING_HIGH
+            swing_price[n] = current_high
+        elif low[ppp] == current_low and low[p] > low[ppp] and low[c] > low[p] and low[pp] > low[ppp]:
+            swing_type[n] = SWING_LOW
+            swing_price[n] = current_low
+
+if njit:
+    _scan_swings = njit(cache=True)(_scan_swings)
 
 class StrategyEngine:
     """
@@ -44,7 +95,7 @@ class StrategyEngine:
     def update_candle(self, instrument_key, candle, interval=1):
         """Update historical candle data."""
         target_history = self.candle_history if interval == 1 else self.candle_history_5m
-        limit = 100 if interval == 1 else 50
+        limit = CANDLE_HISTORY_LIMIT if interval == 1 else 50
 
         if instrument_key not in target_history:
             target_history[instrument_key] = []
@@ -59,6 +110,27 @@ class StrategyEngine:
         if len(target_history[instrument_key]) > limit:
             target_history[instrument_key].pop(0)
 
+    def update_option_bars(self, keys, opens, highs, lows, closes, ois, oi_deltas):
+        """Records one bar for several option keys: the same effect as update_data + update_candle per key."""
+        self.option_bar_updater(keys)(opens, highs, lows, closes, ois, oi_deltas)
+
+    def option_bar_updater(self, keys):
+        """
+        update_option_bars specialised to a fixed list of keys. The per-key history lists are
+        resolved once, so replaying many bars for the same chain only appends.
+        """
+        current_data = self.current_data
+        targets = [(key, self.candle_history.setdefault(key, [])) for key in keys]
+
+        def update(opens, highs, lows, closes, ois, oi_deltas):
+            for (key, history), o, h, l, c, oi, oi_delta in zip(targets, opens, highs, lows, closes, ois, oi_deltas):
+                current_data[key] = {'ltp': c, 'oi': oi, 'oi_delta': oi_delta}
+                history.append({'open': o, 'high': h, 'low': l, 'close': c, 'instrument_key': key})
+                if len(history) > CANDLE_HISTORY_LIMIT:
+                    history.pop(0)
+
+        return update
+
     def calculate_atr(self, instrument_key=None, period=14, history=None):
         """Calculate Average True Range."""
         if history is None:
@@ -176,6 +248,23 @@ class StrategyEngine:
 
         return None
 
+    def identify_swings(self, candles):
+        """
+        Batch form of identify_swing for replaying history: returns (swing_type, swing_price)
+        arrays of length len(candles) + 1, where entry n is the swing identify_swing
+        would report for candles[:n] (SWING_HIGH, SWING_LOW or 0).
+        """
+        window = getattr(self, 'swing_window', 15)
+        swing_type = np.zeros(len(candles) + 1, dtype=np.int64)
+        swing_price = np.zeros(len(candles) + 1)
+        if len(candles) >= window:
+            _scan_swings(
+                candles['open'].to_numpy(dtype=np.float64), candles['high'].to_numpy(dtype=np.float64),
+                candles['low'].to_numpy(dtype=np.float64), candles['close'].to_numpy(dtype=np.float64),
+                window, swing_type, swing_price
+            )
+        return swing_type, swing_price
+
     def check_decay_filter(self, current_index_price, current_option_price, ref_level):
         """
         Phase II: The Pullback & Decay Filter (Anti-Theta)
@@ -380,11 +469,10 @@ class StrategyEngine:
             if self.check_guardrails(side, idx_data, ce_data, pe_data, ref_level):
                 return None
 
-            details['ce_key'] = instruments['ce']
-            details['pe_key'] = instruments['pe']
             return Signal(index_name=self.index_name, side='BUY_CE' if is_bull else 'BUY_PE',
                           index_price=current_idx_price, option_price=active_opt_data['ltp'],
-                          confluence_score=score, details=details)
+                          confluence_score=score, ce_key=instruments['ce'], pe_key=instruments['pe'],
+                          details=details)
         return None
 
     def check_exit_condition(self, position, idx_data, ce_data, pe_data, current_time=None):
@@ -554,6 +642,25 @@ class StrategyEngine:
 
         return True
 
+    def trend_states(self, opens, closes):
+        """
+        get_trend_state('BUY_CE') and ('BUY_PE') after each of a run of 1m index candles is fed,
+        as two bool arrays. Reference levels are taken as fixed for the whole run.
+        """
+        idx_key = INDICES[self.index_name]['index_key']
+        ltp = np.asarray(closes, dtype=np.float64)
+
+        # The oldest open left in the rolling history once candle k of the run is appended
+        seq = np.asarray([c['open'] for c in self.candle_history.get(idx_key, [])] + list(opens), dtype=np.float64)
+        pos = len(seq) - len(ltp) + np.arange(len(ltp))
+        oldest_open = seq[np.maximum(pos - (CANDLE_HISTORY_LIMIT - 1), 0)]
+
+        ref_high = self.reference_levels.get('High')
+        ref_low = self.reference_levels.get('Low')
+        ce = ltp > ref_high['index_price'] if ref_high else ltp > oldest_open
+        pe = ltp < ref_low['index_price'] if ref_low else ltp < oldest_open
+        return ce, pe
+
     def save_reference_level(self, level_type, index_price, ce_price, pe_price, ce_key, pe_key, timestamp=None):
         session = self.get_session()
         ref = ReferenceLevel(
@@ -0,0 +1,168 @@
+import sys
+import os
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Point the symmetry DB at a scratch file before the database module builds its engines
+import config
+if 'symmetry_engine.database' not in sys.modules:
+    config.SYMMETRY_DB_PATH = os.path.join(tempfile.mkdtemp(), 'trading_engine.db')
+
+from symmetry_engine import database
+from symmetry_engine import execution
+from symmetry_engine.execution import ExecutionEngine, TRADE_FLUSH_DELAY, TRADE_FLUSH_MAX_DELAY
+
+database.init_db()
+
+
+def make_signal(index_name, price=100.0):
+    return SimpleNamespace(index_name=index_name, ce_key='CE', pe_key='PE', details={}, option_price=price,
+                           side='BUY_CE', timestamp=None, index_price=22000.0)
+
+
+def trade_rows():
+    session = database.get_session()
+    try:
+        return [(t.index_name, t.side, t.status) for t in session.query(database.Trade).order_by(database.Trade.id)]
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def engine():
+    session = database.get_session()
+    session.query(database.Trade).delete()
+    session.commit()
+    session.close()
+    return ExecutionEngine()
+
+
+def count_writes(engine, failures=0):
+    """Wraps _write_trades to record each batch and fail the first `failures` calls."""
+    calls = []
+    write_trades = engine._write_trades
+
+    def wrapper(writes, pending_sl, balance_paise):
+        calls.append([(w.index_name, w.trade_id is None) for w in writes])
+        if len(calls) <= failures:
+            return None
+        return write_trades(writes, pending_sl, balance_paise)
+
+    engine._write_trades = wrapper
+    return calls
+
+
+def test_close_burst_shares_one_flush(engine):
+    async def run():
+        await engine.execute_signal_async(make_signal('NIFTY'))
+        await engine.execute_signal_async(make_signal('BANKNIFTY'))
+        calls = count_writes(engine)
+        engine.close_position('NIFTY', 110.0)
+        engine.close_position('BANKNIFTY', 90.0)
+        await engine.flush_trades_async()
+        return calls
+
+    calls = asyncio.run(run())
+    assert calls == [[('NIFTY', False), ('BANKNIFTY', False)]]
+    assert engine.positions == {}
+    assert trade_rows() == [('NIFTY', 'BUY', 'CLOSED'), ('BANKNIFTY', 'BUY', 'CLOSED'),
+                            ('NIFTY', 'SELL', 'CLOSED'), ('BANKNIFTY', 'SELL', 'CLOSED')]
+
+
+def test_entries_and_closes_keep_event_order(engine):
+    async def run():
+        await engine.execute_signal_async(make_signal('NIFTY'))
+        engine.close_position('NIFTY', 110.0)
+        # Re-entry waits for the close to commit, then is written after it
+        assert await engine.execute_signal_async(make_signal('NIFTY')) is None
+        await engine.flush_trades_async()
+        return await engine.execute_signal_async(make_signal('NIFTY'))
+
+    trade = asyncio.run(run())
+    assert trade is not None
+    assert trade_rows() == [('NIFTY', 'BUY', 'CLOSED'), ('NIFTY', 'SELL', 'CLOSED'), ('NIFTY', 'BUY', 'OPEN')]
+    assert engine.positions['NIFTY'].trade_id == trade.id
+
+
+def test_failed_entry_is_refunded(engine):
+    async def run():
+        count_writes(engine, failures=1)
+        balance = engine.balance
+        trade = await engine.execute_signal_async(make_signal('NIFTY'))
+        return trade, balance
+
+    trade, balance = asyncio.run(run())
+    assert trade is None
+    assert engine.balance == balance
+    assert 'NIFTY' not in engine.positions and not engine._opening
+    assert trade_rows() == []
+
+
+def test_failed_close_is_retried_with_backoff(engine):
+    async def run():
+        await engine.execute_signal_async(make_signal('NIFTY'))
+        calls = count_writes(engine, failures=2)
+        engine.close_position('NIFTY', 110.0)
+        await engine.flush_trades_async()
+        # The close stays queued and the position stays, marked closing
+        assert engine._flush_failures == 1 and len(engine._pending) == 1
+        assert engine.positions['NIFTY'].closing
+        assert engine._flush_handle.when() - asyncio.get_running_loop().time() <= TRADE_FLUSH_DELAY * 2
+        # Second failure doubles the delay, then the retry after it lands
+        await asyncio.sleep(TRADE_FLUSH_DELAY * 3)
+        assert engine._flush_failures == 2
+        await asyncio.sleep(TRADE_FLUSH_DELAY * 8)
+        return calls
+
+    calls = asyncio.run(run())
+    assert len(calls) == 3
+    assert engine._flush_failures == 0 and engine._pending == []
+    assert engine.positions == {}
+    assert trade_rows() == [('NIFTY', 'BUY', 'CLOSED'), ('NIFTY', 'SELL', 'CLOSED')]
+
+
+def test_retry_backoff_is_capped():
+    engine = ExecutionEngine()
+    engine._flush_failures = 20
+    delays = []
+    engine._schedule_flush = delays.append
+
+    async def run():
+        engine._flush_done(None, [], {1: 95.0})
+
+    asyncio.run(run())
+    assert delays == [TRADE_FLUSH_MAX_DELAY]
+    assert engine._pending_sl == {1: 95.0}
+
+
+def test_closing_position_ignores_repeat_exits_and_sl(engine):
+    async def run():
+        await engine.execute_signal_async(make_signal('NIFTY'))
+        first = engine.close_position('NIFTY', 110.0)
+        balance = engine.balance
+        assert engine.close_position('NIFTY', 120.0) is None
+        assert engine.close_positions_bulk(['NIFTY'], [120.0]) == []
+        engine.update_trailing_sl('NIFTY', 105.0)
+        assert engine._pending_sl == {} and engine.balance == balance
+        await engine.flush_trades_async()
+        return first
+
+    first = asyncio.run(run())
+    assert first.pnl > 0
+    assert engine.positions == {}
+
+
+def test_sync_callers_write_through(engine):
+    trade = engine.execute_signal(make_signal('NIFTY'))
+    assert trade is not None and engine.positions['NIFTY'].trade_id == trade.id
+    engine.update_trailing_sl('NIFTY', 99.5)
+    engine.close_position('NIFTY', 101.0)
+    assert engine.positions == {}
+    assert trade_rows() == [('NIFTY', 'BUY', 'CLOSED'), ('NIFTY', 'SELL', 'CLOSED')]
+    assert execution._paise(engine.balance) == engine._balance_paise
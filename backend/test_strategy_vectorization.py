@@ -0,0 +1,87 @@
+import sys
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Point the symmetry DB at a scratch file before the database module builds its engines
+import config
+if 'symmetry_engine.database' not in sys.modules:
+    config.SYMMETRY_DB_PATH = os.path.join(tempfile.mkdtemp(), 'trading_engine.db')
+
+from symmetry_engine.strategy import StrategyEngine, SWING_HIGH, SWING_LOW, CANDLE_HISTORY_LIMIT
+
+
+def random_candles(n, seed, step=4.0):
+    """A paise-rounded random walk, so equal highs/lows (the swing tie cases) actually occur."""
+    rng = np.random.default_rng(seed)
+    close = np.round(22000 + np.cumsum(rng.normal(0, step, n)), 1)
+    open_ = np.round(np.r_[close[0], close[:-1]] + rng.normal(0, step / 4, n), 1)
+    high = np.round(np.maximum(open_, close) + np.abs(rng.normal(0, step, n)), 1)
+    low = np.round(np.minimum(open_, close) - np.abs(rng.normal(0, step, n)), 1)
+    return pd.DataFrame({'open': open_, 'high': high, 'low': low, 'close': close})
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('window', [4, 15])
+def test_identify_swings_matches_identify_swing_on_every_prefix(seed, window):
+    engine = StrategyEngine('NIFTY')
+    engine.swing_window = window
+    candles = random_candles(300, seed)
+
+    swing_type, swing_price = engine.identify_swings(candles)
+
+    assert len(swing_type) == len(candles) + 1
+    kinds = {'High': SWING_HIGH, 'Low': SWING_LOW}
+    for n in range(len(candles) + 1):
+        swing = engine.identify_swing(candles.iloc[:n])
+        if swing is None:
+            assert swing_type[n] == 0, n
+        else:
+            assert swing_type[n] == kinds[swing['type']], n
+            assert swing_price[n] == swing['price'], n
+    # The walk must exercise both branches, or the comparison proves little
+    assert (swing_type == SWING_HIGH).any() and (swing_type == SWING_LOW).any()
+
+
+def test_identify_swings_short_history():
+    engine = StrategyEngine('NIFTY')
+    swing_type, swing_price = engine.identify_swings(random_candles(engine.swing_window - 1, 0))
+    assert not swing_type.any() and not swing_price.any()
+
+
+def zigzag_candles(n):
+    """Opens alternate around a flat close, so which open is oldest in the history decides every state."""
+    open_ = np.where(np.arange(n) % 2, 21950.0, 22050.0)
+    close = np.full(n, 22000.0)
+    return pd.DataFrame({'open': open_, 'high': open_ + 60, 'low': open_ - 60, 'close': close})
+
+
+@pytest.mark.parametrize('history_len', [0, 3, CANDLE_HISTORY_LIMIT - 5, CANDLE_HISTORY_LIMIT])
+@pytest.mark.parametrize('levels', ['none', 'high', 'both'])
+@pytest.mark.parametrize('make_candles', [lambda n: random_candles(n, 7), zigzag_candles])
+def test_trend_states_matches_get_trend_state(history_len, levels, make_candles):
+    engine = StrategyEngine('NIFTY')
+    idx_key = config.SYMMETRY_INDICES['NIFTY']['index_key']
+    history = make_candles(history_len + 30)
+    for row in history.iloc[:history_len].to_dict('records'):
+        engine.update_candle(idx_key, row)
+    if levels in ('high', 'both'):
+        engine.reference_levels['High'] = {'index_price': float(history['close'].median())}
+    if levels == 'both':
+        engine.reference_levels['Low'] = {'index_price': float(history['close'].quantile(0.3))}
+
+    run = history.iloc[history_len:]
+    ce, pe = engine.trend_states(run['open'].to_numpy(), run['close'].to_numpy())
+
+    # Feed the same candles one by one, as the live loop does, and ask after each
+    for k, row in enumerate(run.to_dict('records')):
+        engine.update_candle(idx_key, row)
+        engine.update_data(idx_key, {'ltp': row['close']})
+        assert ce[k] == engine.get_trend_state('BUY_CE'), k
+        assert pe[k] == engine.get_trend_state('BUY_PE'), k
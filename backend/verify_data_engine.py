@@ -14,7 +14,8 @@ class MockEncoder(json.JSONEncoder):
 
 # Patch sys.modules to avoid real DB and other imports
 sys.modules['db'] = MagicMock()
-sys.modules['db.local_db'] = MagicMock(db=MagicMock(), LocalDBJSONEncoder=MockEncoder)
+sys.modules['db.local_db'] = MagicMock(db=MagicMock(), LocalDBJSONEncoder=MockEncoder,
+                                         to_json_native=lambda d: json.loads(json.dumps(d, cls=MockEncoder)))
 sys.modules['core.provider_registry'] = MagicMock()
 
 # Configure logging
@@ -58,7 +59,9 @@ def test_data_engine_logic():
     }
 
     # Patch time.time to bypass throttling
+    # Rooms without subscribers are skipped, so treat every room as watched
     with patch('time.time', return_value=2000000000.0), \
+         patch('core.data_engine.has_room_subscribers', return_value=True), \
          patch('core.data_engine.emit_event') as mock_emit:
         on_message(json.dumps(tick_msg))
 